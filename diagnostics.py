@@ -0,0 +1,156 @@
+from micropython import const
+from machine import SPI
+import gc
+import sys
+import time
+import serial_flash_accessor
+from serial_flash_accessor.suspend_scheduler import SuspendScheduler
+
+_SPI_ID = const(2)
+_CS_PIN_ID = 'Y5'
+_MISO_PIN_ID = 'Y7'
+_CHECK_PAGES = const(16)
+_LATENCY_ERASE_SIZE = const(262144)
+_LATENCY_READ_SIZE = const(256)
+_LATENCY_READ_INTERVAL_US = const(5000)
+
+def check_allocations(hint: str = None, address: int = None) -> bool:
+    # Checks that programming, reading and polling a page allocate nothing on the heap, so long
+    # runs do not stop for garbage collection. _CHECK_PAGES pages at address (the end of the chip
+    # by default) are erased and overwritten.
+    flash = serial_flash_accessor.create_serial_flash(SPI(_SPI_ID), _CS_PIN_ID, hint, _MISO_PIN_ID)
+    if flash == None:
+        print('Unsupported flash memory')
+        return False
+    print('Name     : {0}'.format(flash.get_name()))
+    if flash.is_protect():
+        print('The flash memory is write protected.')
+        flash.close()
+        return False
+    page_size = flash.get_page_size()
+    length = _CHECK_PAGES * page_size
+    if address == None:
+        sector_size = flash.get_sector_size()
+        address = (flash.get_capacity() - length) // sector_size * sector_size
+    page = bytearray(page_size)
+    for index in range(page_size):
+        page[index] = index & 0xFF
+    read_buffer = bytearray(page_size)
+    flash.erase_range(address, length)
+    flash.set_skip_blank(True)
+
+    results = []
+    gc.collect()
+    gc.disable()
+    try:
+        for name in ('write', 'pipelined write', 'read', 'status poll'):
+            if name == 'pipelined write':
+                flash.erase_range(address, length)
+                flash.set_pipelined(True)
+            # The first page warms up anything created on first use.
+            _run(flash, name, address, page, read_buffer)
+            start = gc.mem_alloc()
+            for index in range(1, _CHECK_PAGES):
+                _run(flash, name, address + index * page_size, page, read_buffer)
+            flash.set_pipelined(False)
+            results.append((name, (gc.mem_alloc() - start) // (_CHECK_PAGES - 1)))
+    finally:
+        flash.set_pipelined(False)
+        gc.enable()
+
+    result = True
+    for name, allocated in results:
+        print('Allocated: {0} bytes per page ({1})'.format(allocated, name))
+        if allocated != 0:
+            result = False
+    if read_buffer != page:
+        print('Verify error')
+        result = False
+    flash.close()
+    print('Completed.' if result else 'Failed.')
+    return result
+
+def _run(flash, name: str, address: int, page: bytearray, read_buffer: bytearray):
+    if name == 'write' or name == 'pipelined write':
+        flash.write(address, page)
+    elif name == 'read':
+        flash.read(address, read_buffer)
+    else:
+        flash.is_protect()
+
+def check_read_latency(hint: str = None, address: int = None, read_address: int = 0) -> bool:
+    # Erases _LATENCY_ERASE_SIZE bytes at address (the end of the chip by default) in 64 KB
+    # blocks while reading a page at read_address every _LATENCY_READ_INTERVAL_US, once waiting
+    # for the erase and once with SuspendScheduler suspending it, and prints the worst-case and
+    # average read latency of both.
+    flash = serial_flash_accessor.create_serial_flash(SPI(_SPI_ID), _CS_PIN_ID, hint, _MISO_PIN_ID)
+    if flash == None:
+        print('Unsupported flash memory')
+        return False
+    print('Name     : {0}'.format(flash.get_name()))
+    if flash.is_protect():
+        print('The flash memory is write protected.')
+        flash.close()
+        return False
+    length = min(_LATENCY_ERASE_SIZE, flash.get_capacity() // 2)
+    if address == None:
+        address = (flash.get_capacity() - length) // _LATENCY_ERASE_SIZE * _LATENCY_ERASE_SIZE if length == _LATENCY_ERASE_SIZE else flash.get_capacity() - length
+    expected = bytearray(_LATENCY_READ_SIZE)
+    flash.read(read_address, expected)
+    read_buffer = bytearray(_LATENCY_READ_SIZE)
+
+    result = True
+    for suspend in (False, True):
+        scheduler = SuspendScheduler(flash, suspend)
+        scheduler.erase_range(address, length)
+        start = time.ticks_ms()
+        while True:
+            wait_us = scheduler.poll()
+            if wait_us == 0:
+                break
+            time.sleep_us(min(wait_us, _LATENCY_READ_INTERVAL_US))
+            scheduler.read(read_address, read_buffer)
+            if read_buffer != expected:
+                result = False
+        elapsed = time.ticks_diff(time.ticks_ms(), start)
+        scheduler.close()
+        reads, suspended_reads, total_us, max_us = scheduler.get_read_stats()
+        print('Latency  : max {0} us, average {1} us, {2} reads ({3} suspended), erase {4} ms ({5})'.format(
+            max_us, total_us // max(1, reads), reads, suspended_reads, elapsed, 'suspend' if suspend else 'wait'))
+    flash.close()
+    if not result:
+        print('Verify error')
+    print('Completed.' if result else 'Failed.')
+    return result
+
+def measure_import(hint: str = None):
+    # Prints the time and heap (gc.mem_free) taken by importing serial_flash_accessor and then
+    # serial_flash_writer, by detecting the chip, which imports its driver, and by importing the
+    # other drivers as the package did before drivers were loaded lazily. The package modules are
+    # removed from sys.modules first; run it right after a reset for figures like those of a
+    # fresh boot.
+    for name in [name for name in sys.modules if name.startswith('serial_flash_')]:
+        del sys.modules[name]
+    gc.collect()
+    start = _measure_point()
+    package = __import__('serial_flash_accessor')
+    point = _print_measure('import', start)
+    __import__('serial_flash_writer')
+    point = _print_measure('import serial_flash_writer', point)
+    flash = package.create_serial_flash(SPI(_SPI_ID), _CS_PIN_ID, hint, _MISO_PIN_ID)
+    point = _print_measure('detect ({0})'.format(flash.get_name() if flash != None else 'unsupported'), point)
+    for driver in package._DRIVERS + package._NAMED_DRIVERS + (package._SFDP_DRIVER,):
+        __import__(driver[1])
+    _print_measure('all other drivers', point)
+    print('Loaded   : {0}'.format(', '.join(sorted([name for name in sys.modules if name.startswith('serial_flash_accessor.')]))))
+
+def _measure_point():
+    gc.collect()
+    return (time.ticks_us(), gc.mem_free())
+
+def _print_measure(name: str, start):
+    end_us = time.ticks_us()
+    gc.collect()
+    point = (end_us, gc.mem_free())
+    print('{0:<28}: {1} us, {2} bytes'.format(name, time.ticks_diff(end_us, start[0]), start[1] - point[1]))
+    return _measure_point()
@@ -0,0 +1,198 @@
+# Throughput benchmark for serial_flash_accessor on the simulated chips (see flash_simulator.py).
+#
+#   python host/benchmark.py                    compare against benchmark_baseline.json
+#   python host/benchmark.py --update-baseline  store the current figures as the new baseline
+#
+# Each case erases the image range, writes the image in buffer_size chunks and verifies it with
+# digest_flash, all in virtual time. Reading and hashing each chunk on the device is charged as
+# HOST_US_PER_KB of virtual time; pipelined cases do that work while the last page programs.
+# The <chip>/read cases dump the whole image with read_chunks, as to_file does, and report
+# bytes/s against the SPI line rate. The <chip>/gang4 cases write the image to four chips on one
+# bus with GangWriter and report bytes/s summed over the chips. Exits with status 1 if a case
+# gets slower, issues more SPI transactions per KB or more busy polls than the baseline allows,
+# or if the chip contents or the protocol are wrong.
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+
+import flash_simulator
+
+_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# (chip, hint, image size)
+CASES = [
+    ('25AA640A', '25AA640A', 4 * 1024),
+    ('SST25VF032B', None, 64 * 1024),
+    ('MX25x40xx', None, 64 * 1024),
+    ('W25Q32JV-IQ', None, 64 * 1024),
+    ('GD25Q32C', None, 64 * 1024),
+]
+BUFFER_SIZES = [256, 1024, 4096]
+# File read plus SHA-256 of one KB on a pyboard-class device.
+HOST_US_PER_KB = 1500
+
+def make_image(size: int) -> bytes:
+    # Random data with a blank tail, like a padded asset image.
+    generator = random.Random(size)
+    data = bytes(generator.getrandbits(8) for _ in range(size * 3 // 4))
+    return data + b'\xff' * (size - len(data))
+
+def run_case(chip: str, hint: str, image: bytes, buffer_size: int, pipelined: bool) -> dict:
+    simulated_flash, bus = flash_simulator.simulate(chip)
+    import machine
+    import serial_flash_accessor
+    from serial_flash_accessor.flash_digest import digest_flash
+    flash = serial_flash_accessor.create_serial_flash(machine.SPI(2), 'Y5', hint, 'Y7')
+    simulated_flash.reset_stats()
+    bus.reset_stats()
+    clock = flash_simulator.CLOCK
+    start = clock.now_us
+
+    flash.reset_write_stats()
+    flash.erase_range(0, len(image))
+    flash.set_skip_blank(True)
+    flash.set_pipelined(pipelined)
+    buffer = memoryview(bytearray(buffer_size))
+    for address in range(0, len(image), buffer_size):
+        length = min(buffer_size, len(image) - address)
+        buffer[:length] = image[address: address + length]
+        flash.write(address, buffer[:length])
+        clock.advance(HOST_US_PER_KB * length / 1024)
+    flash.set_pipelined(False)
+    verified = digest_flash(flash, 0, len(image), 'sha256', 0, buffer_size) == [hashlib.sha256(image).digest()]
+
+    elapsed_us = clock.now_us - start
+    return {
+        'bytes_per_second': round(len(image) * 1000000 / elapsed_us),
+        'transactions_per_kb': round(bus.transactions * 1024 / len(image), 1),
+        'busy_polls': simulated_flash.busy_polls,
+        'ok': verified and bytes(simulated_flash.memory[:len(image)]) == image and not simulated_flash.protocol_errors,
+        'errors': simulated_flash.protocol_errors[:3],
+    }
+
+def run_read_case(chip: str, hint: str, image: bytes, chunk_size: int) -> dict:
+    simulated_flash, bus = flash_simulator.simulate(chip)
+    import machine
+    import serial_flash_accessor
+    flash = serial_flash_accessor.create_serial_flash(machine.SPI(2), 'Y5', hint, 'Y7')
+    simulated_flash.memory[:len(image)] = image
+    simulated_flash.reset_stats()
+    bus.reset_stats()
+    clock = flash_simulator.CLOCK
+    start = clock.now_us
+    digest = hashlib.sha256()
+    for chunk in flash.read_chunks(0, len(image), chunk_size):
+        digest.update(chunk)
+    elapsed_us = clock.now_us - start
+    return {
+        'bytes_per_second': round(len(image) * 1000000 / elapsed_us),
+        'line_rate': round(bus.baudrate / 8),
+        'transactions_per_kb': round(bus.transactions * 1024 / len(image), 1),
+        'busy_polls': simulated_flash.busy_polls,
+        'ok': digest.digest() == hashlib.sha256(image).digest() and not simulated_flash.protocol_errors,
+        'errors': simulated_flash.protocol_errors[:3],
+    }
+
+def run_gang_case(chip: str, hint: str, image: bytes, buffer_size: int, cs_pin_ids: list) -> dict:
+    simulated_flashes = []
+    for cs_pin_id in cs_pin_ids:
+        simulated_flash, bus = flash_simulator.simulate(chip, 2, cs_pin_id, reset=not simulated_flashes)
+        simulated_flashes.append(simulated_flash)
+    import machine
+    import serial_flash_accessor
+    from serial_flash_accessor.gang_writer import GangWriter
+    flashes = [serial_flash_accessor.create_serial_flash(machine.SPI(2), cs_pin_id, hint, 'Y7') for cs_pin_id in cs_pin_ids]
+    for simulated_flash in simulated_flashes:
+        simulated_flash.reset_stats()
+    bus.reset_stats()
+    clock = flash_simulator.CLOCK
+    start = clock.now_us
+    gang = GangWriter(flashes)
+    gang.erase_range(0, len(image))
+    for flash in flashes:
+        flash.set_skip_blank(True)
+    buffer = memoryview(bytearray(buffer_size))
+    for address in range(0, len(image), buffer_size):
+        length = min(buffer_size, len(image) - address)
+        buffer[:length] = image[address: address + length]
+        gang.write(address, buffer[:length])
+        clock.advance(HOST_US_PER_KB * length / 1024)
+    expected = [hashlib.sha256(image).digest()]
+    verified = gang.digests(0, len(image), 'sha256', 0) == [expected] * len(flashes)
+    gang.close()
+    elapsed_us = clock.now_us - start
+    errors = [error for simulated_flash in simulated_flashes for error in simulated_flash.protocol_errors]
+    return {
+        'bytes_per_second': round(len(image) * len(flashes) * 1000000 / elapsed_us),
+        'transactions_per_kb': round(bus.transactions * 1024 / (len(image) * len(flashes)), 1),
+        'busy_polls': sum(simulated_flash.busy_polls for simulated_flash in simulated_flashes),
+        'ok': verified and not errors and gang.get_errors() == [None] * len(flashes)
+              and all(bytes(simulated_flash.memory[:len(image)]) == image for simulated_flash in simulated_flashes),
+        'errors': (errors + [error for error in gang.get_errors() if error])[:3],
+    }
+
+def run_all() -> dict:
+    results = {}
+    for chip, hint, size in CASES:
+        image = make_image(size)
+        for buffer_size in BUFFER_SIZES:
+            results['{0}/{1}'.format(chip, buffer_size)] = run_case(chip, hint, image, buffer_size, False)
+            results['{0}/{1}/pipelined'.format(chip, buffer_size)] = run_case(chip, hint, image, buffer_size, True)
+        results['{0}/read'.format(chip)] = run_read_case(chip, hint, image, 8192)
+        if hint == None:
+            results['{0}/gang4'.format(chip)] = run_gang_case(chip, hint, image, 1024, ['Y5', 'Y4', 'Y3', 'Y2'])
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for key, result in results.items():
+        if not result['ok']:
+            regressions.append('{0}: incorrect result {1}'.format(key, result['errors']))
+        expected = baseline.get(key)
+        if expected == None:
+            continue
+        if result['bytes_per_second'] < expected['bytes_per_second'] * (1 - tolerance):
+            regressions.append('{0}: {1} bytes/s < baseline {2}'.format(key, result['bytes_per_second'], expected['bytes_per_second']))
+        if result['transactions_per_kb'] > expected['transactions_per_kb'] * (1 + tolerance):
+            regressions.append('{0}: {1} transactions/KB > baseline {2}'.format(key, result['transactions_per_kb'], expected['transactions_per_kb']))
+        if result['busy_polls'] > expected['busy_polls'] * (1 + tolerance):
+            regressions.append('{0}: {1} busy polls > baseline {2}'.format(key, result['busy_polls'], expected['busy_polls']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark serial_flash_accessor drivers on simulated chips.')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.02)
+    args = parser.parse_args()
+
+    results = run_all()
+    baseline = {}
+    if os.path.exists(_BASELINE_PATH):
+        with open(_BASELINE_PATH) as file:
+            baseline = json.load(file)
+
+    print('{0:<30} {1:>12} {2:>14} {3:>11} {4:>10}'.format('chip/buffer', 'bytes/s', 'trans./KB', 'busy polls', 'baseline'))
+    for key, result in results.items():
+        expected = baseline.get(key)
+        ratio = '{0:+.1%}'.format(result['bytes_per_second'] / expected['bytes_per_second'] - 1) if expected else '-'
+        line_rate = ' ({0:.1%} of line rate)'.format(result['bytes_per_second'] / result['line_rate']) if 'line_rate' in result else ''
+        print('{0:<30} {1:>12} {2:>14} {3:>11} {4:>10}{5}'.format(key, result['bytes_per_second'], result['transactions_per_kb'], result['busy_polls'], ratio, line_rate))
+
+    if args.update_baseline:
+        with open(_BASELINE_PATH, 'w') as file:
+            json.dump({key: {name: result[name] for name in ('bytes_per_second', 'transactions_per_kb', 'busy_polls')}
+                       for key, result in results.items()}, file, indent=2, sort_keys=True)
+            file.write('\n')
+        print('Baseline updated.')
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# Compresses an image for serial_flash_writer.from_file, which decompresses it on the board.
+# The deflate window (2**window_bits bytes) is also the RAM the board needs for decompression,
+# so a small window is used by default.
+#
+#   python host/compress_image.py player.img                     writes player.img.gz
+#   python host/compress_image.py player.img --format zlib --window-bits 12
+import argparse
+import zlib
+
+_FORMATS = {
+    # format: (extension, wbits offset), see zlib.compressobj.
+    'gzip': ('.gz', 16),
+    'zlib': ('.zlib', 0),
+    'deflate': ('.deflate', None),
+}
+
+def compress_image(image: bytes, format: str = 'gzip', window_bits: int = 10, level: int = 9) -> bytes:
+    offset = _FORMATS[format][1]
+    wbits = -window_bits if offset == None else window_bits + offset
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    return compressor.compress(image) + compressor.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description='Compress an image for on-board decompression by from_file.')
+    parser.add_argument('image')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--format', choices=sorted(_FORMATS), default='gzip')
+    parser.add_argument('--window-bits', type=int, choices=range(9, 16), default=10)
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as file:
+        image = file.read()
+    compressed = compress_image(image, args.format, args.window_bits)
+    output = args.output or args.image + _FORMATS[args.format][0]
+    with open(output, 'wb') as file:
+        file.write(compressed)
+    print('{0}: {1} -> {2} bytes ({3:.1f}x), window {4} bytes'.format(
+        output, len(image), len(compressed), len(image) / max(1, len(compressed)), 1 << args.window_bits))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,508 @@
+# Protocol level serial flash simulator for running serial_flash_accessor on CPython.
+#
+# install() puts host/shims (micropython, machine) and the repository on sys.path and
+# replaces time.sleep_us/ticks_us/... with a virtual clock. simulate(name) then attaches a
+# simulated chip from SIMULATED_CHIPS to SPI(2)/'Y5', so the unmodified drivers talk to it
+# through SpiDevice. The clock advances with every SPI transfer (bus clock plus a fixed call
+# overhead), with sleep_us and with reads of the MISO pin ('Y7', see SST EBSY), and chip
+# operations stay busy for their configured time, so throughput, transaction and busy poll
+# figures are deterministic.
+import os
+import sys
+import time
+
+_HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+_REPOSITORY_DIR = os.path.dirname(_HOST_DIR)
+
+_KB = 1024
+_MB = 1024 * 1024
+
+# Typical timings in microseconds, taken from the datasheets of the chips in the drivers'
+# chip_infos tables. 'suspend' lists the (suspend, resume) commands of chips that can suspend a
+# page program or sector/block erase; its timing is the time until the chip stops.
+SIMULATED_CHIPS = {
+    '25AA640A': {
+        'jedec_id': None, 'capacity': 8 * _KB, 'page_size': 32, 'address_bytes': 2, 'program': 'eeprom',
+        'erase_sizes': {}, 'protect_mask': 0x0C,
+        'timings': {'page_program': 3500},
+    },
+    '25LC640A': {
+        'jedec_id': None, 'capacity': 8 * _KB, 'page_size': 32, 'address_bytes': 2, 'program': 'eeprom',
+        'erase_sizes': {}, 'protect_mask': 0x0C,
+        'timings': {'page_program': 3500},
+    },
+    'SST25VF032B': {
+        'jedec_id': b'\xBF\x25\x4A', 'capacity': 4 * _MB, 'page_size': 1, 'address_bytes': 3, 'program': 'aai',
+        'erase_sizes': {0x20: 4 * _KB, 0x52: 32 * _KB, 0xD8: 64 * _KB}, 'protect_mask': 0x3C,
+        'timings': {'word_program': 7, 'byte_program': 7, 'sector_erase': 18000, 'block_erase': 18000, 'chip_erase': 35000},
+    },
+    'MX25x40xx': {
+        'jedec_id': b'\xC2\x20\x13', 'capacity': 512 * _KB, 'page_size': 256, 'address_bytes': 3, 'program': 'page',
+        'erase_sizes': {0x20: 4 * _KB, 0xD8: 64 * _KB}, 'protect_mask': 0x1C,
+        'timings': {'page_program': 1400, 'sector_erase': 60000, 'block_erase': 700000, 'chip_erase': 3500000, 'status_write': 5000},
+    },
+    'W25Q32JV-IQ': {
+        'jedec_id': b'\xEF\x40\x16', 'capacity': 4 * _MB, 'page_size': 256, 'address_bytes': 3, 'program': 'page',
+        'erase_sizes': {0x20: 4 * _KB, 0x52: 32 * _KB, 0xD8: 64 * _KB}, 'protect_mask': 0x7C, 'suspend': (0x75, 0x7A),
+        'timings': {'page_program': 400, 'sector_erase': 45000, 'block_erase': 150000, 'chip_erase': 10000000, 'suspend': 10},
+    },
+    # Not in any driver's chip_infos; identified through SFDP only.
+    'GD25Q32C': {
+        'jedec_id': b'\xC8\x40\x16', 'capacity': 4 * _MB, 'page_size': 256, 'address_bytes': 3, 'program': 'page',
+        'erase_sizes': {0x20: 4 * _KB, 0x52: 32 * _KB, 0xD8: 64 * _KB}, 'protect_mask': 0x7C, 'sfdp': True,
+        'timings': {'page_program': 600, 'sector_erase': 50000, 'block_erase': 200000, 'chip_erase': 10000000},
+    },
+    # 32 MB parts. 'four_byte' lists how they take 4 byte addresses: the dedicated commands
+    # ('opcodes') and/or EN4B/EX4B ('en4b').
+    'W25Q256JV-IQ': {
+        'jedec_id': b'\xEF\x40\x19', 'capacity': 32 * _MB, 'page_size': 256, 'address_bytes': 3, 'program': 'page',
+        'erase_sizes': {0x20: 4 * _KB, 0x52: 32 * _KB, 0xD8: 64 * _KB}, 'protect_mask': 0x7C, 'four_byte': ('opcodes', 'en4b'),
+        'suspend': (0x75, 0x7A),
+        'timings': {'page_program': 400, 'sector_erase': 45000, 'block_erase': 150000, 'chip_erase': 80000000, 'suspend': 10},
+    },
+    'MX25L25645G': {
+        'jedec_id': b'\xC2\x20\x19', 'capacity': 32 * _MB, 'page_size': 256, 'address_bytes': 3, 'program': 'page',
+        'erase_sizes': {0x20: 4 * _KB, 0x52: 32 * _KB, 0xD8: 64 * _KB}, 'protect_mask': 0x3C, 'four_byte': ('opcodes', 'en4b'),
+        'suspend': (0xB0, 0x30),
+        'timings': {'page_program': 150, 'sector_erase': 25000, 'block_erase': 140000, 'chip_erase': 50000000, 'status_write': 5000,
+                    'suspend': 10},
+    },
+    # Not in any driver's chip_infos; identified through SFDP only, which reports EN4B.
+    'IS25LP256D': {
+        'jedec_id': b'\x9D\x60\x19', 'capacity': 32 * _MB, 'page_size': 256, 'address_bytes': 3, 'program': 'page',
+        'erase_sizes': {0x20: 4 * _KB, 0x52: 32 * _KB, 0xD8: 64 * _KB}, 'protect_mask': 0x3C, 'sfdp': True, 'four_byte': ('en4b',),
+        'timings': {'page_program': 200, 'sector_erase': 70000, 'block_erase': 150000, 'chip_erase': 45000000},
+    },
+}
+
+_WRSR = 0x01
+_PP = 0x02
+_READ = 0x03
+_WRDI = 0x04
+_RDSR = 0x05
+_WREN = 0x06
+_FAST_READ = 0x0B
+_EWSR = 0x50
+_RDSFDP = 0x5A
+_CE = 0x60
+_EBSY = 0x70
+_DBSY = 0x80
+_RDID = 0x9F
+_AAI_PROGRAM = 0xAD
+_ENTER_4_BYTE = 0xB7
+_CE2 = 0xC7
+_EXIT_4_BYTE = 0xE9
+
+# Dedicated 4 byte address command: the 3 byte address command it stands for.
+_4_BYTE_COMMANDS = {0x13: _READ, 0x0C: _FAST_READ, 0x12: _PP, 0x21: 0x20, 0x5C: 0x52, 0xDC: 0xD8}
+
+_CORRUPTED_BYTE_INTERVAL = 97
+
+_BUSY = 0x01
+_WEL = 0x02
+_AAI = 0x40
+
+def _encode_time(microseconds: int, units: tuple, count_bits: int) -> int:
+    # JESD216 time field: count (count_bits wide, stored minus one) in the smallest unit that fits.
+    for index, unit in enumerate(units):
+        count = max(1, -(-microseconds // unit))
+        if count <= 1 << count_bits:
+            return (index << count_bits) | (count - 1)
+    return ((len(units) - 1) << count_bits) | ((1 << count_bits) - 1)
+
+def build_sfdp(chip: dict) -> bytes:
+    # SFDP header, one parameter header and a 16 dword Basic Flash Parameter Table (JESD216B)
+    # describing the chip's capacity, page size, erase commands and typical timings.
+    timings = chip['timings']
+    erase_sizes = sorted(chip['erase_sizes'].items(), key=lambda item: item[1])
+    dwords = [0] * 16
+    dwords[0] = 0xFF000000 | (0x20 << 8) | 0x04 | (0x01 if 4 * _KB in chip['erase_sizes'].values() else 0x03)
+    dwords[1] = chip['capacity'] * 8 - 1
+    erase_field = 0
+    for index, (command, size) in enumerate(erase_sizes[:4]):
+        dwords[7 + (index >> 1)] |= (((command << 8) | size.bit_length() - 1) << ((index & 1) * 16))
+        erase_time = timings['sector_erase'] if size == 4 * _KB else timings['block_erase']
+        erase_field |= _encode_time(erase_time, (1000, 16000, 128000, 1000000), 5) << (4 + index * 7)
+    dwords[9] = erase_field | 0x03
+    page_program = _encode_time(timings['page_program'], (8, 64), 5)
+    chip_erase = _encode_time(timings['chip_erase'], (16000, 256000, 4000000, 64000000), 5)
+    dwords[10] = (chip_erase << 24) | (page_program << 8) | ((chip['page_size'].bit_length() - 1) << 4) | 0x03
+    if 'en4b' in chip.get('four_byte', ()):
+        # 3 or 4 byte addresses; enter with 0xB7 and exit with 0xE9.
+        dwords[0] |= 1 << 17
+        dwords[15] |= (0x01 << 24) | (0x01 << 14)
+    table = b''.join(dword.to_bytes(4, 'little') for dword in dwords)
+    header = b'SFDP' + bytes([0x06, 0x01, 0x00, 0xFF])
+    parameter_header = bytes([0x00, 0x06, 0x01, len(dwords)]) + (16).to_bytes(3, 'little') + bytes([0xFF])
+    return header + parameter_header + table
+
+class VirtualClock:
+    def __init__(self):
+        self.now_us = 0.0
+
+    def advance(self, microseconds: float):
+        self.now_us += microseconds
+
+    def sleep_us(self, microseconds: int):
+        self.now_us += microseconds
+
+    def sleep_ms(self, milliseconds: int):
+        self.now_us += milliseconds * 1000
+
+    def sleep(self, seconds: float):
+        self.now_us += seconds * 1000000
+
+    def ticks_us(self) -> int:
+        return int(self.now_us)
+
+    def ticks_ms(self) -> int:
+        return int(self.now_us // 1000)
+
+    def ticks_diff(self, end: int, start: int) -> int:
+        return end - start
+
+    def ticks_add(self, ticks: int, delta: int) -> int:
+        return ticks + delta
+
+CLOCK = VirtualClock()
+
+def install():
+    for path in (_REPOSITORY_DIR, os.path.join(_HOST_DIR, 'shims')):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    time.sleep_us = CLOCK.sleep_us
+    time.sleep_ms = CLOCK.sleep_ms
+    time.ticks_us = CLOCK.ticks_us
+    time.ticks_ms = CLOCK.ticks_ms
+    time.ticks_diff = CLOCK.ticks_diff
+    time.ticks_add = CLOCK.ticks_add
+
+class SimulatedFlash:
+    def __init__(self, name: str, timings: dict = None, clock: VirtualClock = CLOCK):
+        chip = SIMULATED_CHIPS[name]
+        self.name = name
+        self.jedec_id = chip['jedec_id']
+        self.capacity = chip['capacity']
+        self.page_size = chip['page_size']
+        self.address_bytes = chip['address_bytes']
+        self.four_byte = chip.get('four_byte', ())
+        self.four_byte_mode = False
+        self.suspend_commands = chip.get('suspend', ())
+        self.program = chip['program']
+        self.erase_sizes = chip['erase_sizes']
+        self.protect_mask = chip['protect_mask']
+        self.sfdp = build_sfdp(chip) if chip.get('sfdp') else b''
+        self.timings = dict(chip['timings'])
+        if timings:
+            self.timings.update(timings)
+        self.memory = bytearray(b'\xff' * self.capacity)
+        self._clock = clock
+        self._status = 0
+        self._busy_until = 0.0
+        self._busy_operation = None
+        # (operation, remaining us) of a suspended operation.
+        self._suspended = None
+        self._status_write_enabled = False
+        self._aai_address = None
+        self._ready_output = False
+        self._selected = False
+        self._command = bytearray()
+        self._read_offset = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.busy_polls = 0
+        self.status_reads = 0
+        self.ready_pin_reads = 0
+        self.protocol_errors = []
+
+    def is_busy(self) -> bool:
+        return self._clock.now_us < self._busy_until
+
+    # SPI side, driven by SimulatedSpiBus.
+    def select(self):
+        self._selected = True
+        self._command = bytearray()
+        self._read_offset = 0
+
+    def miso_level(self) -> int:
+        # After EBSY the SO pin outputs RY/BY# while CS is low during AAI; otherwise it floats
+        # (pulled up).
+        if not (self._selected and self._ready_output and self._aai_address != None) or self._command:
+            return 1
+        self.ready_pin_reads += 1
+        return 0 if self.is_busy() else 1
+
+    def receive(self, data):
+        self._command += data
+
+    def transmit(self, length: int) -> bytes:
+        command = self._base_command() if self._command else None
+        if command == _RDSR:
+            self.status_reads += 1
+            if self.is_busy():
+                self.busy_polls += 1
+            return bytes([self._read_status()]) * length
+        if self.is_busy():
+            self._error('0x{0:02X} read while busy'.format(command))
+            return b'\xff' * length
+        if command == _RDID and self.jedec_id != None:
+            data = self.jedec_id[self._read_offset: self._read_offset + length]
+            self._read_offset += length
+            return data + b'\xff' * (length - len(data))
+        if command == _RDSFDP:
+            address = self._address() + self._read_offset
+            self._read_offset += length
+            data = self.sfdp[address: address + length]
+            return data + b'\xff' * (length - len(data))
+        if command in (_READ, _FAST_READ):
+            address = self._address() + self._read_offset
+            self._read_offset += length
+            return bytes(self.memory[(address + index) % self.capacity] for index in range(length))
+        return b'\xff' * length
+
+    def deselect(self):
+        self._selected = False
+        if not self._command:
+            return
+        command = self._base_command()
+        if command in (_RDSR, _RDID, _RDSFDP, _READ, _FAST_READ):
+            return
+        if command in self.suspend_commands:
+            self._suspend_or_resume(command)
+            return
+        if self.is_busy():
+            self._error('0x{0:02X} sent while busy'.format(self._command[0]))
+            return
+        if self._suspended != None:
+            self._error('0x{0:02X} sent while suspended'.format(self._command[0]))
+            return
+        self._execute(command)
+
+    def _suspend_or_resume(self, command: int):
+        # A suspend is ignored unless a page program or sector/block erase is running, a resume
+        # unless one is suspended.
+        now = self._clock.now_us
+        if command == self.suspend_commands[0]:
+            if self.is_busy() and self._suspended == None and self._busy_operation in ('page_program', 'sector_erase', 'block_erase'):
+                self._suspended = (self._busy_operation, self._busy_until - now)
+                self._busy_until = now + self.timings.get('suspend', 0)
+        elif self._suspended != None:
+            if self.is_busy():
+                self._error('resume while suspending')
+                return
+            self._busy_operation = self._suspended[0]
+            self._busy_until = now + self._suspended[1]
+            self._suspended = None
+
+    def _read_status(self) -> int:
+        status = self._status
+        if self.is_busy():
+            status |= _BUSY
+        if self._aai_address != None:
+            status |= _AAI
+        return status
+
+    def _execute(self, command: int):
+        if command == _WREN:
+            self._status |= _WEL
+        elif command == _WRDI:
+            self._status &= ~_WEL
+            self._aai_address = None
+        elif command == _EWSR:
+            self._status_write_enabled = True
+        elif command in (_ENTER_4_BYTE, _EXIT_4_BYTE) and 'en4b' in self.four_byte:
+            self.four_byte_mode = command == _ENTER_4_BYTE
+        elif command in (_EBSY, _DBSY) and self.program == 'aai':
+            self._ready_output = command == _EBSY
+        elif command == _WRSR:
+            if not (self._status & _WEL or self._status_write_enabled):
+                self._error('WRSR without write enable')
+                return
+            self._status = (self._status & _WEL) | (self._command[1] & 0xFC)
+            self._status_write_enabled = False
+            self._status &= ~_WEL
+            self._busy('status_write')
+        elif command == _PP and self.program in ('page', 'eeprom'):
+            if self._check_writable():
+                self._program_page()
+        elif command == _PP and self.program == 'aai':
+            if self._aai_address != None:
+                self._error('byte program during AAI')
+            elif len(self._command) != 2 + self._address_length():
+                self._error('malformed byte program')
+            elif self._check_writable():
+                self.memory[self._address()] &= self._command[1 + self._address_length()]
+                self._busy('byte_program')
+        elif command == _AAI_PROGRAM and self.program == 'aai':
+            self._program_aai()
+        elif command in self.erase_sizes:
+            if self._check_writable():
+                size = self.erase_sizes[command]
+                address = self._address() - self._address() % size
+                self.memory[address: address + size] = b'\xff' * size
+                self._busy('sector_erase' if size == 4 * _KB else 'block_erase')
+        elif command in (_CE, _CE2) and self.program != 'eeprom':
+            if self._check_writable():
+                self.memory[:] = b'\xff' * self.capacity
+                self._busy('chip_erase')
+        else:
+            self._error('unsupported command 0x{0:02X}'.format(command))
+
+    def _check_writable(self) -> bool:
+        if not self._status & _WEL:
+            self._error('0x{0:02X} without WREN'.format(self._command[0]))
+            return False
+        self._status &= ~_WEL
+        if self._status & self.protect_mask:
+            self._error('0x{0:02X} while protected'.format(self._command[0]))
+            return False
+        return True
+
+    def _program_page(self):
+        address = self._address()
+        data = self._command[1 + self._address_length():]
+        page_size = self.page_size
+        page_address = address - address % page_size
+        for index in range(len(data)):
+            target = page_address + (address + index) % page_size
+            if self.program == 'eeprom':
+                self.memory[target] = data[index]
+            else:
+                self.memory[target] &= data[index]
+        self._busy('page_program')
+
+    def _program_aai(self):
+        if self._aai_address == None:
+            if not self._status & _WEL:
+                self._error('AAI without WREN')
+                return
+            self._aai_address = self._address()
+            data = self._command[1 + self._address_length():]
+        else:
+            data = self._command[1:]
+        if len(data) != 2 or self._aai_address % 2 != 0:
+            self._error('malformed AAI sequence')
+            return
+        for value in data:
+            self.memory[self._aai_address % self.capacity] &= value
+            self._aai_address += 1
+        self._busy('word_program')
+
+    def _base_command(self) -> int:
+        command = self._command[0]
+        if command in _4_BYTE_COMMANDS and 'opcodes' in self.four_byte:
+            return _4_BYTE_COMMANDS[command]
+        return command
+
+    def _address_length(self) -> int:
+        command = self._command[0]
+        if command in _4_BYTE_COMMANDS and 'opcodes' in self.four_byte:
+            return 4
+        if self.four_byte_mode and command != _RDSFDP:
+            return 4
+        return self.address_bytes
+
+    def _address(self) -> int:
+        # 3 byte addresses reach the first 16 MB only.
+        return int.from_bytes(self._command[1: 1 + self._address_length()], 'big') % self.capacity
+
+    def _busy(self, operation: str):
+        self._busy_operation = operation
+        self._busy_until = self._clock.now_us + self.timings.get(operation, 0)
+
+    def _error(self, message: str):
+        self.protocol_errors.append('{0:.0f}us: {1}'.format(self._clock.now_us, message))
+
+class SimulatedSpiBus:
+    # Models a pyboard SPI peripheral: the baudrate is rounded down to source_clock / 2**n and
+    # every write/readinto costs call_overhead_us on top of the bit time; a read of the MISO pin
+    # costs pin_read_us. Above max_reliable_baudrate (wiring that cannot keep up) received data
+    # has a flipped bit every _CORRUPTED_BYTE_INTERVAL bytes.
+    def __init__(self, source_clock: int = 42000000, call_overhead_us: float = 4, pin_read_us: float = 1, clock: VirtualClock = CLOCK,
+                 max_reliable_baudrate: int = None):
+        self.source_clock = source_clock
+        self.call_overhead_us = call_overhead_us
+        self.pin_read_us = pin_read_us
+        self.max_reliable_baudrate = max_reliable_baudrate
+        self._counted = True
+        self.baudrate = source_clock // 256
+        self._clock = clock
+        self._devices = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.transactions = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def achievable_baudrates(self) -> list:
+        return [self.source_clock >> shift for shift in range(1, 9)]
+
+    def set_baudrate(self, baudrate: int):
+        candidates = [rate for rate in self.achievable_baudrates() if rate <= baudrate]
+        self.baudrate = candidates[0] if candidates else self.achievable_baudrates()[-1]
+
+    def attach(self, cs_pin_id, flash: SimulatedFlash, miso_pin_id = None):
+        import machine
+        self._devices[cs_pin_id] = flash
+        machine.Pin.add_listener(cs_pin_id, lambda level: self._on_cs(flash, level))
+        if miso_pin_id != None:
+            machine.Pin.set_source(miso_pin_id, self._read_miso)
+
+    def _read_miso(self) -> int:
+        self._clock.advance(self.pin_read_us)
+        level = 1
+        for flash in self._devices.values():
+            level &= flash.miso_level()
+        return level
+
+    def write(self, buffer):
+        self._transfer(len(buffer))
+        self.bytes_out += len(buffer)
+        for flash in self._selected():
+            flash.receive(bytes(buffer))
+
+    def readinto(self, buffer):
+        self._transfer(len(buffer))
+        self.bytes_in += len(buffer)
+        for flash in self._selected():
+            buffer[:] = flash.transmit(len(buffer))
+        if self.max_reliable_baudrate != None and self.baudrate > self.max_reliable_baudrate:
+            for index in range(0, len(buffer), _CORRUPTED_BYTE_INTERVAL):
+                buffer[index] ^= 0x80
+
+    def _on_cs(self, flash: SimulatedFlash, level: int):
+        # A transaction is counted at its first transfer; selecting a chip only to read its
+        # ready state on MISO moves no data.
+        if level == 0:
+            self._counted = False
+            flash.select()
+        else:
+            flash.deselect()
+
+    def _selected(self) -> list:
+        import machine
+        return [flash for cs_pin_id, flash in self._devices.items() if machine.Pin._levels.get(cs_pin_id, 1) == 0]
+
+    def _transfer(self, length: int):
+        if not self._counted:
+            self._counted = True
+            self.transactions += 1
+        self._clock.advance(self.call_overhead_us + length * 8 * 1000000 / self.baudrate)
+
+def simulate(name: str, spi_id=2, cs_pin_id='Y5', timings: dict = None, reset: bool = True, miso_pin_id='Y7'):
+    # Attaches a fresh simulated chip and returns (flash, bus). With reset=False further chips
+    # can be added on other buses or chip selects.
+    install()
+    import machine
+    if reset:
+        machine.Pin.reset()
+        machine.SPI._buses.clear()
+    bus = machine.SPI._buses.get(spi_id)
+    if bus == None:
+        bus = SimulatedSpiBus()
+        machine.SPI.attach_bus(spi_id, bus)
+    flash = SimulatedFlash(name, timings)
+    bus.attach(cs_pin_id, flash, miso_pin_id)
+    return (flash, bus)
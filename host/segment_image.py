@@ -0,0 +1,66 @@
+# Builds a segment container for serial_flash_writer.from_file, which writes each segment at its
+# own address and erases, programs and verifies only those ranges. Intel HEX files can be given to
+# from_file as they are; --hex writes one instead of the container.
+#
+#   python host/segment_image.py firmware.seg boot.bin@0x0 assets.bin@0x100000
+#   python host/segment_image.py firmware.hex boot.bin@0x0 assets.bin@0x100000 --hex
+import argparse
+
+CONTAINER_MAGIC = b'SFSG'
+_HEX_RECORD_SIZE = 16
+
+def build_container(segments: list) -> bytes:
+    # segments: [(address, data), ...]
+    output = bytearray(CONTAINER_MAGIC)
+    output += len(segments).to_bytes(4, 'little')
+    for address, data in segments:
+        output += address.to_bytes(4, 'little') + len(data).to_bytes(4, 'little') + data
+    return bytes(output)
+
+def build_intel_hex(segments: list) -> bytes:
+    lines = []
+    upper = -1
+    for address, data in segments:
+        offset = 0
+        while offset != len(data):
+            record_address = address + offset
+            # Records do not cross a 64 KB boundary.
+            length = min(_HEX_RECORD_SIZE, len(data) - offset, 0x10000 - (record_address & 0xFFFF))
+            if record_address >> 16 != upper:
+                upper = record_address >> 16
+                lines.append(_hex_record(0x04, 0, upper.to_bytes(2, 'big')))
+            lines.append(_hex_record(0x00, record_address & 0xFFFF, data[offset: offset + length]))
+            offset += length
+    lines.append(_hex_record(0x01, 0, b''))
+    return ''.join(lines).encode()
+
+def _hex_record(record_type: int, address: int, data: bytes) -> str:
+    record = bytes([len(data), address >> 8, address & 0xFF, record_type]) + data
+    return ':{0}{1:02X}\n'.format(record.hex().upper(), -sum(record) & 0xFF)
+
+def _parse_segment(argument: str):
+    name, separator, address = argument.rpartition('@')
+    if separator == '':
+        raise argparse.ArgumentTypeError('expected file@address: ' + argument)
+    with open(name, 'rb') as file:
+        return (int(address, 0), file.read())
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a segmented image for from_file.')
+    parser.add_argument('output')
+    parser.add_argument('segments', nargs='+', type=_parse_segment, metavar='file@address')
+    parser.add_argument('--hex', action='store_true', help='write Intel HEX instead of the container')
+    args = parser.parse_args()
+
+    segments = sorted(args.segments)
+    for index in range(1, len(segments)):
+        if segments[index][0] < segments[index - 1][0] + len(segments[index - 1][1]):
+            parser.error('segments overlap at 0x{0:06x}'.format(segments[index][0]))
+    output = build_intel_hex(segments) if args.hex else build_container(segments)
+    with open(args.output, 'wb') as file:
+        file.write(output)
+    print('{0}: {1} segments, {2} bytes of data, {3} bytes'.format(
+        args.output, len(segments), sum(len(data) for _, data in segments), len(output)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# CPython stand-in for the parts of the MicroPython `machine` module used by serial_flash_accessor.
+# Pins keep their level in a class-wide table so a simulated SPI bus can see which chip is selected,
+# and an input pin can be given a source function (e.g. a chip driving MISO); SPI objects forward
+# transfers to the bus registered for their id (see host/flash_simulator.py).
+
+class Pin:
+    IN = 0
+    OUT = 1
+
+    _levels = {}
+    _listeners = {}
+    _sources = {}
+
+    def __init__(self, id, mode: int = -1, pull: int = -1, value: int = None):
+        self._id = id
+        Pin._levels.setdefault(id, 1)
+        if value != None:
+            self.value(value)
+
+    def value(self, value: int = None):
+        if value == None:
+            source = Pin._sources.get(self._id)
+            return source() if source != None else Pin._levels[self._id]
+        value = 1 if value else 0
+        if Pin._levels[self._id] != value:
+            Pin._levels[self._id] = value
+            for listener in Pin._listeners.get(self._id, []):
+                listener(value)
+
+    def low(self):
+        self.value(0)
+
+    def high(self):
+        self.value(1)
+
+    @classmethod
+    def add_listener(cls, id, listener):
+        cls._levels.setdefault(id, 1)
+        cls._listeners.setdefault(id, []).append(listener)
+
+    @classmethod
+    def set_source(cls, id, source):
+        cls._levels.setdefault(id, 1)
+        cls._sources[id] = source
+
+    @classmethod
+    def reset(cls):
+        cls._levels.clear()
+        cls._listeners.clear()
+        cls._sources.clear()
+
+# pyboard (STM32F405) clocks: SYSCLK, HCLK, PCLK1 (SPI2/SPI3) and PCLK2 (SPI1); the simulated
+# SPI bus uses PCLK1 as its source clock.
+def freq():
+    return (168000000, 168000000, 42000000, 84000000)
+
+class SPI:
+    MASTER = 1
+
+    _buses = {}
+    _instances = {}
+
+    def __new__(cls, id, *args, **kwargs):
+        # Like the pyboard's hardware SPI, SPI(id) is the same object every time.
+        instance = cls._instances.get(id)
+        if instance == None:
+            instance = object.__new__(cls)
+            cls._instances[id] = instance
+        return instance
+
+    def __init__(self, id, *args, **kwargs):
+        if id not in SPI._buses:
+            raise ValueError('SPI({0}) does not exist'.format(id))
+        self._bus = SPI._buses[id]
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode: int = MASTER, baudrate: int = 328125, **kwargs):
+        self._bus.set_baudrate(baudrate)
+
+    def write(self, buffer):
+        self._bus.write(buffer)
+
+    def readinto(self, buffer, write: int = 0x00):
+        self._bus.readinto(buffer)
+
+    @classmethod
+    def attach_bus(cls, id, bus):
+        cls._buses[id] = bus
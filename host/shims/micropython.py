@@ -0,0 +1,23 @@
+# CPython stand-in for the MicroPython `micropython` module, used by host/flash_simulator.py.
+# The code emitters are no-ops here; `const` just returns its value. Importing it also provides
+# the viper pointer casts (ptr8 etc.) as builtins; indexing the buffer itself behaves the same.
+import builtins
+
+def const(value):
+    return value
+
+def native(function):
+    return function
+
+def viper(function):
+    return function
+
+def kbd_intr(chr: int):
+    pass
+
+def _pointer(buffer):
+    return buffer
+
+builtins.ptr8 = _pointer
+builtins.ptr16 = _pointer
+builtins.ptr32 = _pointer
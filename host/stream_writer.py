@@ -0,0 +1,336 @@
+# Host side (CPython) programmer that streams an image to the pyboard through the raw REPL.
+# The board does not need a copy of the image on its filesystem; each chunk is programmed
+# as soon as it arrives.
+#
+#   python host/stream_writer.py player.img --port /dev/ttyACM0
+#   python host/stream_writer.py player.img --loopback
+import argparse
+import socket
+import sys
+import threading
+import time
+
+_RAW_REPL_PROMPT = b'raw REPL; CTRL-B to exit\r\n>'
+
+# Executed on the board. Chunks are acknowledged with b'A' once they are programmed and
+# verified, which hands a transfer credit back to the host. The host keeps up to `window`
+# chunks in flight, so the next chunk is already travelling over USB while the board is
+# busy programming the current one.
+_AGENT = '''
+import sys
+import micropython
+from machine import SPI
+import serial_flash_accessor
+
+def _stream_agent(spi_id, cs_pin_id, miso_pin_id, hint, address, size, chunk_size):
+    out = sys.stdout.buffer
+    inp = sys.stdin.buffer
+    flash = serial_flash_accessor.create_serial_flash(SPI(spi_id), cs_pin_id, hint, miso_pin_id)
+    if flash == None:
+        out.write(b'ERR Unsupported flash memory\\n')
+        return
+    if address + size > flash.get_capacity():
+        out.write(b'ERR Insufficient flash memory capacity.\\n')
+        return
+    is_protect = flash.is_protect()
+    if is_protect:
+        flash.set_protect(False)
+    flash.reset_write_stats()
+    if size != 0:
+        flash.erase_range(address, size)
+    flash.set_skip_blank(True)
+    chunk_buffer = memoryview(bytearray(chunk_size))
+    read_buffer = memoryview(bytearray(chunk_size))
+    # Ctrl-C is disabled before the host is told to send, so no 0x03 in the image can interrupt.
+    micropython.kbd_intr(-1)
+    try:
+        out.write('OK {0} {1}\\n'.format(flash.get_name(), flash.get_capacity()).encode())
+        offset = 0
+        while offset < size:
+            length = min(chunk_size, size - offset)
+            chunk = chunk_buffer[:length]
+            received = 0
+            while received < length:
+                received += inp.readinto(chunk[received:])
+            flash.write(address + offset, chunk)
+            flash.read(address + offset, read_buffer[:length])
+            if chunk != read_buffer[:length]:
+                out.write('V {0}\\n'.format(address + offset).encode())
+                return
+            out.write(b'A')
+            offset += length
+    finally:
+        micropython.kbd_intr(3)
+        if is_protect:
+            flash.set_protect(True)
+    write_stats = flash.get_write_stats()
+    out.write('DONE {0} {1}\\n'.format(write_stats[0], write_stats[1]).encode())
+'''
+
+class StreamWriterError(Exception):
+    pass
+
+class SerialTransport:
+    def __init__(self, port: str, baudrate: int = 115200, timeout: float = 10):
+        try:
+            import serial
+        except ImportError:
+            raise StreamWriterError('pyserial is required for --port (pip install pyserial).')
+        self._serial = serial.Serial(port, baudrate, timeout=timeout)
+
+    def write(self, data):
+        self._serial.write(data)
+
+    def read(self, size: int) -> bytes:
+        return self._serial.read(size)
+
+    def close(self):
+        self._serial.close()
+
+class LoopbackTransport:
+    # Stand-in for a pyboard: a thread that speaks the raw REPL on the other end of a
+    # socketpair and runs the agent against an in-memory flash. With simulate=<chip name>
+    # the agent runs the real serial_flash_accessor drivers against flash_simulator instead.
+    def __init__(self, capacity: int = 4 * 1024 * 1024, page_program_seconds: float = 0,
+                 link_bytes_per_second: float = 0, simulate: str = None, timeout: float = 10):
+        self._link_bytes_per_second = link_bytes_per_second
+        self._socket, device_socket = socket.socketpair()
+        self._socket.settimeout(timeout)
+        stream = device_socket.makefile('rwb', buffering=0)
+        modules = {'sys': _Namespace(stdin=_Namespace(buffer=stream), stdout=_Namespace(buffer=stream))}
+        if simulate:
+            import flash_simulator
+            self.flash = flash_simulator.simulate(simulate)[0]
+        else:
+            self.flash = _RamFlash(capacity, page_program_seconds)
+            modules['micropython'] = _Namespace(kbd_intr=lambda chr: None)
+            modules['machine'] = _Namespace(SPI=lambda id: None)
+            modules['serial_flash_accessor'] = _Namespace(create_serial_flash=lambda spi, cs_pin_id, hint, miso_pin_id: self.flash)
+        self._device = threading.Thread(target=_LoopbackDevice(stream, modules).run, daemon=True)
+        self._device.start()
+
+    def write(self, data):
+        if self._link_bytes_per_second:
+            time.sleep(len(data) / self._link_bytes_per_second)
+        self._socket.sendall(data)
+
+    def read(self, size: int) -> bytes:
+        try:
+            return self._socket.recv(size)
+        except socket.timeout:
+            return b''
+
+    def close(self):
+        self._socket.close()
+        self._device.join(1)
+
+class RawRepl:
+    def __init__(self, transport):
+        self._transport = transport
+
+    def enter(self):
+        self._transport.write(b'\r\x03\x03')
+        self._transport.write(b'\r\x01')
+        self.read_until(_RAW_REPL_PROMPT)
+
+    def exit(self):
+        self._transport.write(b'\r\x02')
+
+    def exec_start(self, code: str):
+        # Sends the code and returns as soon as the board has accepted it, so the caller
+        # can talk to the running code over the same line.
+        data = code.encode()
+        for index in range(0, len(data), 256):
+            self._transport.write(data[index: index + 256])
+        self._transport.write(b'\x04')
+        if self.read_until(b'OK')[-2:] != b'OK':
+            raise StreamWriterError('The board did not accept the code.')
+
+    def exec_finish(self) -> bytes:
+        self.read_until(b'\x04')
+        error = self.read_until(b'\x04')[:-1]
+        self.read_until(b'>')
+        return error
+
+    def read_until(self, ending: bytes) -> bytes:
+        data = bytearray()
+        while not data.endswith(ending):
+            received = self._transport.read(1)
+            if not received:
+                raise StreamWriterError('Timed out waiting for {0!r}, received {1!r}.'.format(ending, bytes(data[-80:])))
+            data += received
+        return bytes(data)
+
+    def read_byte(self) -> bytes:
+        received = self._transport.read(1)
+        if not received:
+            raise StreamWriterError('Timed out waiting for the board.')
+        return received
+
+def program(transport, image, hint: str = None, address: int = 0, chunk_size: int = 4096, window: int = 2,
+            spi_id: int = 2, cs_pin_id: str = 'Y5', miso_pin_id: str = 'Y7', log=print):
+    repl = RawRepl(transport)
+    repl.enter()
+    try:
+        repl.exec_start(_AGENT + '_stream_agent({0!r}, {1!r}, {2!r}, {3!r}, {4!r}, {5!r}, {6!r})\n'.format(
+            spi_id, cs_pin_id, miso_pin_id, hint, address, len(image), chunk_size))
+        header = repl.read_until(b'\n').decode().split()
+        if header[0] != 'OK':
+            raise StreamWriterError(' '.join(header[1:]))
+        log('Name     : {0}'.format(header[1]))
+        log('Capacity : {0} bytes'.format(header[2]))
+
+        start = time.monotonic()
+        chunk_count = (len(image) + chunk_size - 1) // chunk_size
+        sent = 0
+        acknowledged = 0
+        while acknowledged != chunk_count:
+            while sent != chunk_count and sent - acknowledged < window:
+                transport.write(image[sent * chunk_size: (sent + 1) * chunk_size])
+                sent += 1
+            reply = repl.read_byte()
+            if reply == b'V':
+                raise StreamWriterError('Verify error at 0x{0:06x}'.format(int(repl.read_until(b'\n'))))
+            if reply != b'A':
+                raise StreamWriterError('Unexpected reply {0!r}'.format(reply + repl.read_until(b'\n')))
+            chunk_address = address + acknowledged * chunk_size
+            log('Writing: 0x{0:06x}-0x{1:06x}'.format(chunk_address, min(chunk_address + chunk_size, address + len(image)) - 1))
+            acknowledged += 1
+        elapsed = time.monotonic() - start
+
+        footer = repl.read_until(b'\n').decode().split()
+        error = repl.exec_finish()
+        if footer[0] != 'DONE' or error:
+            raise StreamWriterError(error.decode() or ' '.join(footer))
+        log('Pages    : {0} programmed, {1} skipped (blank)'.format(footer[1], footer[2]))
+        log('Speed    : {0:.0f} bytes/s'.format(len(image) / elapsed if elapsed else 0))
+        return [len(image), elapsed]
+    finally:
+        repl.exit()
+
+class _LoopbackDevice:
+    def __init__(self, stream, modules: dict):
+        self._stream = stream
+        self._modules = modules
+
+    def run(self):
+        stream = self._stream
+        while True:
+            data = stream.read(1)
+            if not data:
+                return
+            if data == b'\x01':
+                stream.write(_RAW_REPL_PROMPT)
+                self._raw_repl()
+
+    def _raw_repl(self):
+        stream = self._stream
+        while True:
+            code = bytearray()
+            while True:
+                data = stream.read(1)
+                if not data or data == b'\x02':
+                    return
+                if data == b'\x04':
+                    break
+                code += data
+            stream.write(b'OK')
+            error = b''
+            try:
+                builtins = dict(__builtins__ if isinstance(__builtins__, dict) else vars(__builtins__))
+                builtins['__import__'] = self._import
+                exec(bytes(code).decode(), {'__builtins__': builtins, '__name__': '__main__'})
+            except Exception as e:
+                error = 'Traceback (most recent call last):\r\n{0}: {1}\r\n'.format(type(e).__name__, e).encode()
+            stream.write(b'\x04' + error + b'\x04>')
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if name in self._modules:
+            return self._modules[name]
+        return __import__(name, globals, locals, fromlist, level)
+
+class _Namespace:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+class _RamFlash:
+    def __init__(self, capacity: int, page_program_seconds: float):
+        self.memory = bytearray(b'\xff' * capacity)
+        self._page_program_seconds = page_program_seconds
+        self._skip_blank = False
+        self._pages = [0, 0]
+
+    def get_name(self) -> str:
+        return 'Loopback'
+
+    def get_capacity(self) -> int:
+        return len(self.memory)
+
+    def is_protect(self) -> bool:
+        return False
+
+    def set_protect(self, is_protect: bool):
+        pass
+
+    def erase_range(self, address: int, length: int):
+        start = address - address % 4096
+        end = (address + length + 4095) // 4096 * 4096
+        self.memory[start:end] = b'\xff' * (end - start)
+
+    def set_skip_blank(self, skip_blank: bool):
+        self._skip_blank = skip_blank
+
+    def reset_write_stats(self):
+        self._pages = [0, 0]
+
+    def get_write_stats(self):
+        return tuple(self._pages)
+
+    def write(self, address: int, write_buffer):
+        for index in range(0, len(write_buffer), 256):
+            page = bytes(write_buffer[index: index + 256])
+            if self._skip_blank and page.count(0xFF) == len(page):
+                self._pages[1] += 1
+                continue
+            for offset, value in enumerate(page):
+                self.memory[address + index + offset] &= value
+            self._pages[0] += 1
+            time.sleep(self._page_program_seconds)
+
+    def read(self, address: int, read_buffer):
+        read_buffer[:] = self.memory[address: address + len(read_buffer)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream an image into serial flash through the pyboard raw REPL.')
+    parser.add_argument('image')
+    parser.add_argument('--port', default='/dev/ttyACM0')
+    parser.add_argument('--hint', default=None, help='chip name for parts without JEDEC ID (e.g. 25AA640A)')
+    parser.add_argument('--address', type=lambda value: int(value, 0), default=0)
+    parser.add_argument('--chunk', type=int, default=4096, help='bytes per transfer')
+    parser.add_argument('--window', type=int, default=2, help='chunks in flight')
+    parser.add_argument('--loopback', action='store_true', help='use an in-process stand-in instead of a board')
+    parser.add_argument('--page-time', type=float, default=0.0007, help='loopback page program time in seconds')
+    parser.add_argument('--link-speed', type=float, default=1000000, help='loopback USB throughput in bytes/s')
+    parser.add_argument('--simulate', default=None, help='loopback with the real drivers on a simulated chip (e.g. W25Q32JV-IQ)')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as file:
+        image = file.read()
+    if args.loopback:
+        transport = LoopbackTransport(page_program_seconds=args.page_time, link_bytes_per_second=args.link_speed,
+                                      simulate=args.simulate)
+    else:
+        transport = SerialTransport(args.port)
+    try:
+        program(transport, image, args.hint, args.address, args.chunk, args.window)
+        if args.loopback and bytes(transport.flash.memory[args.address: args.address + len(image)]) != image:
+            raise StreamWriterError('Loopback contents differ from the image.')
+        print('Completed.')
+    except StreamWriterError as e:
+        print(e)
+        sys.exit(1)
+    finally:
+        transport.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,33 @@
 from serial_flash_accessor.serial_flash import SerialFlash
 from serial_flash_accessor.spi_device import SpiDevice
-from serial_flash_accessor.sst25vfxxxb_serial_flash import SST25VFxxxBSerialFlash
-from serial_flash_accessor.mx25_serial_flash import MX25SerialFlash
-from serial_flash_accessor.w25q_serial_flash import W25QSerialFlash
-from serial_flash_accessor.microchip_25xx640a_serial_flash import Microchip25XX640ASerialFlash
+from serial_flash_accessor.busy_waiter import FlashTimeoutError
+from serial_flash_accessor.flash_registry import FlashRegistry, load_driver
 
-def create_serial_flash(spi, cs_pin_id, hint: str = None) -> SerialFlash:
-    spi_device = SpiDevice(spi, cs_pin_id)
-    device_creators = [
-        Microchip25XX640ASerialFlash.create,
-        SST25VFxxxBSerialFlash.create,
-        MX25SerialFlash.create,
-        W25QSerialFlash.create,
-    ]
-    for device_creator in device_creators:
-        device = device_creator(spi_device, hint)
-        if device != None:
-            return device
-    return None
+# Drivers by JEDEC manufacturer ID (or chip names for the EEPROMs without RDID). A driver module
+# is imported when the JEDEC ID or the hint selects it, so only the present chip's driver takes
+# import time and heap. The tables are tuples of constants, which stay in flash when frozen.
+_DRIVERS = (
+    (0xBF, 'serial_flash_accessor.sst25vfxxxb_serial_flash', 'SST25VFxxxBSerialFlash'),
+    (0xC2, 'serial_flash_accessor.mx25_serial_flash', 'MX25SerialFlash'),
+    (0xEF, 'serial_flash_accessor.w25q_serial_flash', 'W25QSerialFlash'),
+)
+_NAMED_DRIVERS = (
+    (('25AA640A', '25LC640A'), 'serial_flash_accessor.microchip_25xx640a_serial_flash', 'Microchip25XX640ASerialFlash'),
+)
+_SFDP_DRIVER = (None, 'serial_flash_accessor.sfdp_serial_flash', 'SfdpSerialFlash')
+
+registry = FlashRegistry()
+for _driver in _NAMED_DRIVERS:
+    registry.register_named_lazy(_driver[0], _driver[1], _driver[2])
+for _driver in _DRIVERS:
+    registry.register_lazy(_driver[0], _driver[1], _driver[2])
+
+def create_serial_flash(spi, cs_pin_id, hint: str = None, miso_pin_id = None) -> SerialFlash:
+    return registry.create(SpiDevice(spi, cs_pin_id, miso_pin_id), hint)
+
+def __getattr__(name: str):
+    # The driver classes remain attributes of the package; the first access imports the module.
+    for driver in _DRIVERS + _NAMED_DRIVERS + (_SFDP_DRIVER,):
+        if driver[2] == name:
+            return load_driver(driver[1], name)
+    raise AttributeError(name)
@@ -0,0 +1,35 @@
+from micropython import const
+
+# How a chip takes addresses, from the chip_infos tables. Chips up to 16 MB always use 3 bytes.
+ADDRESS_MODE_3_BYTES = const(0)
+# Dedicated commands with a 4 byte address (0x13, 0x0C, 0x12, 0x21, 0x5C, 0xDC). They do not
+# depend on the chip's address mode, which may be 4 bytes after power up on some parts.
+ADDRESS_MODE_4_BYTE_OPCODES = const(1)
+# EN4B (0xB7) makes the usual commands take 4 byte addresses until EX4B (0xE9) or a reset.
+ADDRESS_MODE_EN4B = const(2)
+# The chip only takes 4 byte addresses.
+ADDRESS_MODE_4_BYTES = const(3)
+
+ENTER_4_BYTE_MODE = const(0xB7)
+EXIT_4_BYTE_MODE = const(0xE9)
+
+# The first 16 MB, all that 3 byte addresses reach.
+ADDRESS_3_BYTES_LIMIT = const(0x1000000)
+
+# 3 byte address command: the same command with a 4 byte address.
+_4_BYTE_OPCODES = {0x03: 0x13, 0x0B: 0x0C, 0x02: 0x12, 0x20: 0x21, 0x52: 0x5C, 0xD8: 0xDC}
+
+def select_address_mode(capacity: int, address_mode: int) -> int:
+    # 3 byte addresses while they reach the whole chip, otherwise the chip's 4 byte method.
+    if capacity <= ADDRESS_3_BYTES_LIMIT and address_mode != ADDRESS_MODE_4_BYTES:
+        return ADDRESS_MODE_3_BYTES
+    return address_mode
+
+def get_address_length(address_mode: int) -> int:
+    return 3 if address_mode == ADDRESS_MODE_3_BYTES else 4
+
+def address_command(address_mode: int, command: int) -> int:
+    # The opcode to send for command in address_mode.
+    if address_mode == ADDRESS_MODE_4_BYTE_OPCODES:
+        return _4_BYTE_OPCODES[command]
+    return command
@@ -0,0 +1,83 @@
+from micropython import const
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+_ERASE_BLOCK_SIZE = const(65536)
+_READ_CHUNK_SIZE = const(4096)
+
+class AsyncSerialFlash:
+    # uasyncio access to a SerialFlash that does not block other tasks. The chip is pipelined, so
+    # a program or erase command returns as soon as it is sent; the busy wait then sleeps with
+    # asyncio.sleep_ms for most of the typical time of the operation and polls the status in
+    # between. Every transaction holds lock, which should be shared with the other users of the
+    # SPI bus; they can use it while the chip is busy. Long reads, writes and erase ranges are
+    # split so other tasks also run between them. (SST25VF AAI programming still sends a whole
+    # page inside one write.)
+    def __init__(self, flash, lock = None):
+        self._flash = flash
+        self._lock = lock if lock != None else asyncio.Lock()
+        flash.set_pipelined(True)
+
+    def get_flash(self):
+        return self._flash
+
+    def get_lock(self):
+        return self._lock
+
+    async def sync_async(self):
+        while True:
+            async with self._lock:
+                wait_us = self._flash.poll_pending()
+            if wait_us == 0:
+                return
+            # Rounded up: sleep_ms(0) for a wait under 1 ms would poll without letting time pass.
+            await asyncio.sleep_ms((wait_us + 999) // 1000)
+
+    async def read_async(self, address: int, read_buffer):
+        read_buffer = memoryview(read_buffer)
+        await self.sync_async()
+        index = 0
+        while index != len(read_buffer):
+            read_len = min(_READ_CHUNK_SIZE, len(read_buffer) - index)
+            async with self._lock:
+                self._flash.read(address + index, read_buffer[index: index + read_len])
+            index += read_len
+            await asyncio.sleep_ms(0)
+
+    async def write_async(self, address: int, write_buffer):
+        write_buffer = memoryview(write_buffer)
+        page_size = self._flash.get_page_size()
+        index = 0
+        while index != len(write_buffer):
+            page_len = min(page_size - (address + index) % page_size, len(write_buffer) - index)
+            await self.sync_async()
+            async with self._lock:
+                self._flash.write(address + index, write_buffer[index: index + page_len])
+            index += page_len
+
+    async def erase_async(self):
+        await self.sync_async()
+        async with self._lock:
+            self._flash.erase()
+        await self.sync_async()
+
+    async def erase_range_async(self, address: int, length: int):
+        # One 64 KB block or one sector per command, so other tasks run between them.
+        sector_size = self._flash.get_sector_size()
+        end = address + length
+        while address < end:
+            if address % _ERASE_BLOCK_SIZE == 0 and end - address >= _ERASE_BLOCK_SIZE:
+                step = _ERASE_BLOCK_SIZE
+            else:
+                step = min(sector_size - address % sector_size, end - address)
+            await self.sync_async()
+            async with self._lock:
+                self._flash.erase_range(address, step)
+            address += step
+        await self.sync_async()
+
+    async def close_async(self):
+        await self.sync_async()
+        self._flash.set_pipelined(False)
@@ -0,0 +1,154 @@
+from micropython import const
+from serial_flash_accessor.buffer_util import needs_erase, is_blank, is_equal, fill_blank
+
+_IOCTL_INIT = const(1)
+_IOCTL_DEINIT = const(2)
+_IOCTL_SYNC = const(3)
+_IOCTL_BLOCK_COUNT = const(4)
+_IOCTL_BLOCK_SIZE = const(5)
+_IOCTL_BLOCK_ERASE = const(6)
+
+class FlashBlockDevice:
+    # Block device (MicroPython's extended block protocol) for mounting os.VfsLfs2 or os.VfsFat on
+    # a SerialFlash. Blocks are written into a write-back cache of cache_sectors whole sectors. A
+    # sector goes back to the chip when it is evicted (least recently used first) or on sync, with
+    # at most one erase however many of its blocks changed; if the new data only clears bits the
+    # changed pages are programmed without an erase; EEPROMs are never erased and only get their
+    # changed pages programmed. start and length select a range of sectors.
+    def __init__(self, flash, block_size: int = 512, cache_sectors: int = 2, start: int = 0, length: int = 0):
+        sector_size = flash.get_sector_size()
+        if length == 0:
+            length = flash.get_capacity() - start
+        if sector_size % block_size != 0:
+            raise ValueError('The block size must divide the sector size ({0}).'.format(sector_size))
+        if start < 0 or start % sector_size != 0 or length % sector_size != 0 or start + length > flash.get_capacity():
+            raise ValueError('The range must be whole sectors within the chip.')
+        if cache_sectors < 1:
+            raise ValueError('At least one sector must be cached.')
+        self._flash = flash
+        self._block_size = block_size
+        self._sector_size = sector_size
+        self._start = start
+        self._length = length
+        # [sector address, data, dirty], the most recently used last.
+        self._cache = [[-1, bytearray(sector_size), False] for _ in range(cache_sectors)]
+        self._scratch = memoryview(bytearray(sector_size))
+        self.reset_cache_stats()
+
+    def readblocks(self, block_num: int, buffer, offset: int = 0):
+        buffer = memoryview(buffer)
+        address = self._block_address(block_num, offset, len(buffer))
+        index = 0
+        while index != len(buffer):
+            sector_offset = (address + index) % self._sector_size
+            piece_len = min(self._sector_size - sector_offset, len(buffer) - index)
+            entry = self._find(address + index - sector_offset)
+            if entry != None:
+                buffer[index: index + piece_len] = entry[1][sector_offset: sector_offset + piece_len]
+            else:
+                # Sectors that are not cached are read straight from the chip and not cached.
+                self._flash.read(address + index, buffer[index: index + piece_len])
+            index += piece_len
+
+    def writeblocks(self, block_num: int, buffer, offset: int = 0):
+        buffer = memoryview(buffer)
+        address = self._block_address(block_num, offset, len(buffer))
+        index = 0
+        while index != len(buffer):
+            sector_offset = (address + index) % self._sector_size
+            piece_len = min(self._sector_size - sector_offset, len(buffer) - index)
+            entry = self._load(address + index - sector_offset, piece_len == self._sector_size)
+            entry[1][sector_offset: sector_offset + piece_len] = buffer[index: index + piece_len]
+            entry[2] = True
+            index += piece_len
+
+    def ioctl(self, op: int, arg: int):
+        if op == _IOCTL_INIT:
+            return 0
+        if op == _IOCTL_DEINIT or op == _IOCTL_SYNC:
+            self.sync()
+            return 0
+        if op == _IOCTL_BLOCK_COUNT:
+            return self._length // self._block_size
+        if op == _IOCTL_BLOCK_SIZE:
+            return self._block_size
+        if op == _IOCTL_BLOCK_ERASE:
+            # The erase is only recorded in the cache; the sector is erased when it is written back.
+            address = self._block_address(arg, 0, self._block_size)
+            sector_offset = address % self._sector_size
+            entry = self._load(address - sector_offset, self._block_size == self._sector_size)
+            fill_blank(memoryview(entry[1])[sector_offset: sector_offset + self._block_size])
+            entry[2] = True
+            return 0
+        return None
+
+    def sync(self):
+        for entry in sorted(self._cache, key=lambda entry: entry[0]):
+            self._write_back(entry)
+
+    def get_cache_stats(self):
+        # Returns (cache hits, cache misses, erased sectors, sectors programmed without an erase).
+        return (self._hits, self._misses, self._erased_sectors, self._programmed_sectors)
+
+    def reset_cache_stats(self):
+        self._hits = 0
+        self._misses = 0
+        self._erased_sectors = 0
+        self._programmed_sectors = 0
+
+    def _block_address(self, block_num: int, offset: int, length: int) -> int:
+        address = block_num * self._block_size + offset
+        if block_num < 0 or offset < 0 or address + length > self._length:
+            raise ValueError('The block is out of the device.')
+        return self._start + address
+
+    def _find(self, sector_address: int):
+        for entry in self._cache:
+            if entry[0] == sector_address:
+                return entry
+        return None
+
+    def _load(self, sector_address: int, overwrite: bool):
+        # Returns the cache entry of the sector, evicting the least recently used one on a miss.
+        # With overwrite the caller replaces the whole sector, so it is not read from the chip.
+        cache = self._cache
+        entry = self._find(sector_address)
+        if entry != None:
+            self._hits += 1
+        else:
+            self._misses += 1
+            entry = cache[0]
+            self._write_back(entry)
+            entry[0] = -1
+            if not overwrite:
+                self._flash.read(sector_address, entry[1])
+            entry[0] = sector_address
+        if entry is not cache[-1]:
+            cache.remove(entry)
+            cache.append(entry)
+        return entry
+
+    def _write_back(self, entry):
+        if not entry[2]:
+            return
+        address = entry[0]
+        data = memoryview(entry[1])
+        current = self._scratch
+        self._flash.read(address, current)
+        # Chips without an erase get every changed page programmed, blank ones included.
+        erase = self._flash.is_erasable() and needs_erase(current, data)
+        if not erase and is_equal(data, current):
+            entry[2] = False
+            return
+        if erase:
+            self._flash.erase_sector(address)
+            self._erased_sectors += 1
+        else:
+            self._programmed_sectors += 1
+        page_size = self._flash.get_page_size()
+        for page_address in range(0, self._sector_size, page_size):
+            page = data[page_address: page_address + page_size]
+            if (is_blank(page) if erase else is_equal(page, current[page_address: page_address + page_size])):
+                continue
+            self._flash.write(address + page_address, page)
+        entry[2] = False
@@ -0,0 +1,40 @@
+import micropython
+
+@micropython.native
+def needs_erase(current, data) -> bool:
+    # NOR flash can only clear bits by programming. Any bit that has to go from 0 back to 1 needs an erase.
+    for index in range(len(data)):
+        if data[index] & ~current[index]:
+            return True
+    return False
+
+@micropython.native
+def is_blank(data, start = 0, length = -1) -> bool:
+    # Checks data[start:start + length] (to the end if length is negative) without slicing it.
+    if length < 0:
+        length = len(data) - start
+    for index in range(start, start + length):
+        if data[index] != 0xFF:
+            return False
+    return True
+
+@micropython.viper
+def copy_into(destination, offset: int, source, source_offset: int, length: int):
+    # destination[offset:offset + length] = source[source_offset:source_offset + length] without
+    # the two slices that assignment would allocate.
+    destination_pointer = ptr8(destination)
+    source_pointer = ptr8(source)
+    for index in range(length):
+        destination_pointer[offset + index] = source_pointer[source_offset + index]
+
+@micropython.native
+def is_equal(data, other) -> bool:
+    for index in range(len(data)):
+        if data[index] != other[index]:
+            return False
+    return True
+
+@micropython.native
+def fill_blank(data):
+    for index in range(len(data)):
+        data[index] = 0xFF
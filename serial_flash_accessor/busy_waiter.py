@@ -0,0 +1,147 @@
+from micropython import const
+import time
+
+PAGE_PROGRAM = const(0)
+SECTOR_ERASE = const(1)
+BLOCK_ERASE = const(2)
+CHIP_ERASE = const(3)
+STATUS_WRITE = const(4)
+
+OPERATION_NAMES = ('page program', 'sector erase', 'block erase', 'chip erase', 'status write')
+
+class FlashTimeoutError(Exception):
+    pass
+
+class BusyWaiter:
+    # Waits for the busy bit of a status register. Most of the typical operation time is slept
+    # through without touching the bus, then the status is polled with an exponentially growing
+    # interval (capped at 1/32 of the typical time) until the operation finishes or its maximum
+    # time has passed.
+    #
+    # timings: ((typical us, maximum us), ...) indexed by PAGE_PROGRAM ... STATUS_WRITE.
+    def __init__(self, read_status, timings, busy_mask: int = 0x01):
+        self._read_status = read_status
+        self._timings = timings
+        self._busy_mask = busy_mask
+        self._pending_operation = -1
+        self._pending_start = 0
+        self._pending_polls = 0
+        self._suspended_operation = -1
+        self._suspended_elapsed = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._counts = [0, 0, 0, 0, 0]
+        self._polls = [0, 0, 0, 0, 0]
+        self._total_us = [0, 0, 0, 0, 0]
+        self._max_us = [0, 0, 0, 0, 0]
+
+    def get_stats(self) -> list:
+        # [[operation name, count, polls, total us, max us], ...] for the operations that ran.
+        return [[OPERATION_NAMES[operation], self._counts[operation], self._polls[operation],
+                 self._total_us[operation], self._max_us[operation]]
+                for operation in range(len(OPERATION_NAMES)) if self._counts[operation] != 0]
+
+    def defer(self, operation: int):
+        # Records an operation that has just been started; wait_pending() finishes it later,
+        # so the caller can do other work while the chip is busy.
+        self._pending_operation = operation
+        self._pending_start = time.ticks_us()
+        self._pending_polls = 0
+
+    def wait_pending(self):
+        operation = self._pending_operation
+        if operation >= 0:
+            self._pending_operation = -1
+            self.wait(operation, self._pending_start)
+
+    def poll_pending(self) -> int:
+        # wait_pending() for cooperative schedulers: returns 0 once the pending operation has
+        # finished (or if there is none), otherwise the microseconds to wait before calling again.
+        # The status is not read before most of the typical time has passed.
+        operation = self._pending_operation
+        if operation < 0:
+            return 0
+        timing = self._timings[operation]
+        typical = timing[0]
+        initial = typical - (typical >> 2)
+        elapsed = time.ticks_diff(time.ticks_us(), self._pending_start)
+        if elapsed < initial:
+            return initial - elapsed
+        status = self._read_status()
+        self._pending_polls += 1
+        elapsed = time.ticks_diff(time.ticks_us(), self._pending_start)
+        if status & self._busy_mask == 0:
+            self._pending_operation = -1
+            self._record(operation, self._pending_polls, elapsed)
+            return 0
+        if elapsed > timing[1]:
+            self._pending_operation = -1
+            self._record(operation, self._pending_polls, elapsed)
+            raise _timeout_error(operation, timing[1], status, self._pending_polls, elapsed)
+        return max(1, typical >> 5)
+
+    def suspend_pending(self) -> bool:
+        # Takes a pending page program or sector/block erase out of wait_pending() while the chip
+        # has it suspended; resume_pending() puts it back with the suspended time left out. False
+        # if nothing that can be suspended is pending.
+        operation = self._pending_operation
+        if operation != PAGE_PROGRAM and operation != SECTOR_ERASE and operation != BLOCK_ERASE:
+            return False
+        self._suspended_operation = operation
+        self._suspended_elapsed = time.ticks_diff(time.ticks_us(), self._pending_start)
+        self._pending_operation = -1
+        return True
+
+    def resume_pending(self):
+        self._pending_operation = self._suspended_operation
+        self._pending_start = time.ticks_add(time.ticks_us(), -self._suspended_elapsed)
+        self._suspended_operation = -1
+
+    def is_suspended(self) -> bool:
+        return self._suspended_operation >= 0
+
+    def wait(self, operation: int, start: int = None):
+        if start == None:
+            start = time.ticks_us()
+        timing = self._timings[operation]
+        typical = timing[0]
+        maximum = timing[1]
+        initial = typical - (typical >> 2)
+        elapsed = time.ticks_diff(time.ticks_us(), start)
+        if elapsed < initial:
+            _sleep_us(initial - elapsed)
+        interval = typical >> 6
+        interval_limit = typical >> 5
+        polls = 0
+        while True:
+            status = self._read_status()
+            polls += 1
+            elapsed = time.ticks_diff(time.ticks_us(), start)
+            if status & self._busy_mask == 0:
+                break
+            if elapsed > maximum:
+                self._record(operation, polls, elapsed)
+                raise _timeout_error(operation, maximum, status, polls, elapsed)
+            if interval != 0:
+                _sleep_us(interval)
+                interval = min(interval << 1, interval_limit)
+        self._record(operation, polls, elapsed)
+
+    def _record(self, operation: int, polls: int, elapsed: int):
+        self._counts[operation] += 1
+        self._polls[operation] += polls
+        self._total_us[operation] += elapsed
+        if elapsed > self._max_us[operation]:
+            self._max_us[operation] = elapsed
+
+def _timeout_error(operation: int, maximum: int, status: int, polls: int, elapsed: int):
+    return FlashTimeoutError('{0} did not finish within {1} us (status 0x{2:02X} after {3} polls in {4} us)'.format(
+        OPERATION_NAMES[operation], maximum, status, polls, elapsed))
+
+def _sleep_us(microseconds: int):
+    # sleep_ms lets the port idle or run other work; short waits need sleep_us resolution.
+    if microseconds >= 10000:
+        time.sleep_ms(microseconds // 1000)
+    else:
+        time.sleep_us(microseconds)
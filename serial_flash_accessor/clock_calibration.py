@@ -0,0 +1,104 @@
+from micropython import const
+
+# Prescalers of the pyboard SPI peripheral: the bus clock is source_clock / 2 ** n, n = 1..8.
+_PRESCALER_SHIFTS = const(8)
+_PATTERN_SIZE = const(1024)
+# Each clock must read the pattern back this many times without an error.
+_PASSES = const(3)
+
+def get_baudrates(source_clock: int) -> list:
+    # Achievable baudrates, fastest first.
+    return [source_clock >> shift for shift in range(1, _PRESCALER_SHIFTS + 1)]
+
+def get_effective_baudrate(frequency: int, source_clock: int) -> int:
+    # The baudrate the peripheral produces for frequency (rounded down, at least the slowest).
+    baudrates = get_baudrates(source_clock)
+    for baudrate in baudrates:
+        if baudrate <= frequency:
+            return baudrate
+    return baudrates[-1]
+
+def calibrate(flash, spi_device, source_clock: int, address: int = None) -> int:
+    # Returns the fastest achievable baudrate, up to the one the driver set from the datasheet,
+    # at which the chip reads back a test pattern reliably, or 0 if none does (the SPI device is
+    # left at the result, or the slowest baudrate). With address, the sector there is erased and
+    # the pattern written at the slowest clock, and it is erased again at the end (EEPROMs keep
+    # the pattern). Otherwise data at the start of the chip, read at the slowest clock, is the
+    # pattern; it must not be all one value (a blank chip reads like a floating MISO, at any
+    # clock), or ValueError is raised and a scratch address is needed. Only reads run at the
+    # faster clocks, so a failing clock cannot turn a command into an erase or a status write.
+    maximum = spi_device.get_frequency()
+    baudrates = get_baudrates(source_clock)
+    spi_device.set_frequency(baudrates[-1])
+    if address == None:
+        pattern = bytearray(min(_PATTERN_SIZE, flash.get_capacity()))
+        flash.read(0, pattern)
+        if pattern == bytes((pattern[0],)) * len(pattern):
+            spi_device.set_frequency(maximum)
+            raise ValueError('The start of the chip holds 0x{0:02X} only; give a scratch address.'.format(pattern[0]))
+    else:
+        pattern = bytearray(min(_PATTERN_SIZE, flash.get_sector_size()))
+        for index in range(len(pattern)):
+            # Runs of ones and zeros, alternating bits and a ramp.
+            pattern[index] = (0xFF, 0x00, 0x55, 0xAA, index & 0xFF)[(index >> 4) % 5]
+        flash.erase_range(address, flash.get_sector_size())
+        flash.write(address, pattern)
+    read_address = 0 if address == None else address
+    read_buffer = bytearray(len(pattern))
+    result = 0
+    for baudrate in baudrates:
+        if baudrate > maximum:
+            continue
+        spi_device.set_frequency(baudrate)
+        if _test(flash, read_address, pattern, read_buffer):
+            result = baudrate
+            break
+    spi_device.set_frequency(baudrates[-1])
+    if address != None:
+        flash.erase_range(address, flash.get_sector_size())
+    if result != 0:
+        spi_device.set_frequency(result)
+    return result
+
+def _test(flash, address: int, pattern: bytearray, read_buffer: bytearray) -> bool:
+    for _ in range(_PASSES):
+        flash.read(address, read_buffer)
+        if read_buffer != pattern:
+            return False
+    return True
+
+class ClockCache:
+    # Calibrated baudrates by chip, kept in a text file with one "<key> <baudrate>" line per chip.
+    # The key is the JEDEC ID in hex, or the chip name for chips without one.
+    def __init__(self, path: str):
+        self._path = path
+
+    @staticmethod
+    def get_key(flash) -> str:
+        jedec_id = flash.get_jedec_id()
+        if jedec_id == None:
+            return flash.get_name()
+        return ''.join(['{0:02X}'.format(d) for d in jedec_id])
+
+    def load(self, key: str) -> int:
+        # The cached baudrate, or 0.
+        return self._read().get(key, 0)
+
+    def save(self, key: str, baudrate: int):
+        entries = self._read()
+        entries[key] = baudrate
+        with open(self._path, 'w') as file:
+            for entry_key in entries:
+                file.write('{0} {1}\n'.format(entry_key, entries[entry_key]))
+
+    def _read(self) -> dict:
+        entries = {}
+        try:
+            with open(self._path, 'r') as file:
+                for line in file:
+                    fields = line.split()
+                    if len(fields) == 2:
+                        entries[fields[0]] = int(fields[1])
+        except OSError:
+            pass
+        return entries
@@ -0,0 +1,17 @@
+def plan_erase(address: int, length: int, erase_types) -> list:
+    # erase_types: [[size, command], ...] ordered from the largest block to the smallest sector.
+    # Returns [[command, address, size], ...] covering the range rounded out to the smallest size.
+    granularity = erase_types[-1][0]
+    start = address - (address % granularity)
+    end = address + length
+    if end % granularity != 0:
+        end += granularity - (end % granularity)
+    plan = []
+    while start < end:
+        for erase_type in erase_types:
+            size = erase_type[0]
+            if start % size == 0 and start + size <= end:
+                plan.append([erase_type[1], start, size])
+                start += size
+                break
+    return plan
@@ -0,0 +1,79 @@
+try:
+    import uhashlib as hashlib
+except ImportError:
+    import hashlib
+try:
+    from binascii import crc32
+except ImportError:
+    crc32 = None
+from binascii import hexlify
+
+class _Crc32:
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = crc32(data, self._value)
+
+    def digest(self) -> bytes:
+        return self._value.to_bytes(4, 'big')
+
+def new_hash(algorithm: str):
+    if algorithm == 'sha256':
+        return hashlib.sha256()
+    if algorithm == 'crc32':
+        if crc32 == None:
+            raise ValueError('crc32 is not available on this port.')
+        return _Crc32()
+    raise ValueError('Unsupported digest algorithm: {0}'.format(algorithm))
+
+def to_hex(digest: bytes) -> str:
+    return hexlify(digest).decode()
+
+class DigestEngine:
+    # Running digest that is split into regions of region_size bytes (0 means a single region),
+    # so a mismatch can be located without comparing the data itself.
+    def __init__(self, algorithm: str = 'sha256', region_size: int = 0):
+        self._algorithm = algorithm
+        self._region_size = region_size
+        self._region_left = region_size
+        self._hash = new_hash(algorithm)
+        self._digests = []
+
+    def update(self, data):
+        if self._region_size == 0:
+            self._hash.update(data)
+            return
+        index = 0
+        data_len = len(data)
+        while index != data_len:
+            length = min(self._region_left, data_len - index)
+            self._hash.update(data[index: index + length])
+            self._region_left -= length
+            index += length
+            if self._region_left == 0:
+                self._digests.append(self._hash.digest())
+                self._hash = new_hash(self._algorithm)
+                self._region_left = self._region_size
+
+    def digests(self) -> list:
+        if self._region_size == 0:
+            return [self._hash.digest()]
+        if self._region_left != self._region_size:
+            return self._digests + [self._hash.digest()]
+        return self._digests
+
+def digest_flash(flash, address: int, length: int, algorithm: str = 'sha256', region_size: int = 0, buffer_size: int = 4096) -> list:
+    engine = DigestEngine(algorithm, region_size)
+    for chunk in flash.read_chunks(address, length, buffer_size):
+        engine.update(chunk)
+    return engine.digests()
+
+def digest_file(file, algorithm: str = 'sha256', region_size: int = 0, buffer_size: int = 4096) -> list:
+    engine = DigestEngine(algorithm, region_size)
+    buffer = memoryview(bytearray(buffer_size))
+    while True:
+        read_count = file.readinto(buffer)
+        if read_count == 0:
+            return engine.digests()
+        engine.update(buffer[:read_count])
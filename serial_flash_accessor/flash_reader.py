@@ -0,0 +1,128 @@
+from micropython import const
+from serial_flash_accessor.buffer_util import copy_into
+
+_WINDOWS = const(2)
+
+class FlashReader:
+    # File-like reader (readinto/read/seek/tell) of the range [start, start + length) of a
+    # SerialFlash, for streaming assets. Data comes from two windows of window_size bytes aligned
+    # to window_size, each filled with a single read command, so small sequential reads cost no
+    # bus transfer until a window runs out. Reads of whole windows go straight into the caller's
+    # buffer. The SPI transfer blocks, so the next window is filled ahead of time only when the
+    # caller asks: prefetch() between frames (e.g. while audio DMA plays the last buffer) makes
+    # the following readinto() across the window boundary cost no transfer.
+    def __init__(self, flash, start: int = 0, length: int = None, window_size: int = 4096):
+        if length == None:
+            length = flash.get_capacity() - start
+        if start < 0 or length < 0 or start + length > flash.get_capacity():
+            raise ValueError('The address is out of the accessible range.')
+        self._flash = flash
+        self._start = start
+        self._length = length
+        self._window_size = window_size
+        self._windows = [memoryview(bytearray(window_size)) for _ in range(_WINDOWS)]
+        # Offset of the data in each window (-1 when empty) and its length.
+        self._window_offsets = [-1] * _WINDOWS
+        self._window_lengths = [0] * _WINDOWS
+        self._current = 0
+        self._position = 0
+        self.reset_stats()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._windows = None
+
+    def get_length(self) -> int:
+        return self._length
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self._length
+        if offset < 0:
+            raise ValueError('Negative seek position')
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer) -> int:
+        position = self._position
+        read_len = max(0, min(len(buffer), self._length - position))
+        window_size = self._window_size
+        index = 0
+        while index != read_len:
+            window = self._find_window(position)
+            if window < 0 and position % window_size == 0 and read_len - index >= window_size:
+                # Whole windows skip the copy.
+                direct_len = (read_len - index) // window_size * window_size
+                self._flash.read(self._start + position, memoryview(buffer)[index: index + direct_len])
+                self._direct_reads += 1
+                copy_len = direct_len
+            else:
+                if window < 0:
+                    window = self._fill(position - position % window_size, self._current ^ 1)
+                    self._refills += 1
+                else:
+                    self._hits += 1
+                self._current = window
+                window_offset = position - self._window_offsets[window]
+                copy_len = min(self._window_lengths[window] - window_offset, read_len - index)
+                copy_into(buffer, index, self._windows[window], window_offset, copy_len)
+            index += copy_len
+            position += copy_len
+        self._position = position
+        return read_len
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            size = self._length - self._position
+        buffer = bytearray(max(0, min(size, self._length - self._position)))
+        self.readinto(buffer)
+        return bytes(buffer)
+
+    def prefetch(self) -> bool:
+        # Fills the window after the one being read if it is not loaded yet. Returns True if the
+        # flash was read.
+        current_offset = self._window_offsets[self._current]
+        if current_offset < 0:
+            current_offset = self._position - self._position % self._window_size
+        offset = current_offset + self._window_size
+        if offset >= self._length or self._find_window(offset) >= 0:
+            return False
+        self._fill(offset, self._current ^ 1)
+        self._prefetches += 1
+        return True
+
+    def get_stats(self):
+        # Returns (window hits, on-demand refills, prefetched windows, direct reads) since the
+        # last reset.
+        return (self._hits, self._refills, self._prefetches, self._direct_reads)
+
+    def reset_stats(self):
+        self._hits = 0
+        self._refills = 0
+        self._prefetches = 0
+        self._direct_reads = 0
+
+    def _find_window(self, position: int) -> int:
+        for window in range(_WINDOWS):
+            offset = self._window_offsets[window]
+            if offset >= 0 and offset <= position < offset + self._window_lengths[window]:
+                return window
+        return -1
+
+    def _fill(self, offset: int, window: int) -> int:
+        fill_len = min(self._window_size, self._length - offset)
+        buffer = self._windows[window]
+        self._flash.read(self._start + offset, buffer if fill_len == len(buffer) else buffer[:fill_len])
+        self._window_offsets[window] = offset
+        self._window_lengths[window] = fill_len
+        return window
@@ -0,0 +1,66 @@
+from serial_flash_accessor.spi_device import SpiDevice
+
+_RDID_COMMAND = b'\x9F'
+_SFDP_MODULE = 'serial_flash_accessor.sfdp_serial_flash'
+_SFDP_CLASS = 'SfdpSerialFlash'
+
+def read_jedec_id(spi_device: SpiDevice) -> bytes:
+    jedec_id = bytearray(3)
+    spi_device.write_read(_RDID_COMMAND, jedec_id)
+    return bytes(jedec_id)
+
+def load_driver(module_name: str, class_name: str):
+    return getattr(__import__(module_name, None, None, (class_name,)), class_name)
+
+class FlashRegistry:
+    # Maps a JEDEC ID (manufacturer ID, memory type, capacity) to the driver class and chip_info
+    # for it, so a chip is identified with a single RDID. Chips without RDID (EEPROMs) are
+    # registered by name and selected with the hint. Unknown JEDEC IDs fall back to SFDP.
+    # Drivers registered lazily (by manufacturer ID or names and the module that holds them)
+    # are imported only when a chip selects them.
+    def __init__(self):
+        self._jedec_drivers = {}
+        self._named_drivers = {}
+        self._lazy_jedec_drivers = {}
+        self._lazy_named_drivers = {}
+
+    def register(self, driver_class, chip_infos):
+        for chip_info in chip_infos:
+            self._jedec_drivers[bytes(chip_info[0])] = (driver_class, chip_info)
+
+    def register_named(self, driver_class, chip_infos):
+        for chip_info in chip_infos:
+            self._named_drivers[chip_info[0]] = (driver_class, chip_info)
+
+    def register_lazy(self, manufacturer_id: int, module_name: str, class_name: str):
+        self._lazy_jedec_drivers[manufacturer_id] = (module_name, class_name)
+
+    def register_named_lazy(self, names, module_name: str, class_name: str):
+        for name in names:
+            self._lazy_named_drivers[name] = (module_name, class_name)
+
+    def create(self, spi_device: SpiDevice, hint: str = None):
+        lazy_driver = self._lazy_named_drivers.get(hint)
+        if lazy_driver != None:
+            driver_class = load_driver(lazy_driver[0], lazy_driver[1])
+            self._remove_lazy(self._lazy_named_drivers, lazy_driver)
+            self.register_named(driver_class, driver_class.get_chip_infos())
+        driver = self._named_drivers.get(hint)
+        if driver != None:
+            return driver[0](spi_device, driver[1])
+        jedec_id = read_jedec_id(spi_device)
+        lazy_driver = self._lazy_jedec_drivers.get(jedec_id[0])
+        if lazy_driver != None:
+            driver_class = load_driver(lazy_driver[0], lazy_driver[1])
+            self._remove_lazy(self._lazy_jedec_drivers, lazy_driver)
+            self.register(driver_class, driver_class.get_chip_infos())
+        driver = self._jedec_drivers.get(jedec_id)
+        if driver != None:
+            return driver[0](spi_device, driver[1])
+        if jedec_id == b'\xFF\xFF\xFF' or jedec_id == b'\x00\x00\x00':
+            return None
+        return load_driver(_SFDP_MODULE, _SFDP_CLASS).create(spi_device, jedec_id)
+
+    def _remove_lazy(self, lazy_drivers: dict, lazy_driver):
+        for key in [key for key in lazy_drivers if lazy_drivers[key] == lazy_driver]:
+            del lazy_drivers[key]
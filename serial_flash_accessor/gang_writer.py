@@ -0,0 +1,77 @@
+from micropython import const
+from serial_flash_accessor.flash_digest import digest_flash
+
+_ERASE_STEP = const(65536)
+
+class GangWriter:
+    # Writes the same data to several identical chips. The chips are pipelined and each page
+    # (or erase block) is sent to every chip in turn, so a chip programs while the data for the
+    # others is clocked out. A chip that raises is recorded as failed and left out afterwards.
+    def __init__(self, flashes: list):
+        self._flashes = flashes
+        self._errors = [None] * len(flashes)
+        self._page_size = min([flash.get_page_size() for flash in flashes])
+        for index in self._active():
+            self._call(index, self._flashes[index].set_pipelined, True)
+
+    def get_errors(self) -> list:
+        # None for each chip that has not failed, otherwise the message of its error.
+        return self._errors
+
+    def fail(self, index: int, message: str):
+        if self._errors[index] == None:
+            self._errors[index] = message
+
+    def erase_range(self, address: int, length: int):
+        end = address + length
+        while address < end:
+            step = min(_ERASE_STEP - address % _ERASE_STEP, end - address)
+            for index in self._active():
+                self._call(index, self._flashes[index].erase_range, address, step)
+            address += step
+
+    def write(self, address: int, data):
+        page_size = self._page_size
+        end = address + len(data)
+        offset = 0
+        while address != end:
+            page_len = min(page_size - address % page_size, end - address)
+            page = data[offset: offset + page_len]
+            for index in self._active():
+                self._call(index, self._flashes[index].write, address, page)
+            address += page_len
+            offset += page_len
+
+    def sync(self):
+        for index in self._active():
+            self._call(index, self._flashes[index].sync)
+
+    def close(self):
+        for index in range(len(self._flashes)):
+            try:
+                self._flashes[index].set_pipelined(False)
+            except Exception as exception:
+                self.fail(index, _describe(exception))
+
+    def digests(self, address: int, length: int, algorithm: str = 'sha256', region_size: int = 0) -> list:
+        # digest_flash of each chip, None for failed chips.
+        results = [None] * len(self._flashes)
+        self.sync()
+        for index in self._active():
+            try:
+                results[index] = digest_flash(self._flashes[index], address, length, algorithm, region_size)
+            except Exception as exception:
+                self.fail(index, _describe(exception))
+        return results
+
+    def _active(self) -> list:
+        return [index for index in range(len(self._flashes)) if self._errors[index] == None]
+
+    def _call(self, index: int, function, *args):
+        try:
+            function(*args)
+        except Exception as exception:
+            self.fail(index, _describe(exception))
+
+def _describe(exception) -> str:
+    return '{0}: {1}'.format(type(exception).__name__, exception)
@@ -0,0 +1,125 @@
+import os
+try:
+    import deflate
+except ImportError:
+    deflate = None
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
+GZIP = 'gzip'
+ZLIB = 'zlib'
+DEFLATE = 'deflate'
+
+_EXTENSIONS = (('.gz', GZIP), ('.zlib', ZLIB), ('.deflate', DEFLATE))
+
+def compression_from_name(name: str) -> str:
+    for extension, compression in _EXTENSIONS:
+        if name.endswith(extension):
+            return compression
+    return None
+
+class ImageFile:
+    # Image to be written, read through readinto(). A compressed image (gzip, zlib or raw
+    # deflate) is decompressed while it is read, with a window of 2**window_bits bytes, so the
+    # image is never held in RAM. 0 takes the window from a zlib header and uses 32 KB for gzip
+    # and raw deflate, which do not record it; pass the compressor's value to save RAM.
+    # compression 'auto' chooses by file name extension (.gz, .zlib, .deflate).
+    def __init__(self, name: str, compression: str = 'auto', window_bits: int = 0):
+        if compression == 'auto':
+            compression = compression_from_name(name)
+        if compression not in (None, GZIP, ZLIB, DEFLATE):
+            raise ValueError('Unsupported compression: {0}'.format(compression))
+        self._name = name
+        self._compression = compression
+        self._window_bits = window_bits
+        self._compressed_size = os.stat(name)[6]
+        self._file = open(name, 'rb')
+        self._reader = self._file
+        if compression == None:
+            self._size = self._compressed_size
+        elif compression == GZIP:
+            # ISIZE, the last 4 bytes of a gzip member, is the uncompressed size modulo 2**32.
+            trailer = bytearray(4)
+            self._file.seek(self._compressed_size - 4)
+            self._file.readinto(trailer)
+            self._size = trailer[0] | (trailer[1] << 8) | (trailer[2] << 16) | (trailer[3] << 24)
+            self.seek(0)
+        else:
+            self.seek(0)
+            self._size = self._skip(-1)
+            self.seek(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def get_size(self) -> int:
+        return self._size
+
+    def get_compressed_size(self) -> int:
+        return self._compressed_size
+
+    def get_compression(self) -> str:
+        return self._compression
+
+    def readinto(self, buffer) -> int:
+        return self._reader.readinto(buffer)
+
+    def seek(self, offset: int):
+        # A compressed image is decompressed again from its start up to offset.
+        self._file.seek(0 if self._compression != None else offset)
+        if self._compression != None:
+            self._reader = _open_decompressor(self._file, self._compression, self._window_bits)
+            self._skip(offset)
+
+    def _skip(self, count: int) -> int:
+        # Reads and discards count bytes (all of them if count is negative); returns the number read.
+        buffer = memoryview(bytearray(1024))
+        skipped = 0
+        while count < 0 or skipped != count:
+            read_count = self._reader.readinto(buffer if count < 0 else buffer[:min(1024, count - skipped)])
+            if read_count == 0:
+                break
+            skipped += read_count
+        return skipped
+
+def _open_decompressor(stream, compression: str, window_bits: int):
+    if deflate != None:
+        formats = {GZIP: deflate.GZIP, ZLIB: deflate.ZLIB, DEFLATE: deflate.RAW}
+        if window_bits == 0 and compression != ZLIB:
+            window_bits = 15
+        return deflate.DeflateIO(stream, formats[compression], window_bits)
+    if hasattr(zlib, 'DecompIO'):
+        # uzlib takes the window in wbits: negative for raw deflate, +16 for gzip.
+        window_bits = window_bits or 15
+        wbits = {GZIP: window_bits + 16, ZLIB: window_bits, DEFLATE: -window_bits}
+        return zlib.DecompIO(stream, wbits[compression])
+    if zlib != None:
+        return _DecompressReader(stream, {GZIP: 31, ZLIB: 15, DEFLATE: -15}[compression])
+    raise ValueError('No decompressor is available on this port.')
+
+class _DecompressReader:
+    # CPython stand-in for DeflateIO built on zlib.decompressobj.
+    def __init__(self, stream, wbits: int):
+        self._stream = stream
+        self._decompressor = zlib.decompressobj(wbits)
+        self._input = bytearray(1024)
+        self._pending = b''
+
+    def readinto(self, buffer) -> int:
+        while len(self._pending) < len(buffer) and not self._decompressor.eof:
+            read_count = self._stream.readinto(self._input)
+            if read_count == 0:
+                break
+            self._pending += self._decompressor.decompress(bytes(self._input[:read_count]))
+        read_count = min(len(buffer), len(self._pending))
+        buffer[:read_count] = self._pending[:read_count]
+        self._pending = self._pending[read_count:]
+        return read_count
@@ -1,40 +1,55 @@
 from micropython import const
 from serial_flash_accessor.spi_device import SpiDevice
 from serial_flash_accessor.serial_flash import SerialFlash
+from serial_flash_accessor.busy_waiter import BusyWaiter, PAGE_PROGRAM, STATUS_WRITE
+from serial_flash_accessor.buffer_util import copy_into
+
+_READ  = const(0b0000_0011)
+_WRITE = const(0b0000_0010)
+_WRDI  = const(0b0000_0100)
+_WREN  = const(0b0000_0110)
+_RDSR  = const(0b0000_0101)
+_WRSR  = const(0b0000_0001)
+
+_BP_VALUE = const(0b0000_1100)
+_BP_NONE = const(0b00000_0000)
+
+_PAGE_SIZE = const(32)
+
+# Typical and maximum times in microseconds (25XX640A write cycle), indexed by busy_waiter operation.
+_TIMINGS = (
+    (3500, 5000),           # Page program
+    (0, 0),                 # Sector erase
+    (0, 0),                 # Block erase
+    (0, 0),                 # Chip erase
+    (3500, 5000),           # Status write
+)
+
+_KILOBIT = const(1 << 10)
+_MEGA_HZ = const(1000000)
+_CHIP_INFOS = (
+    ( '25AA640A', 64 * _KILOBIT >> 3, 5 * _MEGA_HZ ),
+    ( '25LC640A', 64 * _KILOBIT >> 3, 5 * _MEGA_HZ ),
+)
 
 class Microchip25XX640ASerialFlash(SerialFlash):
-    _READ  = const(0b0000_0011)
-    _WRITE = const(0b0000_0010)
-    _WRDI  = const(0b0000_0100)
-    _WREN  = const(0b0000_0110)
-    _RDSR  = const(0b0000_0101)
-    _WRSR  = const(0b0000_0001)
-
-    _BP_VALUE = const(0b0000_1100)
-    _BP_NONE = const(0b00000_0000)
-
-    _PAGE_SIZE = const(32)
-
     @staticmethod
-    def create(spi_device: SpiDevice, hint: str):
-        MEGABIT = 2 ** 20
-        KILOBIT = 2 ** 10 
-        MEGA_HZ  = 1000 * 1000
-        chip_infos = [
-            [ '25AA640A', 64 * KILOBIT >> 3, 5 * MEGA_HZ ],
-            [ '25LC640A', 64 * KILOBIT >> 3, 5 * MEGA_HZ ],
-        ]
-        for chip_info in chip_infos:
-            if chip_info[0] == hint:
-                return Microchip25XX640ASerialFlash(spi_device, chip_info)
-        return None
+    def get_chip_infos() -> tuple:
+        return _CHIP_INFOS
 
     def __init__(self, spi_device: SpiDevice, chip_info):
-        self._buffer = memoryview(bytearray(3))
+        # Page programs send the header and the page from this buffer as one write.
+        buffer = memoryview(bytearray(3 + _PAGE_SIZE))
+        self._buffer = buffer
+        # Views of the first bytes of the buffer, made once so that commands do not allocate.
+        self._prefixes = [buffer[:length] for length in range(4)]
         self._spi_device = spi_device
         self._name = chip_info[0]
         self._capacity = chip_info[1]
         spi_device.set_frequency(chip_info[2])
+        self._programmed_pages = 0
+        self._busy_waiter = BusyWaiter(self._read_status, _TIMINGS)
+        self._pipelined = False
 
     def get_vendor(self) -> str:
         return 'Microchip'
@@ -51,22 +66,22 @@ class Microchip25XX640ASerialFlash(SerialFlash):
     def set_protect(self, is_protect: bool):
         self._execute_command(_WREN)
         self._write_status(_BP_VALUE if is_protect else _BP_NONE)
-        self._wait_ready()
+        self._wait_ready(STATUS_WRITE)
 
     def is_protect(self) -> bool:
         return self._read_status() & _BP_VALUE != 0
 
     def read(self, address: int, read_buffer: bytearray):
-        if address + len(read_buffer) >= self._capacity:
+        if address < 0 or address + len(read_buffer) > self._capacity:
             raise ValueError('The address is out of the accessible range.')
         buffer =  self._setup_address(_READ, address)
-        return self._spi_device.write_read(buffer[:3], read_buffer)
+        return self._spi_device.write_read(self._prefixes[3], read_buffer)
 
     def write(self, address:int, write_buffer: bytearray):
         if self.is_protect():
            raise Exception("This chip is write protected.")
         write_len = len(write_buffer)
-        if address + write_len >= self._capacity:
+        if address < 0 or address + write_len > self._capacity:
             raise ValueError('The write address is out of the accessible range.')
         if write_len == 0:
             return
@@ -75,19 +90,68 @@ class Microchip25XX640ASerialFlash(SerialFlash):
             page_address = address + index
             page_len = min(_PAGE_SIZE - (page_address % _PAGE_SIZE), write_len - index)
             self._execute_command(_WREN)
-            self._setup_address(_WRITE, page_address)
-            self._spi_device.writes([self._buffer[:3], write_buffer[index: index + page_len]])
-            self._wait_ready()
+            buffer = self._setup_address(_WRITE, page_address)
+            copy_into(buffer, 3, write_buffer, index, page_len)
+            self._spi_device.write(buffer if 3 + page_len == len(buffer) else buffer[:3 + page_len])
+            self._wait_ready(PAGE_PROGRAM)
+            self._programmed_pages += 1
             index += page_len
 
     def erase(self):
         pass
 
-    def _wait_ready(self):
-        while self._read_status() & 0x1 == 1:
-            pass
+    def get_page_size(self) -> int:
+        return _PAGE_SIZE
+
+    def is_erasable(self) -> bool:
+        return False
+
+    def set_skip_blank(self, skip_blank: bool):
+        # EEPROM cells are overwritten in place and never erased, so 0xFF pages must still be written.
+        pass
+
+    def get_write_stats(self):
+        return (self._programmed_pages, 0)
+
+    def reset_write_stats(self):
+        self._programmed_pages = 0
+
+    def set_pipelined(self, pipelined: bool):
+        # Supported for the common API, but the write cycle of each 32 byte page dwarfs the host
+        # work that can overlap it, so writes get barely faster.
+        self._pipelined = pipelined
+        if not pipelined:
+            self._busy_waiter.wait_pending()
+
+    def sync(self):
+        self._busy_waiter.wait_pending()
+
+    def poll_pending(self) -> int:
+        return self._busy_waiter.poll_pending()
+
+    def get_wait_stats(self) -> list:
+        return self._busy_waiter.get_stats()
+
+    def reset_wait_stats(self):
+        self._busy_waiter.reset_stats()
+
+    def get_sector_size(self) -> int:
+        return _PAGE_SIZE
+
+    def erase_sector(self, address: int):
+        pass
+
+    def erase_range(self, address: int, length: int):
+        pass
+
+    def _wait_ready(self, operation: int):
+        if self._pipelined and operation != STATUS_WRITE:
+            self._busy_waiter.defer(operation)
+        else:
+            self._busy_waiter.wait(operation)
 
     def _setup_address(self, command:int, address:int) -> bytearray:
+        self._busy_waiter.wait_pending()
         buffer = self._buffer
         buffer[0] = command
         buffer[1] = (address >> 8) & 0xFF
@@ -102,14 +166,16 @@ class Microchip25XX640ASerialFlash(SerialFlash):
         buffer = self._buffer
         buffer[0] = _WRSR
         buffer[1] = value
-        self._spi_device.write(buffer[:2])
+        self._spi_device.write(self._prefixes[2])
 
     def _execute_command(self, command: int, read_len: int = 0) -> bytearray:
+        if command != _RDSR:
+            self._busy_waiter.wait_pending()
         buffer = self._buffer
         buffer[0] = command
         if read_len == 0:
-            self._spi_device.write(buffer[:1])
+            self._spi_device.write(self._prefixes[1])
             return None
         else:
-            self._spi_device.write_read(buffer[:1], buffer[:read_len])
-            return buffer[:read_len]
+            self._spi_device.write_read(self._prefixes[1], self._prefixes[read_len])
+            return self._prefixes[read_len]
@@ -1,71 +1,124 @@
 from micropython import const
+import time
 from serial_flash_accessor.spi_device import SpiDevice
 from serial_flash_accessor.serial_flash import SerialFlash
+from serial_flash_accessor.busy_waiter import FlashTimeoutError, BusyWaiter, PAGE_PROGRAM, SECTOR_ERASE, BLOCK_ERASE, CHIP_ERASE, STATUS_WRITE
+from serial_flash_accessor.erase_planner import plan_erase
+from serial_flash_accessor.buffer_util import is_blank, copy_into
+from serial_flash_accessor.address_mode import ADDRESS_MODE_3_BYTES, ADDRESS_MODE_4_BYTE_OPCODES, ADDRESS_MODE_EN4B, ENTER_4_BYTE_MODE, EXIT_4_BYTE_MODE, select_address_mode, get_address_length, address_command
 
-class MX25SerialFlash(SerialFlash):
-    _WREN = const(0x06)
-    _WRSR = const(0x01)
-    _RDID = const(0x9F)
-    _RDSR = const(0x05)
-    _READ = const(0x03)
-    _READ_FAST = const(0x0B)
-    _CE = const(0x60)
-    _PP = const(0x02)
-
-    _BP0 = const(0x04)
-    _BP1 = const(0x08)
-    _BP2 = const(0x10)
-    _BP3 = const(0x20)
-    _BP_NONE = const(0x00)
-    _BUSY = const(0x01)
-
-    _PAGE_SIZE = const(256)
+_WREN = const(0x06)
+_WRSR = const(0x01)
+_RDID = const(0x9F)
+_RDSR = const(0x05)
+_READ = const(0x03)
+_READ_FAST = const(0x0B)
+_CE = const(0x60)
+_SE = const(0x20)
+_BE32 = const(0x52)
+_BE64 = const(0xD8)
+_PP = const(0x02)
+_SUSPEND = const(0xB0)
+_RESUME = const(0x30)
+
+_BP0 = const(0x04)
+_BP1 = const(0x08)
+_BP2 = const(0x10)
+_BP3 = const(0x20)
+_BP_NONE = const(0x00)
+_BUSY = const(0x01)
+# Suspend latency, also the minimum time from a resume to the next suspend (MX25L25645G).
+_SUSPEND_US = const(20)
+
+_PAGE_SIZE = const(256)
+_SECTOR_SIZE = const(4096)
+_BLOCK32_SIZE = const(32768)
+_BLOCK64_SIZE = const(65536)
+
+# Typical and maximum times in microseconds (MX25L4006E), indexed by busy_waiter operation.
+_TIMINGS = (
+    (1400, 5000),           # Page program
+    (60000, 300000),        # Sector erase
+    (700000, 2000000),      # Block erase
+    (3500000, 7500000),     # Chip erase
+    (5000, 40000),          # Status write
+)
+# MX25L25645G
+_TIMINGS_256M = (
+    (150, 750),             # Page program
+    (25000, 400000),        # Sector erase
+    (140000, 2000000),      # Block erase
+    (50000000, 150000000),  # Chip erase
+    (5000, 40000),          # Status write
+)
 
+_MEGABIT = const(1 << 20)
+_KILOBIT = const(1 << 10)
+_MEGA_HZ = const(1000000)
+_ERASE_4K_64K = ((_BLOCK64_SIZE, _BE64), (_SECTOR_SIZE, _SE))
+_ERASE_4K_32K_64K = ((_BLOCK64_SIZE, _BE64), (_BLOCK32_SIZE, _BE32), (_SECTOR_SIZE, _SE))
+_CHIP_INFOS = (
+    # JEDEC ID         Name           Capacity          Min Op.MHz     Protect bits         Erase types       Address                      Suspend Timings
+    # MX25L25645G
+    ( b'\xC2\x20\x19', 'MX25L25645G', 256 * _MEGABIT >> 3, 133 * _MEGA_HZ, _BP0|_BP1|_BP2|_BP3, _ERASE_4K_32K_64K, ADDRESS_MODE_4_BYTE_OPCODES, True,   _TIMINGS_256M ),
+    # MX25L6406E
+    #( b'\xC2\x20\x17', 'MX25x64xx',  64 * _MEGABIT >> 3,  86 * _MEGA_HZ, _BP0|_BP1|_BP2|_BP3, _ERASE_4K_64K, ADDRESS_MODE_3_BYTES, False, _TIMINGS ),
+    # MX25L3206E/MX25L3233F/MX25L3236F/MX25L3273F
+    #( b'\xC2\x20\x16', 'MX25x32xx',  32 * _MEGABIT >> 3,  86 * _MEGA_HZ, _BP0|_BP1|_BP2|_BP3, _ERASE_4K_64K, ADDRESS_MODE_3_BYTES, False, _TIMINGS ),
+    # MX25L1606E/MX25V16066/MX25V1606F
+    #( b'\xC2\x20\x15', 'MX25x16xx',  16 * _MEGABIT >> 3,  80 * _MEGA_HZ, _BP0|_BP1|_BP2|_BP3, _ERASE_4K_64K, ADDRESS_MODE_3_BYTES, False, _TIMINGS ),
+    # MX25L8006E/MX25V80066
+    #( b'\xC2\x20\x14', 'MX25x80xx',   8 * _MEGABIT >> 3,  86 * _MEGA_HZ, _BP0|_BP1|_BP2, _ERASE_4K_64K, ADDRESS_MODE_3_BYTES, False, _TIMINGS ),
+    # MX25L4006E/MX25V40066/MX25L4026E
+    ( b'\xC2\x20\x13', 'MX25x40xx',   4 * _MEGABIT >> 3,  86 * _MEGA_HZ, _BP0|_BP1|_BP2, _ERASE_4K_64K, ADDRESS_MODE_3_BYTES, False, _TIMINGS ),
+    # MX25L2006E/MX25V20066/MX25V2033F/MX25V2039F/MX25L2026E
+    #( b'\xC2\x20\x12', 'MX25x20xx',   2 * _MEGABIT >> 3,  86 * _MEGA_HZ, _BP0|_BP1, _ERASE_4K_64K, ADDRESS_MODE_3_BYTES, False, _TIMINGS ),
+    # MX25L1006E/MX25V1006F/MX25L1026E
+    #( b'\xC2\x20\x11', 'MX25x10xx',   1 * _MEGABIT >> 3, 104 * _MEGA_HZ, _BP0|_BP1, _ERASE_4K_64K, ADDRESS_MODE_3_BYTES, False, _TIMINGS ),
+    #( b'\xC2\x22\x11', 'MX25L1021E',   1 * _MEGABIT >> 3,  45 * _MEGA_HZ ),
+    # MX25V5126F/MX25L5126F
+    #( b'\xC2\x22\x10', 'MX25L5121E', 512 * _KILOBIT >> 3,  45 * _MEGA_HZ ),
+    #( b'\xC2\x23\x15', 'MX25V1635F',  16 * _MEGABIT >> 3,  80 * _MEGA_HZ ),
+    #( b'\xC2\x23\x14', 'MX25V8035F',   8 * _MEGABIT >> 3, 108 * _MEGA_HZ ),
+    #( b'\xC2\x23\x13', 'MX25V4035F',   4 * _MEGABIT >> 3, 108 * _MEGA_HZ ),
+    #( b'\xC2\x25\x15', 'MX25L1636E',  16 * _MEGABIT >> 3, 133 * _MEGA_HZ ),
+    #( b'\xC2\x24\x15', 'MX25L1673E',  16 * _MEGABIT >> 3, 104 * _MEGA_HZ ),
+)
+
+class MX25SerialFlash(SerialFlash):
     @staticmethod
-    def create(spi_device: SpiDevice, hint: str):
-        jedec_id = bytearray(3)
-        spi_device.write_read(bytes([_RDID]), jedec_id)
-        MEGABIT = 2 ** 20
-        KILOBIT = 2 ** 10 
-        MEGA_HZ  = 1000 * 1000
-        chip_infos = [
-            # JEDEC ID         Name           Capacity          Min Op.MHz 
-            # MX25L6406E
-            #[ b'\xC2\x20\x17', 'MX25x64xx',  64 * MEGABIT >> 3,  86 * MEGA_HZ, _BP0|_BP1|_BP2|_BP3 ],
-            # MX25L3206E/MX25L3233F/MX25L3236F/MX25L3273F
-            #[ b'\xC2\x20\x16', 'MX25x32xx',  32 * MEGABIT >> 3,  86 * MEGA_HZ, _BP0|_BP1|_BP2|_BP3 ],
-            # MX25L1606E/MX25V16066/MX25V1606F
-            #[ b'\xC2\x20\x15', 'MX25x16xx',  16 * MEGABIT >> 3,  80 * MEGA_HZ, _BP0|_BP1|_BP2|_BP3 ],
-            # MX25L8006E/MX25V80066
-            #[ b'\xC2\x20\x14', 'MX25x80xx',   8 * MEGABIT >> 3,  86 * MEGA_HZ, _BP0|_BP1|_BP2 ],
-            # MX25L4006E/MX25V40066/MX25L4026E
-            [ b'\xC2\x20\x13', 'MX25x40xx',   4 * MEGABIT >> 3,  86 * MEGA_HZ, _BP0|_BP1|_BP2 ],
-            # MX25L2006E/MX25V20066/MX25V2033F/MX25V2039F/MX25L2026E
-            #[ b'\xC2\x20\x12', 'MX25x20xx',   2 * MEGABIT >> 3,  86 * MEGA_HZ, _BP0|_BP1 ],
-            # MX25L1006E/MX25V1006F/MX25L1026E
-            #[ b'\xC2\x20\x11', 'MX25x10xx',   1 * MEGABIT >> 3, 104 * MEGA_HZ, _BP0|_BP1 ],
-            #[ b'\xC2\x22\x11', 'MX25L1021E',   1 * MEGABIT >> 3,  45 * MEGA_HZ ],
-            # MX25V5126F/MX25L5126F
-            #[ b'\xC2\x22\x10', 'MX25L5121E', 512 * KILOBIT >> 3,  45 * MEGA_HZ ],
-            #[ b'\xC2\x23\x15', 'MX25V1635F',  16 * MEGABIT >> 3,  80 * MEGA_HZ ],
-            #[ b'\xC2\x23\x14', 'MX25V8035F',   8 * MEGABIT >> 3, 108 * MEGA_HZ ],
-            #[ b'\xC2\x23\x13', 'MX25V4035F',   4 * MEGABIT >> 3, 108 * MEGA_HZ ],
-            #[ b'\xC2\x25\x15', 'MX25L1636E',  16 * MEGABIT >> 3, 133 * MEGA_HZ ],
-            #[ b'\xC2\x24\x15', 'MX25L1673E',  16 * MEGABIT >> 3, 104 * MEGA_HZ ],
-        ]
-        for chip_info in chip_infos:
-            if chip_info[0] == jedec_id:
-                return MX25SerialFlash(spi_device, chip_info)
-        return None
+    def get_chip_infos() -> tuple:
+        return _CHIP_INFOS
 
     def __init__(self, spi_device: SpiDevice, chip_info):
-        self._buffer = memoryview(bytearray(6))
+        # Page programs send the header and the page from this buffer as one write.
+        buffer = memoryview(bytearray(5 + _PAGE_SIZE))
+        self._buffer = buffer
+        # Views of the first bytes of the buffer, made once so that commands do not allocate.
+        self._prefixes = [buffer[:length] for length in range(7)]
         self._spi_device = spi_device
         self._jedec_id = chip_info[0]
         self._name = chip_info[1]
         self._capacity = chip_info[2]
         spi_device.set_frequency(chip_info[3])
         self._protect_value = chip_info[4]
+        address_mode = select_address_mode(self._capacity, chip_info[6])
+        self._header_len = 1 + get_address_length(address_mode)
+        self._page_command = buffer[:self._header_len + _PAGE_SIZE]
+        self._read_command = address_command(address_mode, _READ_FAST)
+        self._program_command = address_command(address_mode, _PP)
+        self._sector_erase = address_command(address_mode, _SE)
+        self._erase_types = [[size, address_command(address_mode, command)] for size, command in chip_info[5]]
+        self._skip_blank = False
+        self._programmed_pages = 0
+        self._skipped_pages = 0
+        self._busy_waiter = BusyWaiter(self._read_status, chip_info[8])
+        self._pipelined = False
+        self._can_suspend = chip_info[7]
+        self._resumed = time.ticks_us()
+        self._address_mode = address_mode
+        if address_mode == ADDRESS_MODE_EN4B:
+            self._execute_command(ENTER_4_BYTE_MODE)
 
     def get_vendor(self) -> str:
         return 'Macronix'
@@ -84,33 +137,38 @@ class MX25SerialFlash(SerialFlash):
         buffer = self._buffer
         buffer[0] = _WRSR
         buffer[1] = self._protect_value if is_protect else _BP_NONE
-        self._spi_device.write(buffer[:2])
-        self._wait_ready()
+        self._spi_device.write(self._prefixes[2])
+        self._wait_ready(STATUS_WRITE)
 
     def is_protect(self) -> bool:
         return (self._read_status() & self._protect_value) != _BP_NONE
 
     def read(self, address: int, read_buffer: bytearray):
-        if address + len(read_buffer) >= self._capacity:
+        if address < 0 or address + len(read_buffer) > self._capacity:
             raise ValueError('The address is out of the accessible range.')
-        buffer =  self._setup_address(_READ_FAST, address)
-        buffer[4] = 0x00
-        return self._spi_device.write_read(buffer[:5], read_buffer)
+        buffer =  self._setup_address(self._read_command, address)
+        buffer[self._header_len] = 0x00
+        return self._spi_device.write_read(self._prefixes[self._header_len + 1], read_buffer)
 
     def write(self, address:int, write_buffer: bytearray):
         if self.is_protect():
            raise Exception("This chip is write protected.")
         write_len = len(write_buffer)
-        if address + write_len >= self._capacity:
+        if address < 0 or address + write_len > self._capacity:
             raise ValueError('The write address is out of the accessible range.')
         index = 0
         while index != write_len:
             page_address = address + index
             page_len = min(_PAGE_SIZE - (page_address % _PAGE_SIZE), write_len - index)
-            self._execute_command(_WREN)
-            self._setup_address(_PP, page_address)
-            self._spi_device.writes([self._buffer[:4], write_buffer[index: index + page_len]])
-            self._wait_ready()
+            if self._skip_blank and is_blank(write_buffer, index, page_len):
+                self._skipped_pages += 1
+            else:
+                self._execute_command(_WREN)
+                buffer = self._setup_address(self._program_command, page_address)
+                copy_into(buffer, self._header_len, write_buffer, index, page_len)
+                self._spi_device.write(self._page_command if page_len == _PAGE_SIZE else buffer[:self._header_len + page_len])
+                self._wait_ready(PAGE_PROGRAM)
+                self._programmed_pages += 1
             index += page_len
 
     def erase(self):
@@ -118,29 +176,129 @@ class MX25SerialFlash(SerialFlash):
           raise Exception("This chip is write protected.")
         self._execute_command(_WREN)
         self._execute_command(_CE)
-        self._wait_ready()
+        self._wait_ready(CHIP_ERASE)
+
+    def get_page_size(self) -> int:
+        return _PAGE_SIZE
+
+    def set_skip_blank(self, skip_blank: bool):
+        self._skip_blank = skip_blank
+
+    def get_write_stats(self):
+        return (self._programmed_pages, self._skipped_pages)
+
+    def reset_write_stats(self):
+        self._programmed_pages = 0
+        self._skipped_pages = 0
+
+    def set_pipelined(self, pipelined: bool):
+        self._pipelined = pipelined
+        if not pipelined:
+            self.resume()
+            self._busy_waiter.wait_pending()
+
+    def sync(self):
+        self.resume()
+        self._busy_waiter.wait_pending()
+
+    def close(self):
+        # EN4B parts go back to 3 byte addresses, which hosts and bootloaders expect after power up.
+        self.set_pipelined(False)
+        if self._address_mode == ADDRESS_MODE_EN4B:
+            self._execute_command(EXIT_4_BYTE_MODE)
+
+    def poll_pending(self) -> int:
+        self.resume()
+        return self._busy_waiter.poll_pending()
+
+    def suspend(self) -> bool:
+        busy_waiter = self._busy_waiter
+        if not self._can_suspend or not busy_waiter.suspend_pending():
+            return False
+        elapsed = time.ticks_diff(time.ticks_us(), self._resumed)
+        if elapsed < _SUSPEND_US:
+            time.sleep_us(_SUSPEND_US - elapsed)
+        if self._read_status() & _BUSY == 0:
+            # Already finished.
+            busy_waiter.resume_pending()
+            busy_waiter.wait_pending()
+            return False
+        self._buffer[0] = _SUSPEND
+        self._spi_device.write(self._prefixes[1])
+        time.sleep_us(_SUSPEND_US)
+        if self._read_status() & _BUSY:
+            self.resume()
+            raise FlashTimeoutError('suspend did not finish within {0} us'.format(_SUSPEND_US))
+        return True
 
-    def _wait_ready(self):
-        while (self._read_status() & _BUSY) != 0:
-            pass
+    def resume(self):
+        if self._busy_waiter.is_suspended():
+            self._buffer[0] = _RESUME
+            self._spi_device.write(self._prefixes[1])
+            self._resumed = time.ticks_us()
+            self._busy_waiter.resume_pending()
+
+    def get_wait_stats(self) -> list:
+        return self._busy_waiter.get_stats()
+
+    def reset_wait_stats(self):
+        self._busy_waiter.reset_stats()
+
+    def get_sector_size(self) -> int:
+        return _SECTOR_SIZE
+
+    def erase_sector(self, address: int):
+        if self.is_protect():
+          raise Exception("This chip is write protected.")
+        self._erase_block(self._sector_erase, address)
+
+    def erase_range(self, address: int, length: int):
+        if self.is_protect():
+          raise Exception("This chip is write protected.")
+        if address < 0 or address + length > self._capacity:
+            raise ValueError('The erase address is out of the accessible range.')
+        for command, block_address, _ in plan_erase(address, length, self._erase_types):
+            self._erase_block(command, block_address)
+
+    def _erase_block(self, command: int, address: int):
+        self._execute_command(_WREN)
+        self._setup_address(command, address)
+        self._spi_device.write(self._prefixes[self._header_len])
+        self._wait_ready(SECTOR_ERASE if command == self._sector_erase else BLOCK_ERASE)
+
+    def _wait_ready(self, operation: int):
+        if self._pipelined and operation != STATUS_WRITE:
+            self._busy_waiter.defer(operation)
+        else:
+            self._busy_waiter.wait(operation)
 
     def _setup_address(self, command:int, address:int) -> bytearray:
+        self._busy_waiter.wait_pending()
         buffer = self._buffer
         buffer[0] = command
-        buffer[1] = (address >> 16) & 0xFF
-        buffer[2] = (address >> 8) & 0xFF
-        buffer[3] = address & 0xFF
+        if self._header_len == 5:
+            buffer[1] = (address >> 24) & 0xFF
+            buffer[2] = (address >> 16) & 0xFF
+            buffer[3] = (address >> 8) & 0xFF
+            buffer[4] = address & 0xFF
+        else:
+            buffer[1] = (address >> 16) & 0xFF
+            buffer[2] = (address >> 8) & 0xFF
+            buffer[3] = address & 0xFF
         return buffer
 
     def _read_status(self) -> int:
         return self._execute_command(_RDSR, 1)[0]
 
     def _execute_command(self, command: int, read_len: int = 0) -> bytearray:
+        if command != _RDSR:
+            self.resume()
+            self._busy_waiter.wait_pending()
         buffer = self._buffer
         buffer[0] = command
         if read_len == 0:
-            self._spi_device.write(buffer[:1])
+            self._spi_device.write(self._prefixes[1])
             return None
         else:
-            self._spi_device.write_read(buffer[:1], buffer[:read_len])
-            return buffer[:read_len]
+            self._spi_device.write_read(self._prefixes[1], self._prefixes[read_len])
+            return self._prefixes[read_len]
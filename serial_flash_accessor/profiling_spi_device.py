@@ -0,0 +1,83 @@
+import time
+from serial_flash_accessor.spi_device import SpiDevice
+
+# Names of the commands of the supported chips, by opcode. Others are shown in hex.
+_COMMAND_NAMES = {
+    0x01: 'WRSR', 0x02: 'PP', 0x03: 'READ', 0x04: 'WRDI', 0x05: 'RDSR', 0x06: 'WREN', 0x0B: 'FAST_READ',
+    0x20: 'SE', 0x50: 'EWSR', 0x52: 'BE32', 0x5A: 'RDSFDP', 0x60: 'CE', 0x70: 'EBSY', 0x80: 'DBSY',
+    0x9F: 'RDID', 0xAD: 'AAI', 0xC7: 'CE', 0xD8: 'BE',
+    0x0C: 'FAST_READ4B', 0x12: 'PP4B', 0x13: 'READ4B', 0x21: 'SE4B', 0x5C: 'BE32_4B', 0xB7: 'EN4B', 0xDC: 'BE4B',
+    0xE9: 'EX4B', 0x75: 'SUSPEND', 0x7A: 'RESUME', 0xB0: 'SUSPEND', 0x30: 'RESUME',
+}
+# Key of the waits on the RY/BY# output (wait_miso_high), which select the chip without a command.
+_READY_PIN = -1
+
+class ProfilingSpiDevice(SpiDevice):
+    # SpiDevice that counts transactions, CS assertions and bytes and accumulates the time from
+    # CS low to CS high for each command (the first byte sent). Pass it to the registry instead
+    # of SpiDevice to profile a job; SpiDevice itself is unchanged, so there is no cost otherwise.
+    def __init__(self, spi, cs_pin_id, miso_pin_id = None):
+        super().__init__(spi, cs_pin_id, miso_pin_id)
+        self.reset_profile()
+
+    def reset_profile(self):
+        # opcode: [transactions, bytes out, bytes in, total us]
+        self._commands = {}
+        self._cs_assertions = 0
+        self._start = time.ticks_us()
+
+    # The opcode is taken before the transfer; drivers may read the reply into the same buffer.
+    def write(self, write_buffer):
+        opcode = write_buffer[0]
+        start = time.ticks_us()
+        super().write(write_buffer)
+        self._record(opcode, len(write_buffer), 0, start)
+
+    def writes(self, write_buffers):
+        opcode = write_buffers[0][0]
+        start = time.ticks_us()
+        super().writes(write_buffers)
+        self._record(opcode, sum([len(write_buffer) for write_buffer in write_buffers]), 0, start)
+
+    def write_read(self, write_buffer, read_buffer):
+        opcode = write_buffer[0]
+        start = time.ticks_us()
+        super().write_read(write_buffer, read_buffer)
+        self._record(opcode, len(write_buffer), len(read_buffer), start)
+
+    def wait_miso_high(self, timeout_us):
+        start = time.ticks_us()
+        ready = super().wait_miso_high(timeout_us)
+        self._record(_READY_PIN, 0, 0, start)
+        return ready
+
+    def get_profile(self) -> list:
+        # [[command name, transactions, bytes out, bytes in, total us], ...] by descending time.
+        profile = [[_command_name(opcode)] + self._commands[opcode] for opcode in self._commands]
+        profile.sort(key=lambda row: row[4], reverse=True)
+        return profile
+
+    def get_cs_assertions(self) -> int:
+        return self._cs_assertions
+
+    def get_elapsed_us(self) -> int:
+        # Time since reset_profile(); what the SPI transactions do not account for was spent
+        # elsewhere (busy-wait sleeps, file I/O, hashing).
+        return time.ticks_diff(time.ticks_us(), self._start)
+
+    def _record(self, opcode: int, out_len: int, in_len: int, start: int):
+        elapsed = time.ticks_diff(time.ticks_us(), start)
+        self._cs_assertions += 1
+        counters = self._commands.get(opcode)
+        if counters == None:
+            counters = [0, 0, 0, 0]
+            self._commands[opcode] = counters
+        counters[0] += 1
+        counters[1] += out_len
+        counters[2] += in_len
+        counters[3] += elapsed
+
+def _command_name(opcode: int) -> str:
+    if opcode == _READY_PIN:
+        return 'RY/BY#'
+    return _COMMAND_NAMES.get(opcode, '0x{0:02X}'.format(opcode))
@@ -0,0 +1,51 @@
+import os
+
+class ProgressJournal:
+    # Progress of a resumable write, kept in a small text file as one line:
+    # "<algorithm> <image digest> <image size> <erased 0/1> <verified address> <protected 0/1>".
+    # The file is replaced through a temporary file so an interruption leaves the old or the new
+    # line, never a partial one.
+    def __init__(self, path: str, algorithm: str, image_digest: str, image_size: int):
+        self._path = path
+        self._header = '{0} {1} {2}'.format(algorithm, image_digest, image_size)
+        self._erased = False
+        self._verified_address = 0
+        self._protected = False
+
+    def load(self) -> bool:
+        # True if a journal for the same image exists; its progress is then available.
+        try:
+            with open(self._path, 'r') as file:
+                fields = file.read().split()
+        except OSError:
+            return False
+        if len(fields) != 6 or ' '.join(fields[:3]) != self._header:
+            return False
+        self._erased = fields[3] == '1'
+        self._verified_address = int(fields[4])
+        self._protected = fields[5] == '1'
+        return True
+
+    def save(self, erased: bool, verified_address: int, protected: bool):
+        self._erased = erased
+        self._verified_address = verified_address
+        self._protected = protected
+        temporary_path = self._path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            file.write('{0} {1} {2} {3}\n'.format(self._header, 1 if erased else 0, verified_address, 1 if protected else 0))
+        os.rename(temporary_path, self._path)
+
+    def remove(self):
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+    def is_erased(self) -> bool:
+        return self._erased
+
+    def get_verified_address(self) -> int:
+        return self._verified_address
+
+    def is_protected(self) -> bool:
+        return self._protected
@@ -0,0 +1,246 @@
+import binascii
+from serial_flash_accessor.buffer_util import fill_blank
+
+RAW = 'raw'
+INTEL_HEX = 'ihex'
+SEGMENTS = 'segments'
+
+# Segment container: magic, little-endian u32 segment count, then per segment u32 address,
+# u32 length and the data.
+CONTAINER_MAGIC = b'SFSG'
+
+_HEX_EXTENSIONS = ('.hex', '.ihex')
+_HEX_DATA = 0x00
+_HEX_END_OF_FILE = 0x01
+_HEX_EXTENDED_SEGMENT_ADDRESS = 0x02
+_HEX_EXTENDED_LINEAR_ADDRESS = 0x04
+
+def detect_image_format(name: str) -> str:
+    # INTEL_HEX by extension, SEGMENTS by the container magic, otherwise RAW.
+    for extension in _HEX_EXTENSIONS:
+        if name.lower().endswith(extension):
+            return INTEL_HEX
+    with open(name, 'rb') as file:
+        if file.read(len(CONTAINER_MAGIC)) == CONTAINER_MAGIC:
+            return SEGMENTS
+    return RAW
+
+def merge_segments(segments: list, page_size: int, merge_gaps: bool = True) -> list:
+    # Bursts [[address, length, [segment, ...]], ...] in address order. Segments that touch or
+    # share a page go into one burst, so each page is programmed once; the gaps between them
+    # are written as 0xFF, which leaves the erased bytes as they are. Without merge_gaps (a chip
+    # without an erase, where 0xFF would overwrite the bytes in the gap) only touching segments
+    # are merged.
+    if not merge_gaps:
+        page_size = 1
+    bursts = []
+    for segment in sorted(segments, key=lambda segment: segment[0]):
+        if len(bursts) != 0:
+            burst = bursts[-1]
+            burst_end = burst[0] + burst[1]
+            if segment[0] < burst_end:
+                raise ValueError('Segments overlap at 0x{0:06x}'.format(segment[0]))
+            if segment[0] <= (burst_end + page_size - 1) // page_size * page_size:
+                burst[1] = segment[0] + segment[1] - burst[0]
+                burst[2].append(segment)
+                continue
+        bursts.append([segment[0], segment[1], [segment]])
+    return bursts
+
+def get_erase_ranges(bursts: list, sector_size: int) -> list:
+    # [[address, length], ...] covering the sectors of the bursts. Bursts that share a sector are
+    # erased together before anything is programmed.
+    erase_ranges = []
+    for burst in bursts:
+        start = burst[0] // sector_size * sector_size
+        end = (burst[0] + burst[1] + sector_size - 1) // sector_size * sector_size
+        if len(erase_ranges) != 0 and start <= erase_ranges[-1][0] + erase_ranges[-1][1]:
+            erase_ranges[-1][1] = end - erase_ranges[-1][0]
+        else:
+            erase_ranges.append([start, end - start])
+    return erase_ranges
+
+class SegmentedImage:
+    # Image whose segments are written at their own addresses, from an Intel HEX file or a
+    # segment container. Opening the file scans it once and keeps only the segment list
+    # ([address, length, file offset, extended address at that offset]); open_burst() reads the
+    # data again, so the image is never held in RAM. In Intel HEX, consecutive data records with
+    # contiguous addresses form one segment.
+    def __init__(self, name: str, image_format: str = 'auto'):
+        if image_format == 'auto':
+            image_format = detect_image_format(name)
+        if image_format != INTEL_HEX and image_format != SEGMENTS:
+            raise ValueError('Not a segmented image: {0}'.format(name))
+        self._format = image_format
+        self._file = open(name, 'rb')
+        try:
+            self._segments = self._scan_hex() if image_format == INTEL_HEX else self._scan_container()
+        except:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def get_format(self) -> str:
+        return self._format
+
+    def get_segments(self) -> list:
+        return self._segments
+
+    def get_size(self) -> int:
+        # Bytes of data in all segments.
+        return sum([segment[1] for segment in self._segments])
+
+    def open_burst(self, burst: list):
+        # Reader of the burst's bytes (readinto), gaps between its segments filled with 0xFF.
+        return _BurstReader(self, burst)
+
+    def _read_segment(self, state: list, buffer) -> int:
+        # Reads the next bytes of a segment into buffer. state: [segment, bytes read, pending
+        # HEX record data, index into it, extended address].
+        segment = state[0]
+        read_len = min(len(buffer), segment[1] - state[1])
+        if self._format == SEGMENTS:
+            self._file.seek(segment[2] + state[1])
+            read_len = self._file.readinto(buffer[:read_len]) if read_len != 0 else 0
+            if read_len == 0 and segment[1] != state[1]:
+                raise ValueError('Truncated segment at 0x{0:06x}'.format(segment[0]))
+        else:
+            if state[1] == 0:
+                self._file.seek(segment[2])
+            index = 0
+            while index != read_len:
+                data = state[2]
+                if data == None or state[3] == len(data):
+                    state[2] = self._next_hex_data(state)
+                    state[3] = 0
+                    continue
+                copy_len = min(len(data) - state[3], read_len - index)
+                buffer[index: index + copy_len] = data[state[3]: state[3] + copy_len]
+                state[3] += copy_len
+                index += copy_len
+        state[1] += read_len
+        return read_len
+
+    def _next_hex_data(self, state: list) -> bytes:
+        while True:
+            line = self._file.readline()
+            if not line:
+                raise ValueError('Truncated segment at 0x{0:06x}'.format(state[0][0]))
+            record = _parse_hex_line(line)
+            if record == None:
+                continue
+            record_type = record[0]
+            if record_type == _HEX_DATA:
+                return record[2]
+            if record_type == _HEX_END_OF_FILE:
+                raise ValueError('Truncated segment at 0x{0:06x}'.format(state[0][0]))
+            state[4] = _extended_address(record, state[4])
+
+    def _scan_hex(self) -> list:
+        segments = []
+        segment = None
+        extended_address = 0
+        line_number = 0
+        while True:
+            offset = self._file.tell()
+            line = self._file.readline()
+            if not line:
+                break
+            line_number += 1
+            try:
+                record = _parse_hex_line(line)
+            except ValueError as error:
+                raise ValueError('Intel HEX line {0}: {1}'.format(line_number, error))
+            if record == None:
+                continue
+            record_type = record[0]
+            if record_type == _HEX_DATA:
+                address = extended_address + record[1]
+                if segment != None and segment[0] + segment[1] == address:
+                    segment[1] += len(record[2])
+                elif len(record[2]) != 0:
+                    segment = [address, len(record[2]), offset, extended_address]
+                    segments.append(segment)
+            elif record_type == _HEX_END_OF_FILE:
+                break
+            else:
+                extended_address = _extended_address(record, extended_address)
+        return segments
+
+    def _scan_container(self) -> list:
+        header = self._file.read(len(CONTAINER_MAGIC) + 4)
+        if len(header) != len(CONTAINER_MAGIC) + 4 or header[:len(CONTAINER_MAGIC)] != CONTAINER_MAGIC:
+            raise ValueError('Not a segment container')
+        count = int.from_bytes(header[len(CONTAINER_MAGIC):], 'little')
+        segments = []
+        offset = len(header)
+        for _ in range(count):
+            self._file.seek(offset)
+            segment_header = self._file.read(8)
+            if len(segment_header) != 8:
+                raise ValueError('Truncated segment container')
+            address = int.from_bytes(segment_header[:4], 'little')
+            length = int.from_bytes(segment_header[4:], 'little')
+            if length != 0:
+                segments.append([address, length, offset + 8, 0])
+            offset += 8 + length
+        return segments
+
+class _BurstReader:
+    def __init__(self, image: SegmentedImage, burst: list):
+        self._image = image
+        self._segments = burst[2]
+        self._address = burst[0]
+        self._index = 0
+        self._state = None
+
+    def readinto(self, buffer) -> int:
+        buffer = memoryview(buffer)
+        read_len = 0
+        while read_len != len(buffer) and self._index != len(self._segments):
+            segment = self._segments[self._index]
+            if self._address < segment[0]:
+                # Gap before the segment.
+                gap_len = min(segment[0] - self._address, len(buffer) - read_len)
+                fill_blank(buffer[read_len: read_len + gap_len])
+                count = gap_len
+            else:
+                if self._state == None:
+                    self._state = [segment, 0, None, 0, segment[3]]
+                count = self._image._read_segment(self._state, buffer[read_len:])
+                if self._state[1] == segment[1]:
+                    self._state = None
+                    self._index += 1
+            self._address += count
+            read_len += count
+        return read_len
+
+def _parse_hex_line(line) -> tuple:
+    # (record type, address, data) or None for a blank line.
+    line = line.strip()
+    if len(line) == 0:
+        return None
+    if line[0] != 0x3A or len(line) < 11 or len(line) % 2 == 0:
+        raise ValueError('malformed record')
+    record = binascii.unhexlify(line[1:])
+    if len(record) != 5 + record[0]:
+        raise ValueError('wrong record length')
+    if sum(record) & 0xFF != 0:
+        raise ValueError('checksum error')
+    return (record[3], (record[1] << 8) | record[2], record[4: 4 + record[0]])
+
+def _extended_address(record: tuple, extended_address: int) -> int:
+    if record[0] == _HEX_EXTENDED_LINEAR_ADDRESS:
+        return int.from_bytes(record[2], 'big') << 16
+    if record[0] == _HEX_EXTENDED_SEGMENT_ADDRESS:
+        return int.from_bytes(record[2], 'big') << 4
+    # Start address records do not move the data.
+    return extended_address
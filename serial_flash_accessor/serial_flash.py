@@ -1,4 +1,5 @@
 class SerialFlash:
+    # Drivers implement the methods below; read_chunks() is built on read().
     def get_jedec_id(self) -> bytes:
         raise NotImplementedError()
 
@@ -25,3 +26,78 @@ class SerialFlash:
 
     def erase(self):
         raise NotImplementedError()
+
+    def get_sector_size(self) -> int:
+        raise NotImplementedError()
+
+    def erase_sector(self, address: int):
+        raise NotImplementedError()
+
+    def erase_range(self, address: int, length: int):
+        raise NotImplementedError()
+
+    def get_page_size(self) -> int:
+        raise NotImplementedError()
+
+    def is_erasable(self) -> bool:
+        # False for chips that overwrite bytes in place (EEPROMs): erase_sector and erase_range do
+        # nothing, so 0xFF has to be written like any other data.
+        return True
+
+    def set_skip_blank(self, skip_blank: bool):
+        raise NotImplementedError()
+
+    def get_write_stats(self):
+        # Returns (programmed pages, skipped blank pages) since the last reset.
+        raise NotImplementedError()
+
+    def reset_write_stats(self):
+        raise NotImplementedError()
+
+    def get_wait_stats(self) -> list:
+        # [[operation name, count, polls, total us, max us], ...] for the busy waits since the last reset.
+        raise NotImplementedError()
+
+    def reset_wait_stats(self):
+        raise NotImplementedError()
+
+    def set_pipelined(self, pipelined: bool):
+        # When enabled, program and erase commands return as soon as they are sent and the busy
+        # wait is done by the next command to the chip (or sync()).
+        raise NotImplementedError()
+
+    def sync(self):
+        raise NotImplementedError()
+
+    def close(self):
+        # Finishes the pending operation and leaves the chip as it was after power up (e.g. 3 byte
+        # addresses), so another host can use it. The driver is not used afterwards.
+        self.set_pipelined(False)
+
+    def poll_pending(self) -> int:
+        # Non-blocking sync(): 0 once the pending operation has finished, otherwise the
+        # microseconds to wait before polling again.
+        raise NotImplementedError()
+
+    def suspend(self) -> bool:
+        # Suspends the pending page program or sector/block erase (pipelined mode) so the chip
+        # can be read. Returns False if nothing was suspended, also on chips without suspend.
+        # Reads and status reads keep it suspended; resume() or any other command resumes it.
+        return False
+
+    def resume(self):
+        pass
+
+    def read_chunks(self, address: int, length: int, chunk_size: int = 4096):
+        # Yields the range as memoryviews of one reused buffer, each read with a single read
+        # command. A chunk is only valid until the next one is requested.
+        if address < 0 or address + length > self.get_capacity():
+            raise ValueError('The address is out of the accessible range.')
+        buffer = memoryview(bytearray(min(chunk_size, length)))
+        end = address + length
+        while address != end:
+            read_len = min(chunk_size, end - address)
+            chunk = buffer if read_len == len(buffer) else buffer[:read_len]
+            self.read(address, chunk)
+            yield chunk
+            address += read_len
@@ -0,0 +1,113 @@
+from micropython import const
+from serial_flash_accessor.address_mode import ADDRESS_MODE_3_BYTES, ADDRESS_MODE_EN4B, ADDRESS_MODE_4_BYTES
+
+# Serial Flash Discoverable Parameters (JESD216). Only the Basic Flash Parameter Table is used.
+_RDSFDP = const(0x5A)
+_BASIC_PARAMETER_ID = const(0xFF00)
+
+# Typical erase times: (count + 1) * unit. Units in microseconds, indexed by the 2 bit field.
+_ERASE_UNITS = (1000, 16000, 128000, 1000000)
+_CHIP_ERASE_UNITS = (16000, 256000, 4000000, 64000000)
+
+# Used when the table predates JESD216A and has no timing dwords.
+_DEFAULT_TIMINGS = (
+    (700, 5000),            # Page program
+    (50000, 400000),        # Sector erase
+    (500000, 2000000),      # Block erase
+    (20000000, 200000000),  # Chip erase
+    (0, 40000),             # Status write
+)
+
+# DWORD 1 address bytes field.
+_ADDRESS_3_OR_4_BYTES = const(1)
+_ADDRESS_4_BYTES = const(2)
+# DWORD 16 "enter 4-byte addressing" method: issue 0xB7 without WREN.
+_ENTER_4_BYTE_B7 = const(0x01)
+
+def read_sfdp(spi_device, address: int, read_buffer: bytearray):
+    command = bytes([_RDSFDP, (address >> 16) & 0xFF, (address >> 8) & 0xFF, address & 0xFF, 0x00])
+    spi_device.write_read(command, read_buffer)
+
+def read_basic_parameter_table(spi_device) -> bytearray:
+    # Returns the Basic Flash Parameter Table, or None when the chip does not answer SFDP.
+    header = bytearray(8)
+    read_sfdp(spi_device, 0, header)
+    if header[:4] != b'SFDP':
+        return None
+    parameter_headers = bytearray(8 * (header[6] + 1))
+    read_sfdp(spi_device, 8, parameter_headers)
+    for index in range(0, len(parameter_headers), 8):
+        parameter_header = parameter_headers[index: index + 8]
+        if (parameter_header[7] << 8) | parameter_header[0] == _BASIC_PARAMETER_ID:
+            table = bytearray(parameter_header[3] * 4)
+            read_sfdp(spi_device, parameter_header[4] | (parameter_header[5] << 8) | (parameter_header[6] << 16), table)
+            return table
+    return None
+
+def parse_basic_parameter_table(table: bytearray) -> list:
+    # [capacity, page size, erase types ([[size, command], ...] largest first), timings
+    # (indexed by busy_waiter operation), address mode (address_mode.ADDRESS_MODE_*), status write
+    # enable command], or None when the chip has no usable erase command.
+    dword1 = _dword(table, 1)
+    dword2 = _dword(table, 2)
+    if dword2 & 0x80000000:
+        capacity = (1 << (dword2 & 0x7FFFFFFF)) >> 3
+    else:
+        capacity = (dword2 + 1) >> 3
+
+    erase_types = []
+    erase_times = []
+    dword10 = _dword(table, 10) if len(table) >= 11 * 4 else 0
+    for erase_type in range(4):
+        dword = _dword(table, 8 + (erase_type >> 1))
+        shift = (erase_type & 1) * 16
+        size_exponent = (dword >> shift) & 0xFF
+        if size_exponent != 0:
+            erase_types.append([1 << size_exponent, (dword >> (shift + 8)) & 0xFF])
+            time_field = (dword10 >> (4 + erase_type * 7)) & 0x7F
+            erase_times.append(((time_field & 0x1F) + 1) * _ERASE_UNITS[time_field >> 5])
+    if len(erase_types) == 0 and dword1 & 0x03 == 0x01:
+        erase_types.append([4096, (dword1 >> 8) & 0xFF])
+        erase_times.append(0)
+    if len(erase_types) == 0:
+        return None
+
+    if dword10 != 0:
+        dword11 = _dword(table, 11)
+        page_size = 1 << ((dword11 >> 4) & 0x0F)
+        erase_multiplier = 2 * ((dword10 & 0x0F) + 1)
+        program_multiplier = 2 * ((dword11 & 0x0F) + 1)
+        page_program = (((dword11 >> 8) & 0x1F) + 1) * (64 if dword11 & 0x2000 else 8)
+        chip_erase = (((dword11 >> 24) & 0x1F) + 1) * _CHIP_ERASE_UNITS[(dword11 >> 29) & 0x03]
+        smallest = min(range(len(erase_types)), key=lambda index: erase_types[index][0])
+        largest = max(range(len(erase_types)), key=lambda index: erase_types[index][0])
+        blocks = [index for index in range(len(erase_types)) if index != smallest]
+        block_typical = min([erase_times[index] for index in blocks]) if blocks else erase_times[smallest]
+        timings = (
+            (page_program, page_program * program_multiplier),
+            (erase_times[smallest], erase_times[smallest] * erase_multiplier),
+            (block_typical, erase_times[largest] * erase_multiplier),
+            (chip_erase, chip_erase * erase_multiplier),
+            _DEFAULT_TIMINGS[4],
+        )
+    else:
+        page_size = 256 if dword1 & 0x04 else 1
+        timings = _DEFAULT_TIMINGS
+
+    erase_types.sort(key=lambda erase_type: erase_type[0], reverse=True)
+    address_field = (dword1 >> 17) & 0x03
+    if address_field == _ADDRESS_4_BYTES:
+        address_mode = ADDRESS_MODE_4_BYTES
+    elif address_field == _ADDRESS_3_OR_4_BYTES and (len(table) < 16 * 4 or (_dword(table, 16) >> 24) & _ENTER_4_BYTE_B7):
+        # Tables before JESD216B do not say how to enter 4 byte mode; 0xB7 is the common way.
+        address_mode = ADDRESS_MODE_EN4B
+    else:
+        address_mode = ADDRESS_MODE_3_BYTES
+    # Volatile block protect bits are written after 0x50 unless bit 4 selects WREN (0x06).
+    status_write_enable = 0x50 if dword1 & 0x18 == 0x08 else 0x06
+    return [capacity, page_size, erase_types, timings, address_mode, status_write_enable]
+
+def _dword(table: bytearray, number: int) -> int:
+    # number is 1 based, as in JESD216.
+    index = (number - 1) * 4
+    return table[index] | (table[index + 1] << 8) | (table[index + 2] << 16) | (table[index + 3] << 24)
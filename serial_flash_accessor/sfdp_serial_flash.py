@@ -0,0 +1,229 @@
+from micropython import const
+from serial_flash_accessor.spi_device import SpiDevice
+from serial_flash_accessor.serial_flash import SerialFlash
+from serial_flash_accessor.busy_waiter import BusyWaiter, PAGE_PROGRAM, SECTOR_ERASE, BLOCK_ERASE, CHIP_ERASE, STATUS_WRITE
+from serial_flash_accessor.erase_planner import plan_erase
+from serial_flash_accessor.buffer_util import is_blank, copy_into
+from serial_flash_accessor.address_mode import ADDRESS_MODE_3_BYTES, ADDRESS_MODE_EN4B, ENTER_4_BYTE_MODE, EXIT_4_BYTE_MODE, ADDRESS_3_BYTES_LIMIT, select_address_mode, get_address_length, address_command
+from serial_flash_accessor.sfdp import read_basic_parameter_table, parse_basic_parameter_table
+
+_WREN = const(0x06)
+_WRSR = const(0x01)
+_RDSR = const(0x05)
+_READ_FAST = const(0x0B)
+_CE = const(0x60)
+_PP = const(0x02)
+
+# BP0-BP2 are at the same place on practically every part; SFDP does not describe them.
+_BP_ALL = const(0x1C)
+_BP_NONE = const(0x00)
+
+# SFDP has no clock field; parts that have SFDP run 0x0B at 50 MHz or more.
+_FREQUENCY = const(50000000)
+
+_VENDORS = {
+    0x01: 'Infineon', 0x1F: 'Adesto', 0x20: 'Micron', 0x37: 'AMIC', 0x5E: 'Zbit', 0x68: 'Boya',
+    0x85: 'Puya', 0x9D: 'ISSI', 0xBF: 'Microchip', 0xC2: 'Macronix', 0xC8: 'GigaDevice', 0xEF: 'Winbond',
+}
+
+class SfdpSerialFlash(SerialFlash):
+    # Generic driver for chips that are not in a driver's chip_infos but describe themselves with
+    # SFDP: capacity, page size, erase commands and timings come from the Basic Flash Parameter Table.
+    @staticmethod
+    def create(spi_device: SpiDevice, jedec_id: bytes):
+        table = read_basic_parameter_table(spi_device)
+        if table == None:
+            return None
+        parameters = parse_basic_parameter_table(table)
+        if parameters == None:
+            return None
+        capacity = parameters[0]
+        if parameters[4] == ADDRESS_MODE_3_BYTES:
+            # Without a way to give 4 byte addresses only the first 16 MB are reachable.
+            capacity = min(capacity, ADDRESS_3_BYTES_LIMIT)
+        name = 'SFDP {0:02X}{1:02X}{2:02X}'.format(jedec_id[0], jedec_id[1], jedec_id[2])
+        chip_info = [ bytes(jedec_id), name, capacity, _FREQUENCY, parameters[2], parameters[1], parameters[3], parameters[5], parameters[4] ]
+        return SfdpSerialFlash(spi_device, chip_info)
+
+    def __init__(self, spi_device: SpiDevice, chip_info):
+        # Page programs send the header and the page from this buffer as one write.
+        buffer = memoryview(bytearray(5 + chip_info[5]))
+        self._buffer = buffer
+        # Views of the first bytes of the buffer, made once so that commands do not allocate.
+        self._prefixes = [buffer[:length] for length in range(7)]
+        self._spi_device = spi_device
+        self._jedec_id = chip_info[0]
+        self._name = chip_info[1]
+        self._capacity = chip_info[2]
+        spi_device.set_frequency(chip_info[3])
+        address_mode = select_address_mode(self._capacity, chip_info[8])
+        self._header_len = 1 + get_address_length(address_mode)
+        self._page_command = buffer[:self._header_len + chip_info[5]]
+        self._read_command = address_command(address_mode, _READ_FAST)
+        self._program_command = address_command(address_mode, _PP)
+        self._erase_types = chip_info[4]
+        self._sector_size = chip_info[4][-1][0]
+        self._sector_erase = chip_info[4][-1][1]
+        self._page_size = chip_info[5]
+        self._status_write_enable = chip_info[7]
+        self._skip_blank = False
+        self._programmed_pages = 0
+        self._skipped_pages = 0
+        self._busy_waiter = BusyWaiter(self._read_status, chip_info[6])
+        self._pipelined = False
+        self._address_mode = address_mode
+        if address_mode == ADDRESS_MODE_EN4B:
+            self._execute_command(ENTER_4_BYTE_MODE)
+
+    def get_vendor(self) -> str:
+        return _VENDORS.get(self._jedec_id[0], 'Unknown')
+
+    def get_jedec_id(self) -> bytes:
+        return self._jedec_id
+
+    def get_capacity(self) -> int:
+        return self._capacity
+
+    def get_name(self) -> str:
+        return self._name
+
+    def set_protect(self, is_protect: bool):
+        self._execute_command(self._status_write_enable)
+        buffer = self._buffer
+        buffer[0] = _WRSR
+        buffer[1] = _BP_ALL if is_protect else _BP_NONE
+        self._spi_device.write(self._prefixes[2])
+        self._wait_ready(STATUS_WRITE)
+
+    def is_protect(self) -> bool:
+        return (self._read_status() & _BP_ALL) != _BP_NONE
+
+    def read(self, address: int, read_buffer: bytearray):
+        if address < 0 or address + len(read_buffer) > self._capacity:
+            raise ValueError('The address is out of the accessible range.')
+        buffer =  self._setup_address(self._read_command, address)
+        buffer[self._header_len] = 0x00
+        return self._spi_device.write_read(self._prefixes[self._header_len + 1], read_buffer)
+
+    def write(self, address:int, write_buffer: bytearray):
+        if self.is_protect():
+           raise Exception("This chip is write protected.")
+        write_len = len(write_buffer)
+        if address < 0 or address + write_len > self._capacity:
+            raise ValueError('The write address is out of the accessible range.')
+        page_size = self._page_size
+        index = 0
+        while index != write_len:
+            page_address = address + index
+            page_len = min(page_size - (page_address % page_size), write_len - index)
+            if self._skip_blank and is_blank(write_buffer, index, page_len):
+                self._skipped_pages += 1
+            else:
+                self._execute_command(_WREN)
+                buffer = self._setup_address(self._program_command, page_address)
+                copy_into(buffer, self._header_len, write_buffer, index, page_len)
+                self._spi_device.write(self._page_command if page_len == page_size else buffer[:self._header_len + page_len])
+                self._wait_ready(PAGE_PROGRAM)
+                self._programmed_pages += 1
+            index += page_len
+
+    def erase(self):
+        if self.is_protect():
+          raise Exception("This chip is write protected.")
+        self._execute_command(_WREN)
+        self._execute_command(_CE)
+        self._wait_ready(CHIP_ERASE)
+
+    def get_page_size(self) -> int:
+        return self._page_size
+
+    def set_skip_blank(self, skip_blank: bool):
+        self._skip_blank = skip_blank
+
+    def get_write_stats(self):
+        return (self._programmed_pages, self._skipped_pages)
+
+    def reset_write_stats(self):
+        self._programmed_pages = 0
+        self._skipped_pages = 0
+
+    def set_pipelined(self, pipelined: bool):
+        self._pipelined = pipelined
+        if not pipelined:
+            self._busy_waiter.wait_pending()
+
+    def sync(self):
+        self._busy_waiter.wait_pending()
+
+    def close(self):
+        # EN4B parts go back to 3 byte addresses, which hosts and bootloaders expect after power up.
+        self.set_pipelined(False)
+        if self._address_mode == ADDRESS_MODE_EN4B:
+            self._execute_command(EXIT_4_BYTE_MODE)
+
+    def poll_pending(self) -> int:
+        return self._busy_waiter.poll_pending()
+
+    def get_wait_stats(self) -> list:
+        return self._busy_waiter.get_stats()
+
+    def reset_wait_stats(self):
+        self._busy_waiter.reset_stats()
+
+    def get_sector_size(self) -> int:
+        return self._sector_size
+
+    def erase_sector(self, address: int):
+        if self.is_protect():
+          raise Exception("This chip is write protected.")
+        self._erase_block(self._sector_erase, address)
+
+    def erase_range(self, address: int, length: int):
+        if self.is_protect():
+          raise Exception("This chip is write protected.")
+        if address < 0 or address + length > self._capacity:
+            raise ValueError('The erase address is out of the accessible range.')
+        for command, block_address, _ in plan_erase(address, length, self._erase_types):
+            self._erase_block(command, block_address)
+
+    def _erase_block(self, command: int, address: int):
+        self._execute_command(_WREN)
+        self._setup_address(command, address)
+        self._spi_device.write(self._prefixes[self._header_len])
+        self._wait_ready(SECTOR_ERASE if command == self._sector_erase else BLOCK_ERASE)
+
+    def _wait_ready(self, operation: int):
+        if self._pipelined and operation != STATUS_WRITE:
+            self._busy_waiter.defer(operation)
+        else:
+            self._busy_waiter.wait(operation)
+
+    def _setup_address(self, command:int, address:int) -> bytearray:
+        self._busy_waiter.wait_pending()
+        buffer = self._buffer
+        buffer[0] = command
+        if self._header_len == 5:
+            buffer[1] = (address >> 24) & 0xFF
+            buffer[2] = (address >> 16) & 0xFF
+            buffer[3] = (address >> 8) & 0xFF
+            buffer[4] = address & 0xFF
+        else:
+            buffer[1] = (address >> 16) & 0xFF
+            buffer[2] = (address >> 8) & 0xFF
+            buffer[3] = address & 0xFF
+        return buffer
+
+    def _read_status(self) -> int:
+        return self._execute_command(_RDSR, 1)[0]
+
+    def _execute_command(self, command: int, read_len: int = 0) -> bytearray:
+        if command != _RDSR:
+            self._busy_waiter.wait_pending()
+        buffer = self._buffer
+        buffer[0] = command
+        if read_len == 0:
+            self._spi_device.write(self._prefixes[1])
+            return None
+        else:
+            self._spi_device.write_read(self._prefixes[1], self._prefixes[read_len])
+            return self._prefixes[read_len]
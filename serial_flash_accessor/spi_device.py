@@ -1,20 +1,34 @@
+import micropython
+import time
 from machine import Pin
 
+# [baudrate the bus is set to] by id of the SPI bus, shared by the devices on it.
+_bus_frequencies = {}
+
 class SpiDevice:
-    def __init__(self, spi, cs_pin_id):
+    # Each device keeps its own baudrate. Devices that share a bus set the bus to theirs when they
+    # select their chip, so a chip never runs at the clock of the device set up last.
+    def __init__(self, spi, cs_pin_id, miso_pin_id = None):
         self._spi = spi
         self._cs_pin = Pin(cs_pin_id, Pin.OUT)
         self._cs_pin.high()
-        self._spi.init(baudrate=1000000)
+        # Pin(id) without a mode leaves the SPI alternate function in place; only its level is read.
+        self._miso_pin = Pin(miso_pin_id) if miso_pin_id != None else None
+        self._bus_frequency = _bus_frequencies.setdefault(id(spi), [0])
+        self.set_frequency(1000000)
 
     @micropython.native
     def write(self, write_buffer):
+        if self._bus_frequency[0] != self._frequency:
+            self._apply_frequency()
         self._cs_pin.low()
         self._spi.write(write_buffer)
         self._cs_pin.high()
 
     @micropython.native
     def writes(self, write_buffers):
+        if self._bus_frequency[0] != self._frequency:
+            self._apply_frequency()
         self._cs_pin.low()
         for write_buffer in write_buffers:
             self._spi.write(write_buffer)
@@ -22,10 +36,39 @@ class SpiDevice:
 
     @micropython.native
     def write_read(self, write_buffer, read_buffer):
+        if self._bus_frequency[0] != self._frequency:
+            self._apply_frequency()
         self._cs_pin.low()
         self._spi.write(write_buffer)
         self._spi.readinto(read_buffer)
         self._cs_pin.high()
 
+    def has_miso_pin(self) -> bool:
+        return self._miso_pin != None
+
+    @micropython.native
+    def wait_miso_high(self, timeout_us):
+        # Selects the chip and waits for it to drive MISO high (SST25VF RY/BY# output after EBSY).
+        miso_pin = self._miso_pin
+        if self._bus_frequency[0] != self._frequency:
+            self._apply_frequency()
+        self._cs_pin.low()
+        start = time.ticks_us()
+        while miso_pin.value() == 0:
+            if time.ticks_diff(time.ticks_us(), start) > timeout_us:
+                break
+        ready = miso_pin.value() != 0
+        self._cs_pin.high()
+        return ready
+
     def set_frequency(self, frequency):
-        self._spi.init(baudrate=frequency)
+        self._frequency = frequency
+        self._apply_frequency()
+
+    def get_frequency(self) -> int:
+        # The requested frequency; the peripheral rounds it down to an achievable baudrate.
+        return self._frequency
+
+    def _apply_frequency(self):
+        self._spi.init(baudrate=self._frequency)
+        self._bus_frequency[0] = self._frequency
@@ -1,56 +1,88 @@
 from micropython import const
+import micropython
 import time
 from serial_flash_accessor.spi_device import SpiDevice
 from serial_flash_accessor.serial_flash import SerialFlash
+from serial_flash_accessor.busy_waiter import BusyWaiter, FlashTimeoutError, PAGE_PROGRAM, SECTOR_ERASE, BLOCK_ERASE, CHIP_ERASE, STATUS_WRITE
+from serial_flash_accessor.erase_planner import plan_erase
+from serial_flash_accessor.buffer_util import is_blank
 
-class SST25VFxxxBSerialFlash(SerialFlash):
-    _READ = const(0x03)
-    _FAST_READ = const(0x0B)
-    _RDSR = const(0x05)
-    _EWSR = const(0x50)
-    _WRSR = const(0x01)
-    _WREN = const(0x06)
-    _WRDI = const(0x04)
-    _RDID = const(0x90)
-    _CE   = const(0x60)
-    _JEDEC_ID = const(0x9F)
-    _AAI_PROGRAM = const(0xAD)
-
-    _BP0 = const(0b0000_0100)
-    _BP1 = const(0b0000_1000)
-    _BP2 = const(0b0001_0000)
-    _BP3 = const(0b0010_0000)
-    _BP_NONE = const(0b0000_0000)
-    _BP_ALL = const(_BP0|_BP1|_BP2|_BP3)
-    _BUSY = const(0b0000_0001)
-
-    _TBP_MICRO_SECONDS = const(10)
+_READ = const(0x03)
+_FAST_READ = const(0x0B)
+_BYTE_PROGRAM = const(0x02)
+_RDSR = const(0x05)
+_EWSR = const(0x50)
+_WRSR = const(0x01)
+_WREN = const(0x06)
+_WRDI = const(0x04)
+_RDID = const(0x90)
+_CE   = const(0x60)
+_SE   = const(0x20)
+_BE32 = const(0x52)
+_BE64 = const(0xD8)
+_JEDEC_ID = const(0x9F)
+_AAI_PROGRAM = const(0xAD)
+_EBSY = const(0x70)
+_DBSY = const(0x80)
+
+_BP0 = const(0b0000_0100)
+_BP1 = const(0b0000_1000)
+_BP2 = const(0b0001_0000)
+_BP3 = const(0b0010_0000)
+_BP_NONE = const(0b0000_0000)
+_BP_ALL = const(_BP0|_BP1|_BP2|_BP3)
+_BUSY = const(0b0000_0001)
+
+_PAGE_SIZE = const(256)
+_SECTOR_SIZE = const(4096)
+_BLOCK32_SIZE = const(32768)
+_BLOCK64_SIZE = const(65536)
+
+_TBP_MICRO_SECONDS = const(10)
+_READY_PIN_TIMEOUT_MICRO_SECONDS = const(100)
+
+# Typical and maximum times in microseconds (SST25VF032B), indexed by busy_waiter operation.
+_TIMINGS = (
+    (7, 10),                # Page program (AAI word program)
+    (18000, 25000),         # Sector erase
+    (18000, 25000),         # Block erase
+    (35000, 50000),         # Chip erase
+    (0, 10000),             # Status write
+)
 
+_MEGABIT = const(1 << 20)
+_MEGA_HZ = const(1000000)
+_ERASE_4K_32K_64K = ((_BLOCK64_SIZE, _BE64), (_BLOCK32_SIZE, _BE32), (_SECTOR_SIZE, _SE))
+_CHIP_INFOS = (
+    # JEDEC ID         Name           Capacity          Min Op.MHz     Erase types
+    ( b'\xBF\x25\x4A', 'SST25VF032B', 32 * _MEGABIT >> 3, 66 * _MEGA_HZ, _ERASE_4K_32K_64K ),
+    #( b'\xBF\x25\x41', 'SST25VF016B', 16 * _MEGABIT >> 3, 50 * _MEGA_HZ, _ERASE_4K_32K_64K ),
+    #( b'\xBF\x25\x8E', 'SST25VF080B',  8 * _MEGABIT >> 3, 50 * _MEGA_HZ, _ERASE_4K_32K_64K ),
+    #( b'\xBF\x25\x8D', 'SST25VF040B',  4 * _MEGABIT >> 3, 50 * _MEGA_HZ, _ERASE_4K_32K_64K ),
+)
+
+class SST25VFxxxBSerialFlash(SerialFlash):
     @staticmethod
-    def create(spi_device: SpiDevice, hint: str):
-        jedec_id = bytearray(3)
-        spi_device.write_read(bytes([_JEDEC_ID]), jedec_id)
-        MEGABIT = 2 ** 20
-        MEGA_HZ  = 1000 * 1000
-        chip_infos = [
-            # JEDEC ID         Name           Capacity          Min Op.MHz 
-            [ b'\xBF\x25\x4A', 'SST25VF032B', 32 * MEGABIT >> 3, 66 * MEGA_HZ ],
-            #[ b'\xBF\x25\x41', 'SST25VF016B', 16 * MEGABIT >> 3, 50 * MEGA_HZ ],
-            #[ b'\xBF\x25\x8E', 'SST25VF080B',  8 * MEGABIT >> 3, 50 * MEGA_HZ ],
-            #[ b'\xBF\x25\x8D', 'SST25VF040B',  4 * MEGABIT >> 3, 50 * MEGA_HZ ],
-        ]
-        for chip_info in chip_infos:
-            if chip_info[0] == jedec_id:
-                return SST25VFxxxBSerialFlash(spi_device, chip_info)
-        return None
+    def get_chip_infos() -> tuple:
+        return _CHIP_INFOS
 
     def __init__(self, spi_device: SpiDevice, chip_info):
-        self._buffer = memoryview(bytearray(6))
+        buffer = memoryview(bytearray(6))
+        self._buffer = buffer
+        # Views of the first bytes of the buffer, made once so that commands do not allocate.
+        self._prefixes = [buffer[:length] for length in range(7)]
+        self._aai_word = bytearray([_AAI_PROGRAM, 0xFF, 0xFF])
         self._spi_device = spi_device
         self._jedec_id = chip_info[0]
         self._name = chip_info[1]
         self._capacity = chip_info[2]
         spi_device.set_frequency(chip_info[3])
+        self._erase_types = chip_info[4]
+        self._skip_blank = False
+        self._programmed_pages = 0
+        self._skipped_pages = 0
+        self._busy_waiter = BusyWaiter(self._read_status, _TIMINGS)
+        self._pipelined = False
 
     def get_jedec_id(self) -> bytes:
         return self._jedec_id
@@ -69,66 +101,175 @@ class SST25VFxxxBSerialFlash(SerialFlash):
         buffer = self._buffer
         buffer[0] = _WRSR
         buffer[1] = _BP_ALL if is_protect else _BP_NONE
-        self._spi_device.write(buffer[:2])
-        self._wait_ready()
+        self._spi_device.write(self._prefixes[2])
+        self._wait_ready(STATUS_WRITE)
 
     def is_protect(self) -> bool:
         return (self._read_status() & _BP_ALL) != _BP_NONE
 
     def read(self, address: int, read_buffer: bytearray):
-        if address + len(read_buffer) >= self._capacity:
+        if address < 0 or address + len(read_buffer) > self._capacity:
             raise ValueError('The address is out of the accessible range.')
         buffer =  self._setup_address(_FAST_READ, address)
         buffer[4] = 0x00
-        return self._spi_device.write_read(buffer[:5], read_buffer)
+        return self._spi_device.write_read(self._prefixes[5], read_buffer)
 
     def write(self, address:int, write_buffer: bytearray):
         write_len = len(write_buffer)
-        if address + write_len >= self._capacity:
+        if address < 0 or address + write_len > self._capacity:
             raise ValueError('The address is out of the accessible range.')
         if write_len == 0:
             return
+
+        # AAI has no page program. Blank elision splits the data into 256 byte runs aligned
+        # like the other drivers' pages and starts a new AAI sequence after each skipped run.
+        run_index = 0
+        index = 0
+        while index != write_len:
+            page_len = min(_PAGE_SIZE - ((address + index) % _PAGE_SIZE), write_len - index)
+            if self._skip_blank and is_blank(write_buffer, index, page_len):
+                if run_index != index:
+                    self._program_aai(address + run_index, write_buffer, run_index, index)
+                run_index = index + page_len
+                self._skipped_pages += 1
+            else:
+                self._programmed_pages += 1
+            index += page_len
+        if run_index != write_len:
+            self._program_aai(address + run_index, write_buffer, run_index, write_len)
+
+    def _program_aai(self, address:int, write_buffer: bytearray, start: int, end: int):
+        # Programs write_buffer[start:end] at address. AAI only programs word aligned pairs; an
+        # odd first or last byte is byte programmed.
+        index = start
         if address % 2 != 0:
-            raise ValueError('The address to write must be an even number.')
+            self._program_byte(address, write_buffer[index])
+            index += 1
+        words_end = index + ((end - index) & ~1)
+        if words_end != index:
+            self._program_words(address + index - start, write_buffer, index, words_end)
+        if words_end != end:
+            self._program_byte(address + words_end - start, write_buffer[words_end])
+
+    def _program_byte(self, address: int, value: int):
+        self._execute_command(_WREN)
+        buffer = self._setup_address(_BYTE_PROGRAM, address)
+        buffer[4] = value
+        self._spi_device.write(self._prefixes[5])
+        self._wait_ready(PAGE_PROGRAM)
 
+    def _program_words(self, address: int, write_buffer: bytearray, start: int, end: int):
+        # With a MISO pin the chip reports the end of each word on SO (EBSY), otherwise each word
+        # is given the remainder of its maximum program time.
+        use_ready_pin = self._spi_device.has_miso_pin()
+        if use_ready_pin:
+            self._execute_command(_EBSY)
         try:
-            def execute_AAI(buffer: bytearray):
-                self._spi_device.write(buffer)
-                time.sleep_us(_TBP_MICRO_SECONDS)
             self._execute_command(_WREN)
             buffer = self._setup_address(_AAI_PROGRAM, address)
-            buffer[4] = write_buffer[0]
-            if write_len < 2:
-                buffer[5] = 0xFF
-                execute_AAI(buffer[:6])
-            else:
-                buffer[5] = write_buffer[1]
-                execute_AAI(buffer[:6])
-                for index in range(2, (write_len >> 1) * 2, 2):
-                    buffer[0] = _AAI_PROGRAM
-                    buffer[1] = write_buffer[index]
-                    buffer[2] = write_buffer[index + 1]
-                    execute_AAI(buffer[:3])
-                if write_len % 2 != 0:
-                    buffer[0] = _AAI_PROGRAM
-                    buffer[1] = write_buffer[write_len - 1]
-                    buffer[2] = 0xFF
-                    execute_AAI(buffer[:3])
+            buffer[4] = write_buffer[start]
+            buffer[5] = write_buffer[start + 1]
+            self._spi_device.write(self._prefixes[6])
+            if self._send_words(write_buffer, start + 2, end, use_ready_pin) != end:
+                raise FlashTimeoutError('AAI word program did not finish within {0} us'.format(_READY_PIN_TIMEOUT_MICRO_SECONDS))
         finally:
             self._execute_command(_WRDI)
+            if use_ready_pin:
+                self._execute_command(_DBSY)
+
+    @micropython.viper
+    def _send_words(self, write_buffer, start: int, end: int, use_ready_pin: bool) -> int:
+        # Waits for the word that has just been sent, then sends write_buffer[start:end] without
+        # allocating. Returns the offset reached (end on success).
+        source = ptr8(write_buffer)
+        word = self._aai_word
+        destination = ptr8(word)
+        spi_device = self._spi_device
+        index = start
+        sent = int(time.ticks_us())
+        while True:
+            if use_ready_pin:
+                if not spi_device.wait_miso_high(_READY_PIN_TIMEOUT_MICRO_SECONDS):
+                    return index - 2
+            else:
+                remaining = _TBP_MICRO_SECONDS - int(time.ticks_diff(time.ticks_us(), sent))
+                if remaining > 0:
+                    time.sleep_us(remaining)
+            if index >= end:
+                return end
+            destination[1] = source[index]
+            destination[2] = source[index + 1]
+            spi_device.write(word)
+            sent = int(time.ticks_us())
+            index += 2
 
     def erase(self):
         if self.is_protect():
           raise Exception("This chip is write protected.")
         self._execute_command(_WREN)
         self._execute_command(_CE)
-        self._wait_ready()
+        self._wait_ready(CHIP_ERASE)
+
+    def get_page_size(self) -> int:
+        return _PAGE_SIZE
+
+    def set_skip_blank(self, skip_blank: bool):
+        self._skip_blank = skip_blank
 
-    def _wait_ready(self):
-        while (self._read_status() & _BUSY) != 0:
-            pass
+    def get_write_stats(self):
+        return (self._programmed_pages, self._skipped_pages)
+
+    def reset_write_stats(self):
+        self._programmed_pages = 0
+        self._skipped_pages = 0
+
+    def set_pipelined(self, pipelined: bool):
+        self._pipelined = pipelined
+        if not pipelined:
+            self._busy_waiter.wait_pending()
+
+    def sync(self):
+        self._busy_waiter.wait_pending()
+
+    def poll_pending(self) -> int:
+        return self._busy_waiter.poll_pending()
+
+    def get_wait_stats(self) -> list:
+        return self._busy_waiter.get_stats()
+
+    def reset_wait_stats(self):
+        self._busy_waiter.reset_stats()
+
+    def get_sector_size(self) -> int:
+        return _SECTOR_SIZE
+
+    def erase_sector(self, address: int):
+        if self.is_protect():
+          raise Exception("This chip is write protected.")
+        self._erase_block(_SE, address)
+
+    def erase_range(self, address: int, length: int):
+        if self.is_protect():
+          raise Exception("This chip is write protected.")
+        if address < 0 or address + length > self._capacity:
+            raise ValueError('The erase address is out of the accessible range.')
+        for command, block_address, _ in plan_erase(address, length, self._erase_types):
+            self._erase_block(command, block_address)
+
+    def _erase_block(self, command: int, address: int):
+        self._execute_command(_WREN)
+        buffer = self._setup_address(command, address)
+        self._spi_device.write(self._prefixes[4])
+        self._wait_ready(SECTOR_ERASE if command == _SE else BLOCK_ERASE)
+
+    def _wait_ready(self, operation: int):
+        if self._pipelined and operation != STATUS_WRITE:
+            self._busy_waiter.defer(operation)
+        else:
+            self._busy_waiter.wait(operation)
 
     def _setup_address(self, command:int, address:int) -> bytearray:
+        self._busy_waiter.wait_pending()
         buffer = self._buffer
         buffer[0] = command
         buffer[1] = (address >> 16) & 0xFF
@@ -140,11 +281,13 @@ class SST25VFxxxBSerialFlash(SerialFlash):
         return self._execute_command(_RDSR, 1)[0]
 
     def _execute_command(self, command: int, read_len: int = 0) -> bytearray:
+        if command != _RDSR:
+            self._busy_waiter.wait_pending()
         buffer = self._buffer
         buffer[0] = command
         if read_len == 0:
-            self._spi_device.write(buffer[:1])
+            self._spi_device.write(self._prefixes[1])
             return None
         else:
-            self._spi_device.write_read(buffer[:1], buffer[:read_len])
-            return buffer[:read_len]
+            self._spi_device.write_read(self._prefixes[1], self._prefixes[read_len])
+            return self._prefixes[read_len]
@@ -0,0 +1,97 @@
+import time
+
+def write_stream(flash, reader, address: int = 0, buffer_size: int = 4096, length: int = None, erase: bool = False,
+                 engines: list = None, progress = None, timeout_ms: int = 5000) -> tuple:
+    # Writes the bytes of reader (anything with readinto: a file, socket, UART, decompressor...)
+    # to flash from address until the reader ends (readinto returns 0) or length bytes have been
+    # written. Returns (bytes written, elapsed us, us spent in reader, us spent in flash).
+    # readinto returning None (a UART or non-blocking socket with nothing received yet) is
+    # retried; an Exception is raised when no data arrives for timeout_ms, or when the reader
+    # ends before length bytes.
+    # buffer_size is rounded down to whole pages (at least one). The first chunk only runs up to
+    # the first page boundary, so no page program is split between two chunks; the drivers
+    # handle the unaligned head and tail (and the odd ones the SST AAI program needs).
+    # The flash is pipelined: the next chunk is read into the other buffer while the last page
+    # of the current one is programming. With erase, each sector is erased before the first byte
+    # is written into it; the bytes of the first sector in front of address and of the last one
+    # behind the data are read before the erase and programmed back. The data is fed to engines
+    # (DigestEngine) and progress(address, length) is called for each chunk.
+    page_size = flash.get_page_size()
+    buffer_size = max(page_size, buffer_size // page_size * page_size)
+    capacity = flash.get_capacity()
+    if address < 0 or address > capacity:
+        raise ValueError('The write address is out of the accessible range.')
+    end = capacity if length == None else address + length
+    if end > capacity:
+        raise ValueError('The write address is out of the accessible range.')
+    sector_size = flash.get_sector_size()
+    erased_end = address // sector_size * sector_size
+    # The bytes behind the data in the last erased sector, at their offsets in the sector.
+    saved = memoryview(bytearray(sector_size)) if erase and flash.is_erasable() else None
+    buffers = (memoryview(bytearray(buffer_size)), memoryview(bytearray(buffer_size)))
+    index = 0
+    start_address = address
+    read_us = 0
+    flash_us = 0
+    start = time.ticks_us()
+    read_count = _fill(reader, buffers[0][:min(buffer_size - address % page_size, end - address)], timeout_ms)
+    read_us += time.ticks_diff(time.ticks_us(), start)
+    flash.set_pipelined(True)
+    try:
+        while read_count != 0:
+            data = buffers[index][:read_count]
+            if progress != None:
+                progress(address, read_count)
+            ticks = time.ticks_us()
+            if erase and address + read_count > erased_end:
+                erase_end = min(capacity, (address + read_count + sector_size - 1) // sector_size * sector_size)
+                head = None
+                tail_len = erase_end - address - read_count
+                if saved != None:
+                    if address > erased_end:
+                        head = bytearray(address - erased_end)
+                        flash.read(erased_end, head)
+                    if tail_len != 0:
+                        flash.read(address + read_count, saved[sector_size - tail_len:])
+                flash.erase_range(erased_end, erase_end - erased_end)
+                if head != None:
+                    flash.write(erased_end, head)
+                erased_end = erase_end
+            flash.write(address, data)
+            flash_us += time.ticks_diff(time.ticks_us(), ticks)
+            address += read_count
+            index ^= 1
+            ticks = time.ticks_us()
+            next_count = _fill(reader, buffers[index][:min(buffer_size, end - address)], timeout_ms) if address != end else 0
+            read_us += time.ticks_diff(time.ticks_us(), ticks)
+            if engines != None:
+                for engine in engines:
+                    engine.update(data)
+            read_count = next_count
+        if saved != None and address < erased_end:
+            flash.write(address, saved[sector_size - (erased_end - address):])
+    finally:
+        ticks = time.ticks_us()
+        flash.set_pipelined(False)
+        flash_us += time.ticks_diff(time.ticks_us(), ticks)
+    if length != None and address != end:
+        raise Exception('The reader ended after {0} of {1} bytes.'.format(address - start_address, length))
+    return (address - start_address, time.ticks_diff(time.ticks_us(), start), read_us, flash_us)
+
+def _fill(reader, buffer, timeout_ms: int) -> int:
+    # Sockets and UARTs return what has arrived, so short reads are retried until the buffer is
+    # full or the reader ends.
+    filled = 0
+    idle_start = time.ticks_ms()
+    while filled != len(buffer):
+        count = reader.readinto(buffer[filled:])
+        if count == None:
+            if time.ticks_diff(time.ticks_ms(), idle_start) > timeout_ms:
+                raise Exception('No data from the reader for {0} ms.'.format(timeout_ms))
+            time.sleep_ms(1)
+            continue
+        if count == 0:
+            break
+        filled += count
+        idle_start = time.ticks_ms()
+    return filled
@@ -0,0 +1,109 @@
+from micropython import const
+import time
+
+_ERASE_BLOCK_SIZE = const(65536)
+
+class SuspendScheduler:
+    # Runs queued erases and writes on a pipelined SerialFlash one command at a time while the
+    # application keeps reading. poll() starts the next command once the chip is free. A read()
+    # that arrives while a sector/block erase or page program is running suspends it, reads and
+    # resumes it, instead of waiting for it to finish (up to seconds for a block erase). Chips
+    # without suspend, chip erases and status writes are waited for. min_progress_us keeps
+    # back-to-back reads from starving the operation: a suspend waits until it has run that long
+    # since the last resume.
+    def __init__(self, flash, suspend: bool = True, min_progress_us: int = 0):
+        self._flash = flash
+        self._suspend = suspend
+        self._min_progress_us = min_progress_us
+        self._resumed = time.ticks_us()
+        # [address, remaining length, data (None for an erase)]
+        self._queue = []
+        self.reset_read_stats()
+        flash.set_pipelined(True)
+
+    def get_flash(self):
+        return self._flash
+
+    def erase_range(self, address: int, length: int):
+        if address < 0 or address + length > self._flash.get_capacity():
+            raise ValueError('The erase address is out of the accessible range.')
+        if length != 0:
+            self._queue.append([address, length, None])
+
+    def write(self, address: int, write_buffer):
+        # write_buffer must not change until the write has been done (is_idle()).
+        if address < 0 or address + len(write_buffer) > self._flash.get_capacity():
+            raise ValueError('The write address is out of the accessible range.')
+        if len(write_buffer) != 0:
+            self._queue.append([address, len(write_buffer), memoryview(write_buffer)])
+
+    def is_idle(self) -> bool:
+        return len(self._queue) == 0 and self._flash.poll_pending() == 0
+
+    def poll(self) -> int:
+        # Starts the next queued command if the chip is free. Returns 0 once everything queued
+        # has finished, otherwise the microseconds to wait before calling again.
+        wait_us = self._flash.poll_pending()
+        if wait_us != 0 or len(self._queue) == 0:
+            return wait_us
+        entry = self._queue[0]
+        address = entry[0]
+        length = entry[1]
+        data = entry[2]
+        if data == None:
+            # One 64 KB block or one sector per command.
+            sector_size = self._flash.get_sector_size()
+            if address % _ERASE_BLOCK_SIZE == 0 and length >= _ERASE_BLOCK_SIZE:
+                step = _ERASE_BLOCK_SIZE
+            else:
+                step = min(sector_size - address % sector_size, length)
+            self._flash.erase_range(address, step)
+        else:
+            page_size = self._flash.get_page_size()
+            step = min(page_size - address % page_size, length)
+            offset = len(data) - length
+            self._flash.write(address, data[offset: offset + step])
+        if step == length:
+            self._queue.pop(0)
+        else:
+            entry[0] = address + step
+            entry[1] = length - step
+        return max(1, self._flash.poll_pending())
+
+    def read(self, address: int, read_buffer):
+        start = time.ticks_us()
+        suspended = False
+        if self._suspend:
+            progress = time.ticks_diff(start, self._resumed)
+            if progress < self._min_progress_us:
+                time.sleep_us(self._min_progress_us - progress)
+            suspended = self._flash.suspend()
+        self._flash.read(address, read_buffer)
+        if suspended:
+            self._flash.resume()
+            self._resumed = time.ticks_us()
+            self._suspended_reads += 1
+        latency = time.ticks_diff(time.ticks_us(), start)
+        self._reads += 1
+        self._total_us += latency
+        if latency > self._max_us:
+            self._max_us = latency
+
+    def get_read_stats(self):
+        # Returns (reads, reads that suspended an operation, total us, max us) since the last reset.
+        return (self._reads, self._suspended_reads, self._total_us, self._max_us)
+
+    def reset_read_stats(self):
+        self._reads = 0
+        self._suspended_reads = 0
+        self._total_us = 0
+        self._max_us = 0
+
+    def close(self):
+        # Finishes everything queued and leaves pipelined mode.
+        while True:
+            wait_us = self.poll()
+            if wait_us == 0:
+                break
+            time.sleep_us(wait_us)
+        self._flash.set_pipelined(False)
@@ -1,50 +1,616 @@
 from micropython import const
-from machine import SPI
-import os
+from machine import SPI, freq
+import time
 import serial_flash_accessor
+# Feature modules (uasyncio, gang writing, profiling, journals, clock calibration, segmented
+# images, streaming) are imported by the functions that use them, so importing this module only
+# loads what every entry point needs.
+from serial_flash_accessor.buffer_util import needs_erase
+from serial_flash_accessor.flash_digest import DigestEngine, digest_flash, digest_file, to_hex
+from serial_flash_accessor.image_file import ImageFile
 
-def from_file(name: str, hint: str = None):
+_VERIFY_REGION_SIZE = const(65536)
+_SPI_ID = const(2)
+_CS_PIN_ID = 'Y5'
+# MISO of SPI(2); read only by chips that report busy on SO (SST25VF EBSY).
+_MISO_PIN_ID = 'Y7'
+# SPI(2) is clocked from APB1, the third entry of machine.freq().
+_SPI_CLOCK_INDEX = const(2)
+_CLOCK_CACHE_PATH = 'spi_clock.cache'
+_JOURNAL_SUFFIX = '.journal'
+# segmented_image.RAW
+_RAW_IMAGE = 'raw'
+# Verified regions before the journaled address that are checked again when resuming.
+_RESUME_VERIFY_REGIONS = const(2)
+
+def from_file(name: str, hint: str = None, differential: bool = False, algorithm: str = 'sha256', resume: bool = False,
+              compression: str = 'auto', window_bits: int = 0, profile: bool = False, image_format: str = 'auto'):
     buffer_size = const(1024)
-    flash = serial_flash_accessor.create_serial_flash(SPI(2), 'Y5', hint)
+    if image_format == 'auto':
+        from serial_flash_accessor.segmented_image import detect_image_format
+        image_format = detect_image_format(name)
+    if differential and resume:
+        print('Differential and resumed writes cannot be combined.')
+        return
+    if image_format != _RAW_IMAGE and (differential or resume):
+        print('Differential and resumed writes need a raw image.')
+        return
+    profiler = None
+    if profile:
+        from serial_flash_accessor.profiling_spi_device import ProfilingSpiDevice
+        profiler = ProfilingSpiDevice(SPI(_SPI_ID), _CS_PIN_ID, _MISO_PIN_ID)
+    flash = _open_flash(hint, profiler)
     if flash == None:
-        print('Unsupported flash memory')
         return
+    try:
+        if image_format != _RAW_IMAGE:
+            if _write_segmented(flash, name, image_format, algorithm, buffer_size, profiler):
+                print('Completed.')
+            return
+
+        with ImageFile(name, compression, window_bits) as file:
+            file_size = file.get_size()
+            if file.get_compression() != None:
+                print('Image    : {0} {1} bytes -> {2} bytes'.format(file.get_compression(), file.get_compressed_size(), file_size))
+            if file_size > flash.get_capacity():
+                print('Insufficient flash memory capacity.')
+                return
+
+            flash.reset_write_stats()
+            flash.reset_wait_stats()
+            if profiler != None:
+                profiler.reset_profile()
+            start = time.ticks_ms()
+            is_protect = flash.is_protect()
+            journal = None
+            if resume:
+                # The journal is written before anything is changed, so the protection found here
+                # is the one restored even if this run is interrupted after removing it.
+                from serial_flash_accessor.progress_journal import ProgressJournal
+                file_digests, image_digest = _digest_image(file, algorithm)
+                journal = ProgressJournal(name + _JOURNAL_SUFFIX, algorithm, to_hex(image_digest), file_size)
+                if journal.load():
+                    is_protect = journal.is_protected()
+                else:
+                    journal.save(False, 0, is_protect)
+            if flash.is_protect():
+                print('Remove memory protection.')
+                flash.set_protect(False)
+
+            if differential:
+                if not _write_differential(flash, file):
+                    return
+            elif journal != None:
+                if not _write_resumable(flash, file, file_size, journal, file_digests, buffer_size, algorithm):
+                    return
+                print('Digest   : {0} {1}'.format(algorithm, to_hex(image_digest)))
+            else:
+                if file_size != 0:
+                    _erase_range(flash, 0, file_size)
+                flash.set_skip_blank(True)
+                region_engine = DigestEngine(algorithm, _VERIFY_REGION_SIZE)
+                image_engine = DigestEngine(algorithm)
+                _write_all(flash, file, 0, file_size, buffer_size, [region_engine, image_engine])
+                print('Verifying...')
+                if not _verify_regions(region_engine.digests(), digest_flash(flash, 0, file_size, algorithm, _VERIFY_REGION_SIZE)):
+                    return
+                print('Digest   : {0} {1}'.format(algorithm, to_hex(image_engine.digests()[0])))
+            elapsed = max(1, time.ticks_diff(time.ticks_ms(), start))
+            print('Time     : {0} ms, {1} bytes/s'.format(elapsed, file_size * 1000 // elapsed), end='')
+            if file.get_compression() != None:
+                print(' ({0} bytes/s compressed)'.format(file.get_compressed_size() * 1000 // elapsed), end='')
+            print()
+            if profiler != None:
+                _print_profile(profiler)
+
+        _finish_write(flash, is_protect)
+        if journal != None:
+            journal.remove()
+        print('Completed.')
+    finally:
+        flash.close()
+
+def from_stream(reader, address: int = 0, hint: str = None, buffer_size: int = 4096, length: int = None,
+                erase: bool = False) -> tuple:
+    # Writes what reader (readinto: a socket, UART, decompressor...) yields to address; with erase,
+    # each sector is erased as the data reaches it. Returns the stats of write_stream, or None.
+    from serial_flash_accessor.stream_writer import write_stream
+    flash = _open_flash(hint)
+    if flash == None:
+        return None
+    try:
+        flash.reset_write_stats()
+        flash.reset_wait_stats()
+        is_protect = flash.is_protect()
+        if is_protect:
+            print('Remove memory protection.')
+            flash.set_protect(False)
+        flash.set_skip_blank(True)
+        stats = write_stream(flash, reader, address, buffer_size, length, erase, None, _print_writing)
+        elapsed = max(1, stats[1])
+        print('Time     : {0} ms, {1} bytes/s (reader {2} ms, flash {3} ms)'.format(
+            elapsed // 1000, stats[0] * 1000000 // elapsed, stats[2] // 1000, stats[3] // 1000))
+        _finish_write(flash, is_protect)
+        print('Completed.')
+        return stats
+    finally:
+        flash.close()
+
+async def from_file_async(name: str, hint: str = None, algorithm: str = 'sha256', compression: str = 'auto',
+                          window_bits: int = 0, lock = None) -> bool:
+    # from_file for uasyncio applications: erases, writes and verifies without blocking other
+    # tasks. lock (an asyncio.Lock) guards the SPI bus if other tasks use it too.
+    from serial_flash_accessor.async_flash import AsyncSerialFlash, asyncio
+    buffer_size = const(1024)
+    if lock == None:
+        lock = asyncio.Lock()
+    async with lock:
+        flash = _open_flash(hint)
+    if flash == None:
+        return False
+    async_flash = AsyncSerialFlash(flash, lock)
+    try:
+        with ImageFile(name, compression, window_bits) as file:
+            file_size = file.get_size()
+            if file_size > flash.get_capacity():
+                print('Insufficient flash memory capacity.')
+                return False
+            flash.reset_write_stats()
+            start = time.ticks_ms()
+            async with lock:
+                is_protect = flash.is_protect()
+                if is_protect:
+                    print('Remove memory protection.')
+                    flash.set_protect(False)
+
+            if file_size != 0:
+                print('Erasing: 0x{0:06x}-0x{1:06x}'.format(0, file_size - 1))
+                await async_flash.erase_range_async(0, file_size)
+            flash.set_skip_blank(True)
+            region_engine = DigestEngine(algorithm, _VERIFY_REGION_SIZE)
+            image_engine = DigestEngine(algorithm)
+            buffer = memoryview(bytearray(buffer_size))
+            address = 0
+            while True:
+                read_count = file.readinto(buffer)
+                if read_count == 0:
+                    break
+                data = buffer[:read_count]
+                print('Writing: 0x{0:06x}-0x{1:06x}'.format(address, address + read_count - 1))
+                await async_flash.write_async(address, data)
+                region_engine.update(data)
+                image_engine.update(data)
+                address += read_count
+
+            print('Verifying...')
+            flash_engine = DigestEngine(algorithm, _VERIFY_REGION_SIZE)
+            for address in range(0, file_size, buffer_size):
+                data = buffer[:min(buffer_size, file_size - address)]
+                await async_flash.read_async(address, data)
+                flash_engine.update(data)
+            if not _verify_regions(region_engine.digests(), flash_engine.digests()):
+                return False
+            print('Digest   : {0} {1}'.format(algorithm, to_hex(image_engine.digests()[0])))
+            elapsed = max(1, time.ticks_diff(time.ticks_ms(), start))
+            print('Time     : {0} ms, {1} bytes/s'.format(elapsed, file_size * 1000 // elapsed))
+        write_stats = flash.get_write_stats()
+        print('Pages    : {0} programmed, {1} skipped (blank)'.format(write_stats[0], write_stats[1]))
+        await async_flash.sync_async()
+        if is_protect:
+            print('Restore memory protection.')
+            async with lock:
+                flash.set_protect(True)
+    finally:
+        await async_flash.close_async()
+        async with lock:
+            flash.close()
+    print('Completed.')
+    return True
+
+def gang_from_file(name: str, devices: list, hint: str = None, algorithm: str = 'sha256',
+                   compression: str = 'auto', window_bits: int = 0) -> list:
+    # Writes the image to several identical chips at once. devices is a list of (SPI bus or bus
+    # id, CS pin id[, MISO pin id]); chips may share a bus. Returns True/False for each device.
+    buffer_size = const(4096)
+    labels = []
+    flashes = []
+    for device in devices:
+        spi = SPI(device[0]) if isinstance(device[0], int) else device[0]
+        spi_device = serial_flash_accessor.SpiDevice(spi, device[1], device[2] if len(device) > 2 else None)
+        flash = serial_flash_accessor.registry.create(spi_device, hint)
+        label = 'Chip {0} ({1})'.format(len(labels), device[1])
+        if flash != None:
+            _apply_cached_clock(flash, spi_device)
+        print('{0}: {1}'.format(label, flash.get_name() if flash != None else 'Unsupported flash memory'))
+        labels.append(label)
+        flashes.append(flash)
+    detected = [flash for flash in flashes if flash != None]
+    if len(detected) == 0:
+        return [False] * len(devices)
+
+    # Chips left open by an exception are closed, so none stays pipelined or in 4-byte mode.
+    unclosed = list(detected)
+    try:
+        with ImageFile(name, compression, window_bits) as file:
+            file_size = file.get_size()
+            from serial_flash_accessor.gang_writer import GangWriter
+            gang = GangWriter(detected)
+            indexes = [index for index in range(len(flashes)) if flashes[index] != None]
+            protects = []
+            for gang_index in range(len(detected)):
+                flash = detected[gang_index]
+                protects.append(False)
+                if flash.get_name() != detected[0].get_name():
+                    gang.fail(gang_index, 'differs from {0}'.format(detected[0].get_name()))
+                elif file_size > flash.get_capacity():
+                    gang.fail(gang_index, 'insufficient capacity')
+                else:
+                    protects[gang_index] = flash.is_protect()
+                    if protects[gang_index]:
+                        flash.set_protect(False)
+                    flash.set_skip_blank(True)
+                    flash.reset_write_stats()
+            start = time.ticks_ms()
+            if file_size != 0:
+                print('Erasing: 0x{0:06x}-0x{1:06x}'.format(0, file_size - 1))
+                gang.erase_range(0, file_size)
+
+            region_engine = DigestEngine(algorithm, _VERIFY_REGION_SIZE)
+            buffer = memoryview(bytearray(buffer_size))
+            address = 0
+            while True:
+                read_count = file.readinto(buffer)
+                if read_count == 0:
+                    break
+                print('Writing: 0x{0:06x}-0x{1:06x}'.format(address, address + read_count - 1))
+                gang.write(address, buffer[:read_count])
+                region_engine.update(buffer[:read_count])
+                address += read_count
+
+            print('Verifying...')
+            file_digests = region_engine.digests()
+            chip_digests = gang.digests(0, file_size, algorithm, _VERIFY_REGION_SIZE)
+            for gang_index in range(len(detected)):
+                if chip_digests[gang_index] == None:
+                    continue
+                for region in range(len(file_digests)):
+                    if chip_digests[gang_index][region] != file_digests[region]:
+                        region_address = region * _VERIFY_REGION_SIZE
+                        gang.fail(gang_index, 'verify error at 0x{0:06x}-0x{1:06x}'.format(region_address, region_address + _VERIFY_REGION_SIZE - 1))
+                        break
+            gang.close()
+            elapsed = max(1, time.ticks_diff(time.ticks_ms(), start))
+            print('Time     : {0} ms, {1} bytes/s per chip'.format(elapsed, file_size * 1000 // elapsed))
+
+        results = [False] * len(devices)
+        for index in range(len(flashes)):
+            if flashes[index] == None:
+                print('{0}: FAILED (not detected)'.format(labels[index]))
+                continue
+            gang_index = indexes.index(index)
+            if protects[gang_index]:
+                try:
+                    detected[gang_index].set_protect(True)
+                except Exception as exception:
+                    gang.fail(gang_index, 'protection not restored ({0})'.format(exception))
+            try:
+                detected[gang_index].close()
+                unclosed.remove(detected[gang_index])
+            except Exception as exception:
+                gang.fail(gang_index, 'not closed ({0})'.format(exception))
+            error = gang.get_errors()[gang_index]
+            if error == None:
+                write_stats = detected[gang_index].get_write_stats()
+                print('{0}: OK, {1} pages programmed, {2} skipped'.format(labels[index], write_stats[0], write_stats[1]))
+                results[index] = True
+            else:
+                print('{0}: FAILED ({1})'.format(labels[index], error))
+    finally:
+        for flash in unclosed:
+            try:
+                flash.close()
+            except Exception:
+                pass
+    print('Completed.')
+    return results
+
+def to_file(name: str, start: int = 0, length: int = None, hint: str = None, algorithm: str = 'sha256'):
+    # Dumps the flash (all of it from start by default) into a file, e.g. to back up a chip or
+    # capture a golden image; the digest can be checked later with verify_digest.
+    buffer_size = const(8192)
+    flash = _open_flash(hint)
+    if flash == None:
+        return
+    try:
+        if length == None:
+            length = flash.get_capacity() - start
+        if start < 0 or length < 0 or start + length > flash.get_capacity():
+            print('The range is out of the flash memory.')
+            return
+        engine = DigestEngine(algorithm)
+        address = start
+        begin = time.ticks_ms()
+        with open(name, 'wb') as file:
+            for chunk in flash.read_chunks(start, length, buffer_size):
+                if address % _VERIFY_REGION_SIZE == 0 or address == start:
+                    print('Reading: 0x{0:06x}-0x{1:06x}'.format(address, min(start + length, address + _VERIFY_REGION_SIZE - address % _VERIFY_REGION_SIZE) - 1))
+                file.write(chunk)
+                engine.update(chunk)
+                address += len(chunk)
+        elapsed = max(1, time.ticks_diff(time.ticks_ms(), begin))
+        print('Digest   : {0} {1}'.format(algorithm, to_hex(engine.digests()[0])))
+        print('Time     : {0} ms, {1} bytes/s'.format(elapsed, length * 1000 // elapsed))
+        print('Completed.')
+    finally:
+        flash.close()
+
+def verify_file(name: str, hint: str = None, algorithm: str = 'sha256', compression: str = 'auto', window_bits: int = 0) -> bool:
+    flash = _open_flash(hint)
+    if flash == None:
+        return False
+    try:
+        with ImageFile(name, compression, window_bits) as file:
+            file_size = file.get_size()
+            if file_size > flash.get_capacity():
+                print('Insufficient flash memory capacity.')
+                return False
+            file_digests = digest_file(file, algorithm, _VERIFY_REGION_SIZE)
+        print('Verifying: 0x{0:06x}-0x{1:06x}'.format(0, file_size - 1))
+        if not _verify_regions(file_digests, digest_flash(flash, 0, file_size, algorithm, _VERIFY_REGION_SIZE)):
+            return False
+        print('Completed.')
+        return True
+    finally:
+        flash.close()
+
+def verify_digest(expected: str, length: int = None, hint: str = None, address: int = 0, algorithm: str = 'sha256') -> bool:
+    flash = _open_flash(hint)
+    if flash == None:
+        return False
+    try:
+        if length == None:
+            length = flash.get_capacity() - address
+        if address < 0 or length < 0 or address + length > flash.get_capacity():
+            print('The address is out of the accessible range.')
+            return False
+        print('Verifying: 0x{0:06x}-0x{1:06x}'.format(address, address + length - 1))
+        actual = to_hex(digest_flash(flash, address, length, algorithm)[0])
+        print('Digest   : {0} {1}'.format(algorithm, actual))
+        if actual != expected.lower():
+            print('Verify error')
+            return False
+        print('Completed.')
+        return True
+    finally:
+        flash.close()
+
+def calibrate_clock(hint: str = None, address: int = None) -> int:
+    # Finds the fastest SPI clock the wiring sustains and caches it for the chip's JEDEC ID; later
+    # runs start at that clock. With address, the sector there is used as scratch and its data is
+    # lost; otherwise the data at the start of the chip is read back, which must not be blank.
+    from serial_flash_accessor.clock_calibration import ClockCache, calibrate
+    spi_device = serial_flash_accessor.SpiDevice(SPI(_SPI_ID), _CS_PIN_ID, _MISO_PIN_ID)
+    flash = _open_flash(hint, spi_device, False)
+    if flash == None:
+        return 0
+    try:
+        if address != None and flash.is_protect():
+            print('The flash memory is write protected.')
+            return 0
+        try:
+            baudrate = calibrate(flash, spi_device, freq()[_SPI_CLOCK_INDEX], address)
+        except ValueError as error:
+            print(error)
+            return 0
+        if baudrate == 0:
+            print('No reliable clock')
+            return 0
+        ClockCache(_CLOCK_CACHE_PATH).save(ClockCache.get_key(flash), baudrate)
+        print('Clock    : {0} Hz (calibrated)'.format(baudrate))
+        print('Completed.')
+        return baudrate
+    finally:
+        flash.close()
+
+def _open_flash(hint: str, spi_device = None, cached_clock: bool = True):
+    from serial_flash_accessor.clock_calibration import get_effective_baudrate
+    if spi_device == None:
+        spi_device = serial_flash_accessor.SpiDevice(SPI(_SPI_ID), _CS_PIN_ID, _MISO_PIN_ID)
+    flash = serial_flash_accessor.registry.create(spi_device, hint)
+    if flash == None:
+        print('Unsupported flash memory')
+        return None
     jedec_id = flash.get_jedec_id()
     print('JEDEC ID : {0}'.format(' '.join(['0x{0:02X}'.format(d) for d in jedec_id]) if jedec_id != None else 'None'))
     print('Vendor   : {0}'.format(flash.get_vendor()))
     print('Name     : {0}'.format(flash.get_name()))
     print('Capacity : {0} bytes'.format(flash.get_capacity()))
+    baudrate = _apply_cached_clock(flash, spi_device) if cached_clock else 0
+    print('Clock    : {0} Hz{1}'.format(get_effective_baudrate(spi_device.get_frequency(), freq()[_SPI_CLOCK_INDEX]),
+                                        ' (calibrated)' if baudrate != 0 else ''))
+    return flash
 
-    file_stat = os.stat(name)
-    file_size = file_stat[6]
-    if file_size > flash.get_capacity():
-        print('Insufficient flash memory capacity.')
-        return
+def _apply_cached_clock(flash, spi_device) -> int:
+    # The driver sets the datasheet maximum; a calibrated clock for this chip lowers it. Returns
+    # the cached baudrate, or 0.
+    from serial_flash_accessor.clock_calibration import ClockCache
+    baudrate = ClockCache(_CLOCK_CACHE_PATH).load(ClockCache.get_key(flash))
+    if baudrate != 0:
+        spi_device.set_frequency(min(baudrate, spi_device.get_frequency()))
+    return baudrate
+
+def _print_profile(profiler):
+    elapsed = profiler.get_elapsed_us()
+    print('Command     Count    Out bytes   In bytes       us')
+    spi_us = 0
+    transactions = 0
+    for row in profiler.get_profile():
+        print('{0:9} {1:7} {2:12} {3:10} {4:8}'.format(row[0], row[1], row[2], row[3], row[4]))
+        spi_us += row[4]
+        if row[0] != 'RY/BY#':
+            transactions += row[1]
+    print('SPI      : {0} transactions, {1} CS assertions, {2} us'.format(transactions, profiler.get_cs_assertions(), spi_us))
+    print('Other    : {0} us (busy-wait sleeps, file I/O, hashing)'.format(elapsed - spi_us))
 
-    is_protect = flash.is_protect()
+def _verify_regions(expected_digests: list, actual_digests: list) -> bool:
+    result = True
+    for index in range(len(expected_digests)):
+        if expected_digests[index] != actual_digests[index]:
+            address = index * _VERIFY_REGION_SIZE
+            print('Verify error: 0x{0:06x}-0x{1:06x}'.format(address, address + _VERIFY_REGION_SIZE - 1))
+            result = False
+    return result
+
+def _finish_write(flash, is_protect: bool):
+    write_stats = flash.get_write_stats()
+    print('Pages    : {0} programmed, {1} skipped (blank)'.format(write_stats[0], write_stats[1]))
+    for wait_stats in flash.get_wait_stats():
+        print('Wait     : {0} x{1}, {2} polls, average {3} us, max {4} us'.format(
+            wait_stats[0], wait_stats[1], wait_stats[2], wait_stats[3] // wait_stats[1], wait_stats[4]))
     if is_protect:
-        print('Remove memory protection.')
-        flash.set_protect(False)
-
-    print('Erasing...')
-    flash.erase()
-
-    with open(name, 'r') as file:
-        file_buffer = memoryview(bytearray(buffer_size))
-        read_buffer = memoryview(bytearray(buffer_size))
-        address = 0
-        while True:
-            read_count = file.readinto(file_buffer)
-            if read_count == 0:
-                if is_protect:
-                    print('Restore memory protection.')
-                    flash.set_protect(True)
-                print('Completed.')
-                return
+        print('Restore memory protection.')
+        flash.set_protect(True)
+
+def _write_segmented(flash, name: str, image_format: str, algorithm: str, buffer_size: int, profiler) -> bool:
+    # Erases, programs and verifies only the ranges the segments cover. Segments are merged into
+    # bursts that start a new page program only where the image has a gap of a page or more (any
+    # gap on a chip without an erase), and every sector the bursts touch is erased before the
+    # first burst is programmed.
+    from serial_flash_accessor.segmented_image import SegmentedImage, merge_segments, get_erase_ranges
+    with SegmentedImage(name, image_format) as image:
+        bursts = merge_segments(image.get_segments(), flash.get_page_size(), flash.is_erasable())
+        burst_size = sum([burst[1] for burst in bursts])
+        print('Image    : {0} {1} segments, {2} bytes in {3} bursts'.format(
+            image_format, len(image.get_segments()), image.get_size(), len(bursts)))
+        if len(bursts) != 0 and bursts[-1][0] + bursts[-1][1] > flash.get_capacity():
+            print('Insufficient flash memory capacity.')
+            return False
+
+        flash.reset_write_stats()
+        flash.reset_wait_stats()
+        if profiler != None:
+            profiler.reset_profile()
+        start = time.ticks_ms()
+        is_protect = flash.is_protect()
+        if is_protect:
+            print('Remove memory protection.')
+            flash.set_protect(False)
+
+        for erase_range in get_erase_ranges(bursts, flash.get_sector_size()):
+            _erase_range(flash, erase_range[0], erase_range[1])
+        flash.set_skip_blank(True)
+        burst_digests = []
+        for burst in bursts:
+            engine = DigestEngine(algorithm)
+            _write_all(flash, image.open_burst(burst), burst[0], burst[1], buffer_size, [engine])
+            burst_digests.append(engine.digests()[0])
+        print('Verifying...')
+        result = True
+        for index in range(len(bursts)):
+            address = bursts[index][0]
+            length = bursts[index][1]
+            if digest_flash(flash, address, length, algorithm)[0] != burst_digests[index]:
+                print('Verify error: 0x{0:06x}-0x{1:06x}'.format(address, address + length - 1))
+                result = False
+        if not result:
+            return False
+        elapsed = max(1, time.ticks_diff(time.ticks_ms(), start))
+        print('Time     : {0} ms, {1} bytes/s'.format(elapsed, burst_size * 1000 // elapsed))
+        if profiler != None:
+            _print_profile(profiler)
+
+    _finish_write(flash, is_protect)
+    return True
+
+def _erase_range(flash, address: int, length: int):
+    sector_size = flash.get_sector_size()
+    erase_end = (address + length + sector_size - 1) // sector_size * sector_size
+    print('Erasing: 0x{0:06x}-0x{1:06x}'.format(address, erase_end - 1))
+    flash.erase_range(address, length)
+
+def _digest_image(file, algorithm: str):
+    # (region digests, whole image digest) of the file in one pass; leaves the file at its start.
+    region_engine = DigestEngine(algorithm, _VERIFY_REGION_SIZE)
+    image_engine = DigestEngine(algorithm)
+    buffer = memoryview(bytearray(4096))
+    while True:
+        read_count = file.readinto(buffer)
+        if read_count == 0:
+            file.seek(0)
+            return (region_engine.digests(), image_engine.digests()[0])
+        region_engine.update(buffer[:read_count])
+        image_engine.update(buffer[:read_count])
+
+def _write_resumable(flash, file, file_size: int, journal, file_digests: list, buffer_size: int, algorithm: str) -> bool:
+    # Writes and verifies one region at a time and records each verified region in the journal.
+    # A resumed run checks the last regions again, erases from the first one that does not
+    # match up to the end of the region that was being written, and continues from there.
+    address = journal.get_verified_address()
+    if journal.is_erased():
+        rewrite_end = min(file_size, address + _VERIFY_REGION_SIZE)
+        if address != 0:
+            start = max(0, address - _RESUME_VERIFY_REGIONS * _VERIFY_REGION_SIZE)
+            print('Resuming: verifying 0x{0:06x}-0x{1:06x}'.format(start, address - 1))
+            actual_digests = digest_flash(flash, start, address - start, algorithm, _VERIFY_REGION_SIZE)
+            for index in range(len(actual_digests)):
+                if actual_digests[index] != file_digests[start // _VERIFY_REGION_SIZE + index]:
+                    address = start + index * _VERIFY_REGION_SIZE
+                    break
+            print('Resuming: 0x{0:06x}'.format(address))
+        if address != rewrite_end:
+            _erase_range(flash, address, rewrite_end - address)
+    elif file_size != 0:
+        _erase_range(flash, 0, file_size)
+        journal.save(True, 0, journal.is_protected())
+
+    flash.set_skip_blank(True)
+    file.seek(address)
+    while address != file_size:
+        length = min(_VERIFY_REGION_SIZE, file_size - address)
+        _write_all(flash, file, address, length, buffer_size, [])
+        if digest_flash(flash, address, length, algorithm)[0] != file_digests[address // _VERIFY_REGION_SIZE]:
+            print('Verify error: 0x{0:06x}-0x{1:06x}'.format(address, address + length - 1))
+            return False
+        address += length
+        journal.save(True, address, journal.is_protected())
+    return True
+
+def _write_all(flash, file, address: int, length: int, buffer_size: int, engines: list):
+    # Writes length bytes from the current file position to address and feeds them to engines
+    # (DigestEngine), so verification only has to read the flash once.
+    from serial_flash_accessor.stream_writer import write_stream
+    write_stream(flash, file, address, buffer_size, length, False, engines, _print_writing)
+
+def _print_writing(address: int, length: int):
+    print('Writing: 0x{0:06x}-0x{1:06x}'.format(address, address + length - 1))
+
+def _write_differential(flash, file) -> bool:
+    sector_size = flash.get_sector_size()
+    file_buffer = memoryview(bytearray(sector_size))
+    read_buffer = memoryview(bytearray(sector_size))
+    address = 0
+    skipped = 0
+    while True:
+        read_count = file.readinto(file_buffer)
+        if read_count == 0:
+            print('Skipped  : {0} sectors'.format(skipped))
+            return True
+        data = file_buffer[:read_count]
+        current = read_buffer[:read_count]
+        flash.read(address, current)
+        if data == current:
+            skipped += 1
+        else:
+            if needs_erase(current, data):
+                print('Erasing: 0x{0:06x}-0x{1:06x}'.format(address, address + sector_size - 1))
+                flash.erase_sector(address)
+                flash.set_skip_blank(True)
+            else:
+                flash.set_skip_blank(False)
             print('Writing: 0x{0:06x}-0x{1:06x}'.format(address, address + read_count - 1))
-            flash.write(address, file_buffer[:read_count])
-            flash.read(address, read_buffer[:read_count])
-            if file_buffer != read_buffer:
+            flash.write(address, data)
+            flash.read(address, current)
+            if data != current:
                 print('Verify error')
-                return
-            address += read_count
+                return False
+        address += read_count